@@ -5,82 +5,17 @@ import numpy as np
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
 import torch.nn.functional as F
 import cv2
-from collections import deque
+from common.replay_buffer import PrioritizedReplayBuffer
+from common.train_utils import make_adam, soft_update
+from common.metrics import MetricsAccumulator
 
 def init(module, weight_init, bias_init, gain=1):
     weight_init(module.weight.data, gain=gain)
     bias_init(module.bias.data)
     return module
 
-class ReplayBuffer(object):
-    def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
-
-    def push(self, state, action, reward, next_state, done):
-
-        self.buffer.append((state, action, reward, next_state , done))
-
-    def sample(self, batch_size):
-        state, action, reward, next_state, done = zip(*random.sample(self.buffer, batch_size))
-
-        return np.array(state), np.array(action), np.array(reward),np.array(next_state), np.array(done)
-
-    def __len__(self):
-        return len(self.buffer)
-
-
-class NaivePrioritizedBuffer(object):
-    def __init__(self, capacity, prob_alpha=0.6):
-        self.prob_alpha = prob_alpha
-        self.capacity = capacity
-        self.buffer = []
-        self.pos = 0
-        self.priorities = np.zeros((capacity,), dtype=np.float32)
-
-    def push(self, state, action, reward, next_state, done):
-
-        max_prio = self.priorities.max() if self.buffer else 1.0
-
-        if len(self.buffer) < self.capacity:
-            self.buffer.append((state, action, reward, next_state, done))
-        else:
-            self.buffer[self.pos] = (state, action, reward, next_state, done)
-
-        self.priorities[self.pos] = max_prio
-        self.pos = (self.pos + 1) % self.capacity
-
-    def sample(self, batch_size, beta=0.4):
-        if len(self.buffer) == self.capacity:
-            prios = self.priorities
-        else:
-            prios = self.priorities[:self.pos]
-
-        probs = prios ** self.prob_alpha
-        probs /= probs.sum()
-
-        indices = np.random.choice(len(self.buffer), batch_size, p=probs)
-        samples = [self.buffer[idx] for idx in indices]
-
-        total = len(self.buffer)
-        weights = (total * probs[indices]) ** (-beta)
-        weights /= weights.max()
-        weights = np.array(weights, dtype=np.float32)
-
-        state, action, reward, next_state, done = zip(*samples)
-
-        return state, action, reward, next_state, done, indices, weights
-
-    def update_priorities(self, batch_indices, batch_priorities):
-        for idx, prio in zip(batch_indices, batch_priorities):
-            self.priorities[idx] = prio
-
-    def __len__(self):
-        return len(self.buffer)
-
-
 class MLPDQN(nn.Module):
     def __init__(self,input_shape,num_actions,hidden,device):
         super(MLPDQN,self).__init__()
@@ -164,12 +99,8 @@ class CnnDQN(nn.Module):
         return action
 
 def compute_td_loss(replay_buffer,batch_size,device):
+    # the buffer hands back tensors already on `device`
     state, action, reward, next_state, done = replay_buffer.sample(batch_size)
-    state = torch.FloatTensor(state).to(device)
-    next_state = torch.FloatTensor(next_state).to(device)
-    action = torch.LongTensor(action).to(device)
-    reward = torch.FloatTensor(reward).to(device)
-    done = torch.FloatTensor(done).to(device)
 
     q_values = current_model(state)
     next_q_values = current_model(next_state)
@@ -194,12 +125,12 @@ def compute_td_loss(replay_buffer,batch_size,device):
 def compute_td_loss_per(replay_buffer,batch_size, beta,device):
     state, action, reward, next_state, done, indices, weights = replay_buffer.sample(batch_size,beta)
 
-    state = torch.FloatTensor(state).to(device)
-    next_state = torch.FloatTensor(next_state).to(device)
-    action =torch.LongTensor(action).to(device)
-    reward = torch.FloatTensor(reward).to(device)
-    done = torch.FloatTensor(done).to(device)
-    weights = torch.FloatTensor(weights).to(device)
+    state = torch.as_tensor(state, device=device).float()
+    next_state = torch.as_tensor(next_state, device=device).float()
+    action = torch.as_tensor(action, device=device)
+    reward = torch.as_tensor(reward, device=device)
+    done = torch.as_tensor(done, device=device)
+    weights = torch.as_tensor(weights, device=device)
 
 
     q_values = current_model(state)
@@ -221,24 +152,13 @@ def compute_td_loss_per(replay_buffer,batch_size, beta,device):
     optimizer.step()
 
     return loss
-def soft_update(current_model, target_model, tau=0.01):
-    """
-    Perform DDPG soft update (move target params toward source based on weight
-    factor tau)
-    Inputs:
-        target (torch.nn.Module): Net to copy parameters to
-        source (torch.nn.Module): Net whose parameters to copy
-        tau (float, 0 < x < 1): Weight factor for update
-    """
-    for target_param, param in zip(target_model.parameters(), current_model.parameters()):
-        target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
-
 
 
 USE_CUDA = torch.cuda.is_available()
 env = gym.make("PongNoFrameskip-v4")
-from tensorboardX import SummaryWriter
-logger = SummaryWriter("results/PongNoFrameskip-v4/dqn/logs")
+from common.scalar_writer import ScalarWriter
+logger = ScalarWriter("results/PongNoFrameskip-v4/dqn/logs")
+metrics = MetricsAccumulator(logger, flush_every=100)
 
 epsilon_start = 0.9
 epsilon_final = 0.005
@@ -250,11 +170,11 @@ beta_frames = 100000
 beta_by_frame = lambda frame_idx: min(1.0, beta_start + frame_idx * (1.0 - beta_start) / beta_frames)
 
 
+ob_shape = (3,210,160)
 if USE_CUDA:
     device = torch.device("cuda:0")
     #current_model = MLPDQN(env.observation_space.shape[0], env.action_space.n,128,device).to(device)
     #target_model = MLPDQN(env.observation_space.shape[0], env.action_space.n,128,device).to(device)
-    ob_shape = (3,210,160)
     current_model = CnnDQN(ob_shape, env.action_space.n,device).to(device)
     target_model = CnnDQN(ob_shape, env.action_space.n,device).to(device)
 
@@ -265,11 +185,11 @@ else:
 target_model.load_state_dict(current_model.state_dict())
 target_model.eval()
 
-optimizer = optim.Adam(current_model.parameters(), lr=0.0001)
+optimizer = make_adam(current_model.parameters(), lr=0.0001)
 
 replay_initial = 5000
-#replay_buffer = ReplayBuffer(1000)
-replay_buffer = NaivePrioritizedBuffer(50000)
+#replay_buffer = ReplayBuffer(1000, ob_shape, device=device)
+replay_buffer = PrioritizedReplayBuffer(50000, ob_shape)
 
 num_frames = 1000000
 batch_size = 32
@@ -311,14 +231,13 @@ for frame_idx in range(1, num_frames + 1):
         print("update at ",frame_idx)
         beta = beta_by_frame(frame_idx)
         loss = compute_td_loss_per(replay_buffer,batch_size,beta,device)
-        logger.add_scalars('value_loss',
-                                {'value_loss': loss},
-                                frame_idx)
+        metrics.add('value_loss', loss)
+        metrics.step(frame_idx)
 
     #if frame_idx % 1000 == 0:
     #    target_model.load_state_dict(current_model.state_dict())
 
-    soft_update(current_model, target_model)
+    soft_update(current_model, target_model, 0.01)
     '''
     if episode_nums % save_epis == 0:
         torch.save({
@@ -4,8 +4,6 @@
 import numpy as np
 import random
 
-import operator
-
 
 class SegmentTree(object):
     def __init__(self, capacity, operation, neutral_element):
@@ -15,25 +13,28 @@ class SegmentTree(object):
         important differences:
             a) setting item's value is slightly slower.
                It is O(lg capacity) instead of O(1).
-            b) user has access to an efficient `reduce`
-               operation which reduces `operation` over
-               a contiguous subsequence of items in the
-               array.
+            b) user has access to an efficient ( O(log segment size) )
+               `reduce` operation which reduces `operation` over
+               a contiguous subsequence of items in the array.
+        The tree is stored in a flat float64 numpy array, so both
+        item assignment and lookup accept either a single index or
+        an array of indexes; a batch of leaves is propagated to the
+        root one tree level at a time.
         Paramters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
-            must for a mathematical group together with the set of
-            possible values for array elements.
-        neutral_element: obj
+        operation: np.ufunc
+            and operation for combining elements (eg. np.add, np.minimum)
+            must form a mathematical group together with the set of
+            possible values for array elements (i.e. be associative)
+        neutral_element: float
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
@@ -71,22 +72,35 @@ class SegmentTree(object):
         if end < 0:
             end += self._capacity
         end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        return float(self._reduce_helper(start, end, 1, 0, self._capacity - 1))
 
     def __setitem__(self, idx, val):
-        # index of the leaf
-        idx += self._capacity
+        if np.ndim(idx) == 0:
+            # index of the leaf
+            idx = int(idx) + self._capacity
+            self._value[idx] = val
+            idx //= 2
+            while idx >= 1:
+                self._value[idx] = self._operation(
+                    self._value[2 * idx],
+                    self._value[2 * idx + 1]
+                )
+                idx //= 2
+            return
+        # indexes of the leaves; they all sit at the same depth,
+        # so the whole batch climbs towards the root together
+        idx = np.asarray(idx, dtype=np.int64) + self._capacity
         self._value[idx] = val
-        idx //= 2
-        while idx >= 1:
+        for _ in range(self._capacity.bit_length() - 1):
+            idx //= 2
             self._value[idx] = self._operation(
                 self._value[2 * idx],
                 self._value[2 * idx + 1]
             )
-            idx //= 2
 
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
+        idx = np.asarray(idx, dtype=np.int64)
+        assert np.all(0 <= idx) and np.all(idx < self._capacity)
         return self._value[self._capacity + idx]
 
 
@@ -94,7 +108,7 @@ class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -110,29 +124,31 @@ class SumSegmentTree(SegmentTree):
         probability efficiently.
         Parameters
         ----------
-        perfixsum: float
-            upperbound on the sum of array prefix
+        perfixsum: float or np.array
+            upperbound on the sum of array prefix, or a batch of them
         Returns
         -------
-        idx: int
-            highest index satisfying the prefixsum constraint
+        idx: int or np.array
+            highest index satisfying the prefixsum constraint, with the
+            same shape as `prefixsum`
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        prefixsum = np.array(prefixsum, dtype=np.float64)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        for _ in range(self._capacity.bit_length() - 1):  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = left <= prefixsum
+            prefixsum -= np.where(go_right, left, 0.0)
+            idx = 2 * idx + go_right
+        idx -= self._capacity
+        return int(idx) if idx.ndim == 0 else idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
@@ -172,10 +188,10 @@ class ReplayBuffer(object):
         for i in idxes:
             data = self._storage[i]
             obs_t, action, reward, obs_tp1, done = data
-            obses_t.append(np.array(obs_t, copy=False))
-            actions.append(np.array(action, copy=False))
+            obses_t.append(np.asarray(obs_t))
+            actions.append(np.asarray(action))
             rewards.append(reward)
-            obses_tp1.append(np.array(obs_tp1, copy=False))
+            obses_tp1.append(np.asarray(obs_tp1))
             dones.append(done)
         return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
 
@@ -238,13 +254,9 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_min[idx] = self._max_priority ** self._alpha
 
     def _sample_proportional(self, batch_size):
-        res = []
-        for _ in range(batch_size):
-            # TODO(szymon): should we ensure no repeats?
-            mass = random.random() * self._it_sum.sum(0, len(self._storage) - 1)
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        # TODO(szymon): should we ensure no repeats?
+        mass = np.random.random(batch_size) * self._it_sum.sum(0, len(self._storage) - 1)
+        return self._it_sum.find_prefixsum_idx(mass)
 
     def sample(self, batch_size, beta):
         """Sample a batch of experiences.
@@ -282,15 +294,12 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
         idxes = self._sample_proportional(batch_size)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
+        p_total = self._it_sum.sum()
+        p_min = self._it_min.min() / p_total
         max_weight = (p_min * len(self._storage)) ** (-beta)
 
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        p_sample = self._it_sum[idxes] / p_total
+        weights = (p_sample * len(self._storage)) ** (-beta) / max_weight
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
@@ -307,11 +316,12 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             transitions at the sampled idxes denoted by
             variable `idxes`.
         """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities, dtype=np.float64)
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        assert np.all(priorities > 0)
+        assert np.all(0 <= idxes) and np.all(idxes < len(self._storage))
+        self._it_sum[idxes] = priorities ** self._alpha
+        self._it_min[idxes] = priorities ** self._alpha
 
-            self._max_priority = max(self._max_priority, priority)
\ No newline at end of file
+        self._max_priority = max(self._max_priority, float(priorities.max()))
\ No newline at end of file
@@ -1,18 +1,26 @@
 from copy import deepcopy
-import itertools
-from torch.optim import Adam
 import collections
+import json
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions.normal import Normal
 from common.utils import *
+from common.nstep import NStepTransitionAssembler
+from common.train_utils import make_adam, TargetUpdater, backward_to
+from common.metrics import MetricsAccumulator, mean_grad_norm
+from algorithm.attention import CNNAttention
 from gym_airsim.envs.AirGym import AirSimEnv
-from tensorboardX import SummaryWriter
+from gym_airsim.surrogate import AirSimSurrogateEnv
+from common.scalar_writer import ScalarWriter
+from common.checkpoint import CheckpointManager, load_checkpoint
+from common.trajectory import TrajectoryRecorder, to_uint8
 from tqdm import trange
 from pathlib import Path
 from torch.distributions import Categorical,Independent
-import cv2
+from torch.func import stack_module_state, functional_call, vmap
+from common.lazy import lazy_import
+cv2 = lazy_import('cv2')
 import numpy as np
 
 
@@ -64,19 +72,103 @@ class ReplayBuffer:
                      done=torch.as_tensor(self.done_buf[idxs], dtype=torch.float32).to(device))
         return {k: v for k, v in batch.items()}
 
+    def flush(self):
+        pass
 
 
-def get_p_and_g_mean_norm(it):
+class MemmapReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer whose arrays are np.memmap files in ``path`` (a raw <name>.bin
+    per array plus meta.json with ptr/size), so the replay survives a
+    crash and can be larger than RAM. Opening an existing ``path`` continues
+    from the flushed contents.
+
+    ``flush`` (every ``flush_every`` stores, and before checkpoints) writes the
+    dirty pages, then the metadata, so meta.json never points past data that
+    is on disk.
+
+    ``block_size > 1`` samples batch_size // block_size runs of consecutive
+    transitions, read in file order: far fewer page faults / disk seeks when
+    the buffer does not fit in the page cache, at the cost of correlated
+    samples within a run. ``obs_dtype=np.uint8`` (sac's default) stores the
+    depth images, rounded with to_uint8, in a quarter of the space.
+    """
+    fields = ('obs_buf', 'inform_buf', 'obs2_buf', 'inform2_buf', 'act_buf', 'rew_buf', 'done_buf')
+
+    def __init__(self, obs_dim, act_dim, size, path, flush_every=1000, block_size=1,
+                 obs_dtype=np.float32):
+        self.path = str(path)
+        self.flush_every = flush_every
+        self.block_size = block_size
+        os.makedirs(self.path, exist_ok=True)
+        obs_dtype = np.dtype(obs_dtype).name
+        specs = {'obs_buf': (combined_shape(size, obs_dim), obs_dtype),
+                 'inform_buf': (combined_shape(size, INCORPORATE), 'float32'),
+                 'obs2_buf': (combined_shape(size, obs_dim), obs_dtype),
+                 'inform2_buf': (combined_shape(size, INCORPORATE), 'float32'),
+                 'act_buf': (combined_shape(size, act_dim), 'float32'),
+                 'rew_buf': ((size,), 'float32'),
+                 'done_buf': ((size,), 'float32')}
+
+        meta = self._read_meta()
+        if meta is not None:
+            stored = {k: (tuple(shape), dtype) for k, (shape, dtype) in meta['specs'].items()}
+            if stored != specs:
+                raise ValueError("replay buffer in {} has a different layout: {} != {}"
+                                 .format(self.path, stored, specs))
+        for name in self.fields:
+            shape, dtype = specs[name]
+            setattr(self, name, np.memmap(os.path.join(self.path, name + '.bin'), dtype=dtype,
+                                          mode='r+' if meta is not None else 'w+', shape=shape))
+        self.specs = specs
+        self.ptr, self.size, self.max_size = 0, 0, size
+        if meta is not None:
+            self.ptr, self.size = meta['ptr'], meta['size']
+        self._unflushed = 0
 
-    size = 1e-8
-    su_p = 0
-    su_g = 0
-    for x in it:
-        if x.grad is None:continue
-        size += 1.
-        su_p += x.norm()
-        su_g += x.grad.norm()
-    return su_p / size, su_g / size
+    def _read_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def store(self, obs, act, rew, next_obs, done):
+        if self.obs_buf.dtype == np.uint8:
+            # round the 0-255 float depth frames rather than truncate them
+            obs, next_obs = [to_uint8(obs[0]), obs[1]], [to_uint8(next_obs[0]), next_obs[1]]
+        super().store(obs, act, rew, next_obs, done)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for name in self.fields:
+            getattr(self, name).flush()
+        meta = dict(ptr=self.ptr, size=self.size,
+                    specs={k: (list(shape), dtype) for k, (shape, dtype) in self.specs.items()})
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self._unflushed = 0
+
+    def sample_batch(self, batch_size=32, device=torch.device("cpu")):
+        if self.block_size > 1:
+            starts = np.random.randint(0, self.size, size=-(-batch_size // self.block_size))
+            idxs = (starts[:, None] + np.arange(self.block_size)).ravel()[:batch_size] % self.size
+        else:
+            idxs = np.random.choice(self.size, size=batch_size, replace=False)
+        # ascending offsets: sequential reads / readahead on the memmapped files
+        idxs = np.sort(idxs)
+        batch = dict(obs=[torch.as_tensor(self.obs_buf[idxs], dtype=torch.float32).to(device),
+                          torch.as_tensor(self.inform_buf[idxs], dtype=torch.float32).to(device)],
+                     obs2=[torch.as_tensor(self.obs2_buf[idxs], dtype=torch.float32).to(device),
+                           torch.as_tensor(self.inform2_buf[idxs], dtype=torch.float32).to(device)],
+                     act=torch.as_tensor(self.act_buf[idxs], dtype=torch.float32).to(device),
+                     rew=torch.as_tensor(self.rew_buf[idxs], dtype=torch.float32).to(device),
+                     done=torch.as_tensor(self.done_buf[idxs], dtype=torch.float32).to(device))
+        return batch
 
 
 def init(module, weight_init, bias_init, gain=1):
@@ -88,71 +180,40 @@ class Flatten(nn.Module):
     def forward(self, x):
         return x.contiguous().view(x.size(0), -1)
 
-class CNNAttention(nn.Module):
-    def __init__(self,size, name ="sa"):
-        super(CNNAttention,self).__init__()
-
-        init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
-                               constant_(x, 0), np.sqrt(2))
-
-        self.w_qs=init_(nn.Conv2d(size, size//8, 1))
-        self.w_ks=init_(nn.Conv2d(size, size//8, 1))
-        self.w_vs=init_(nn.Conv2d(size, size, 1))
-        self.gamma = nn.Parameter(torch.zeros(1))
-        self.name = name
-
-    def forward(self,inputs):
-
-        Batch=inputs.shape[0]
-        output_size=inputs.shape[2]*inputs.shape[3]
-        # NCHW-->N,C,H*W-->N,H*W,C
-        q=self.w_qs(inputs).view(Batch,-1,output_size).permute(0,2,1) # N,H*W,C
-
-        k = self.w_ks(inputs).view(Batch,-1,output_size)# N,C,H*W
-
-        v = self.w_vs(inputs).view(Batch,-1,output_size)# N,C,H*W
-
-        attn = torch.bmm(q, k) #N,H*W,H*W
-
-        attn=F.softmax(attn,dim=-1)
-
-        # N,C,H*W
-        out = torch.bmm(v, attn.permute(0, 2, 1))
-        out=out.view(*inputs.shape)
-
-        out= self.gamma*out + inputs
-
-        return out
+def conv_encoder(num_inputs, sattn=False, name="enc"):
+    """Conv stack mapping a (num_inputs, 112, 112) image scaled to [0, 1] to 800 features."""
+    init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
+                           constant_(x, 0), nn.init.calculate_gain('relu'))
+    if sattn:
+        return nn.Sequential(
+            init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
+            CNNAttention(16, name = name + "_l1"),
+            init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
+            CNNAttention(32, name = name + "_l2"),
+            init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
+            init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
+            Flatten(),
+        )
+    return nn.Sequential(
+        init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
+        init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
+        init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
+        init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
+        Flatten(),
+    )
 
 class Actor(nn.Module):
 
     def __init__(self, obs_dim, act_dim, hidden_size, activation, act_limit=None,
-                 discrete=False, sattn = False):
+                 discrete=False, sattn = False, encoder=True):
         super().__init__()
 
         init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
                                constant_(x, 0), nn.init.calculate_gain('relu'))
 
-        num_inputs = obs_dim[0]
         self.discrete = discrete
-        if sattn:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                CNNAttention(16, name = "ac_l1"),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                CNNAttention(32, name = "ac_l2"),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-        else:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
+        # without an own encoder, obs[0] holds features from SACActorCritic.encoder
+        self.layer1 = conv_encoder(obs_dim[0], sattn, "ac") if encoder else None
         self.layer2 = nn.Sequential(init_(nn.Linear(INCORPORATE, 64)),
                                     nn.ReLU(),
                                     )
@@ -178,14 +239,17 @@ class Actor(nn.Module):
 
         # self.train()
 
+    def encode(self, img):
+        if self.layer1 is None:
+            return img
+        return self.layer1(img / 255.0)
+
     def evaluate(self,obs):
         img = obs[0]
         inform = obs[1]
 
-        x = img / 255.0
-
         #######TO:(N,C,H,W)
-        x = self.layer1(x)
+        x = self.encode(img)
         inform = self.layer2(inform)
         x = torch.cat((x, inform), -1)
 
@@ -205,10 +269,8 @@ class Actor(nn.Module):
             img = obs[0]
             inform = obs[1]
 
-            x = img / 255.0
-
             #######TO:(N,C,H,W)
-            x = self.layer1(x)
+            x = self.encode(img)
             inform = self.layer2(inform)
             x = torch.cat((x, inform), -1)
 
@@ -232,10 +294,8 @@ class Actor(nn.Module):
             img = obs[0]
             inform = obs[1]
 
-            x = img / 255.0
-
             #######TO:(N,C,H,W)
-            x = self.layer1(x)
+            x = self.encode(img)
             inform = self.layer2(inform)
             x = torch.cat((x, inform), -1)
 
@@ -265,31 +325,14 @@ class Actor(nn.Module):
 
 class Qfunc(nn.Module):
     def __init__(self, obs_dim, act_dim, hidden_size, activation, discrete=False,
-                 sattn=False):
+                 sattn=False, encoder=True):
         super().__init__()
         init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
                                constant_(x, 0), nn.init.calculate_gain('relu'))
 
-        num_inputs = obs_dim[0]
         self.discrete = discrete
-        if sattn:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                CNNAttention(16, name = "q_l1"),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                CNNAttention(32, name = "q_l2"),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-        else:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
+        # without an own encoder, obs[0] holds features from SACActorCritic.encoder
+        self.layer1 = conv_encoder(obs_dim[0], sattn, "q") if encoder else None
 
         if discrete:
             self.layer2 = nn.Sequential(init_(nn.Linear(INCORPORATE, 64)),
@@ -308,14 +351,17 @@ class Qfunc(nn.Module):
                                     init_(nn.Linear(hidden_size, 1))
                                     )
 
+    def encode(self, img):
+        if self.layer1 is None:
+            return img
+        return self.layer1(img / 255.0)
+
     def evaluate(self, obs):
         img = obs[0]
         inform = obs[1]
 
-        x = img / 255.0
-
         #######TO:(N,C,H,W)
-        x = self.layer1(x)
+        x = self.encode(img)
         inform = self.layer2(inform)
         x = torch.cat((x, inform), -1)
 
@@ -323,16 +369,17 @@ class Qfunc(nn.Module):
 
         return q
 
-    def forward(self, obs, act):
+    def forward(self, obs, act=None):
+        # act=None gives the per-action values of evaluate(), for QEnsemble
+        if act is None:
+            return self.evaluate(obs)
 
         if self.discrete:
             img = obs[0]
             inform = obs[1]
 
-            x = img / 255.0
-
             #######TO:(N,C,H,W)
-            x = self.layer1(x)
+            x = self.encode(img)
             inform = self.layer2(inform)
             x = torch.cat((x, inform), -1)
 
@@ -344,10 +391,8 @@ class Qfunc(nn.Module):
             img = obs[0]
             inform = obs[1]
 
-            x = img / 255.0
-
             #######TO:(N,C,H,W)
-            x = self.layer1(x)
+            x = self.encode(img)
 
             x = torch.cat((x, inform), -1)
 
@@ -359,7 +404,35 @@ class Qfunc(nn.Module):
 
             return q.squeeze(-1)
 
+class QEnsemble(nn.Module):
+    """
+    num_q Qfunc critics evaluated in a single vmapped call. Their parameters are
+    stacked along a leading ensemble dim (one tensor per layer), so forward and
+    evaluate return (num_q, N) / (num_q, N, act_dim) and the optimizer and
+    polyak update see as many tensors as a single critic has.
+    """
+    def __init__(self, num_q, *args, **kwargs):
+        super().__init__()
+        qs = [Qfunc(*args, **kwargs) for _ in range(num_q)]
+        params, _ = stack_module_state(qs)
+        self.num_q = num_q
+        self.names = list(params)
+        self.params = nn.ParameterDict({n.replace('.', '_'): nn.Parameter(p) for n, p in params.items()})
+        # stateless template for functional_call, kept out of the module tree
+        self.__dict__['base'] = qs[0].to('meta')
+
+    def forward(self, obs, act=None):
+        params = {n: self.params[n.replace('.', '_')] for n in self.names}
+        call = lambda p, o, a: functional_call(self.base, p, (o, a))
+        return vmap(call, in_dims=(0, None, None))(params, obs, act)
+
+    def evaluate(self, obs):
+        return self(obs)
+
 class SACActorCritic(nn.Module):
+    # class attribute so modules unpickled from older checkpoints get it too
+    shared_encoder = False
+
     def __init__(self,
                  observation_space,
                  action_space,
@@ -367,208 +440,296 @@ class SACActorCritic(nn.Module):
                  sattn = True,
                  hidden_size=512,
                  activation=nn.ReLU,
+                 shared_encoder=False,
+                 num_q=2,
                  ):
         super().__init__()
         obs_dim=observation_space.shape
 
+        # one conv stack for pi and the critics, trained by the critic loss only
+        self.shared_encoder = shared_encoder
+        if shared_encoder:
+            self.encoder = conv_encoder(obs_dim[0], sattn, "enc").to(device)
+        own = not shared_encoder
+
         if action_space.__class__.__name__ == "Box":
             act_dim = action_space.shape[0]
             act_limit = action_space.high[0]
-            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, act_limit, sattn=sattn).to(device)
-            self.q1 = Qfunc(obs_dim, act_dim, hidden_size, activation, sattn=sattn).to(device)
-            self.q2 = Qfunc(obs_dim, act_dim, hidden_size, activation, sattn=sattn).to(device)
+            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, act_limit, sattn=sattn, encoder=own).to(device)
+            self.q = QEnsemble(num_q, obs_dim, act_dim, hidden_size, activation, sattn=sattn, encoder=own).to(device)
 
         else:
             act_dim = action_space.n
-            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
-            self.q1 = Qfunc(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
-            self.q2 = Qfunc(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
+            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn, encoder=own).to(device)
+            self.q = QEnsemble(num_q, obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn, encoder=own).to(device)
 
+    def encode(self, obs):
+        """[img, inform] -> [features, inform] with a shared encoder, else obs unchanged."""
+        if not self.shared_encoder:
+            return obs
+        return [self.encoder(obs[0] / 255.0), obs[1]]
 
     def act(self, obs, deterministic=False):
         with torch.no_grad():
-            a, _ = self.pi(obs, deterministic, False)
+            a, _ = self.pi(self.encode(obs), deterministic, False)
             return a.cpu().numpy()
 
 
-def sac(device, seed=1, total_steps=int(510000), replay_size=int(150000), gamma=0.99,
-        polyak=0.995, lr=5e-4, alpha=0.2, batch_size=256, start_steps=5000,
-        update_after=10000, update_every=50, save_freq=3000, sattn= True):
-    ##310000-->410000  1e5--->3e5
-    torch.manual_seed(seed)
-    np.random.seed(seed)
+def load_actor_critic(path, device):
+    """Load an actor_model_*.pt: a pickled SACActorCritic (older runs) or a
+    common.checkpoint state dict saved together with its constructor config."""
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+    if isinstance(checkpoint['model'], nn.Module):
+        return checkpoint['model']
+    ac = SACActorCritic(device=device, **checkpoint['config'])
+    ac.load_state_dict(checkpoint['model'])
+    return ac
 
-    env = AirSimEnv(need_render=False)
-    #env = gym.make("HalfCheetah-v2")
-    env.seed(seed)
 
-    model_dir = Path('./results') / 'AirSimEnv-v42'/ 'SAC'
-    if not model_dir.exists():
-        curr_run = 'run1'
-    else:
-        exst_run_nums = [int(str(folder.name).split('run')[1]) for folder in model_dir.iterdir() if
-                         str(folder.name).startswith('run')]
-        if len(exst_run_nums) == 0:
-            curr_run = 'run1'
-        else:
-            curr_run = 'run%i' % (max(exst_run_nums) + 1)
-
-    run_dir = model_dir / curr_run
-    log_dir = run_dir / 'logs'
-    save_dir = run_dir / 'models'
-    os.makedirs(str(log_dir))
-    os.makedirs(str(save_dir))
-    best_sr=0
-
-    # Create actor-critic module and target networks
-    ac = SACActorCritic(env.observation_space, env.action_space, device = device, sattn=sattn)
-
-    # Freeze target networks with respect to optimizers (only update via polyak averaging)
-    ac_target = deepcopy(ac)
-    for p in ac_target.parameters():
-        p.requires_grad = False
-
-    q_params = itertools.chain(ac.q1.parameters(),ac.q2.parameters())
-    # Experience buffer
-    obs_dim = env.observation_space.shape
-
-    if env.action_space.__class__.__name__ == "Box":
-        act_dim = env.action_space.shape[0]
-        discrete = False
-
-    else:
-        act_dim = 1
-        discrete = True
-
-    replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+def make_update(ac, ac_target, discrete, discount, alpha=0.2, polyak=0.995, lr=5e-4,
+                num_q=2, num_q_min=2, compile=False, cql_alpha=0.):
+    """
+    Build the SAC gradient step ``update(data, metrics, t)`` for ``ac`` and its
+    polyak-averaged copy ``ac_target``. ``discount`` bootstraps the stored
+    (n-step) returns. With ``compile`` the two losses, which include the policy
+    and critic forwards, go through torch.compile. ``cql_alpha > 0`` adds the
+    CQL(H) penalty ``logsumexp_a Q(s, a) - Q(s, a_data)`` to the critic loss,
+    for training from a fixed dataset (discrete actions only).
+    """
+    assert discrete or not cql_alpha, "the CQL penalty is implemented for discrete actions"
+    shared_encoder = ac.shared_encoder
+    # lists, not generators: they are walked by both optimizers and backward_to
+    q_params = list(ac.q.parameters())
+    if shared_encoder:
+        q_params += list(ac.encoder.parameters())
+    pi_params = list(ac.pi.parameters())
+    target_updater = TargetUpdater(ac, ac_target)
+
+    # Bootstrap from the min over a random subset of num_q_min target critics
+    # (REDQ); with num_q_min == num_q this is the usual clipped double-Q.
+    def min_target(q_targ):
+        if num_q_min < num_q:
+            q_targ = q_targ[torch.randperm(num_q, device=q_targ.device)[:num_q_min]]
+        return q_targ.min(dim=0)[0]
 
     # Set up function for computing SAC Q-losses
+    # also returns data['obs'] after ac.encode, so it is encoded once per update
     def compute_loss_q(data):
-        o, a, r, o2, d = data['obs'], data['act'], data['rew'], data['obs2'], data['done']
+        a, r, o2, d = data['act'], data['rew'], data['obs2'], data['done']
+        o = ac.encode(data['obs'])
 
-        q1 = ac.q1(o,a)
-        q2 = ac.q2(o,a)
+        if cql_alpha:
+            q_all = ac.q.evaluate(o)
+            q = q_all.gather(-1, a.long().expand(q_all.shape[0], -1, -1)).squeeze(-1)
+        else:
+            q = ac.q(o,a)
 
         # Bellman backup for Q functions
         if discrete:
             with torch.no_grad():
-                dist,probs,_ = ac.pi.evaluate(o2)
-                q1_targ = ac_target.q1.evaluate(o2)
-                q2_targ = ac_target.q2.evaluate(o2)
-                q_target = torch.min(q1_targ,q2_targ)
+                o2_targ = ac_target.encode(o2)
+                dist,probs,_ = ac.pi.evaluate(ac.encode(o2))
+                q_target = min_target(ac_target.q.evaluate(o2_targ))
                 v = (probs*q_target).sum(dim=-1)+alpha*dist.entropy()
 
-                backup = r + gamma * (1 - d) *v
+                backup = r + discount * (1 - d) *v
+                entropy = dist.entropy().mean()
 
         else:
 
             with torch.no_grad():
                 # Target actions come from *current* policy
-                a2, logp_a2 = ac.pi(o2)
+                a2, logp_a2 = ac.pi(ac.encode(o2))
 
                 # Target Q-values
-                q1_pi_targ = ac_target.q1(o2, a2)
-                q2_pi_targ = ac_target.q2(o2, a2)
-                q_pi_targ = torch.min(q1_pi_targ,q2_pi_targ)
-                backup = r + gamma * (1 - d) * (q_pi_targ - alpha * logp_a2)
+                o2_targ = ac_target.encode(o2)
+                q_pi_targ = min_target(ac_target.q(o2_targ, a2))
+                backup = r + discount * (1 - d) * (q_pi_targ - alpha * logp_a2)
+                entropy = -logp_a2.mean()
 
         # MSE loss against Bellman backup
-        loss_q1 = ((q1 - backup) ** 2).mean()
-        loss_q2 = ((q2 - backup) ** 2).mean()
-        loss_q = loss_q1+loss_q2
+        loss_q = ((q - backup) ** 2).mean(dim=1).sum()
+        if cql_alpha:
+            # push down Q on all actions, up on the dataset's
+            loss_q = loss_q + cql_alpha * (torch.logsumexp(q_all, dim=-1) - q).mean(dim=1).sum()
 
-        return loss_q, dist.entropy().mean()
+        return loss_q, entropy, o
+
+    # The policy maximizes the min over critics, or their mean when targets
+    # use a subset (REDQ).
+    def reduce_q(q):
+        return q.min(dim=0)[0] if num_q_min == num_q else q.mean(dim=0)
 
     # Set up function for computing SAC pi loss
-    def compute_loss_pi(data):
-        o = data['obs']
+    def compute_loss_pi(o):
 
         if discrete:
             _, probs, log_prob = ac.pi.evaluate(o)
 
-            q1 = ac.q1.evaluate(o)
-            q2 = ac.q2.evaluate(o)
-
-            q_min = torch.min(q1, q2)
+            q_min = reduce_q(ac.q.evaluate(o))
             loss_pi = (probs * (-q_min + alpha * log_prob)).sum(dim=-1).mean()
         else:
             pi, logp_pi = ac.pi(o)
-            q1_pi = ac.q1(o,pi)
-            q2_pi = ac.q2(o, pi)
-            q_pi = torch.min(q1_pi,q2_pi)
+            q_pi = reduce_q(ac.q(o,pi))
 
             # Entropy-regularized policy loss
             loss_pi = (alpha * logp_pi - q_pi).mean()
 
         return loss_pi
 
+    if compile:
+        if hasattr(torch, 'compile'):
+            # replay batches always have batch_size rows: one static graph per loss
+            compute_loss_q = torch.compile(compute_loss_q, dynamic=False)
+            compute_loss_pi = torch.compile(compute_loss_pi, dynamic=False)
+        else:
+            # the losses close over vmapped critics and sample from distributions,
+            # which TorchScript cannot script or trace; stay eager
+            print("torch.compile needs torch >= 2.0, running the SAC losses eagerly")
+
     # Set up optimizers for policy and q-function
-    pi_optimizer = Adam(ac.pi.parameters(), lr=lr)
-    q_optimizer = Adam(q_params, lr=lr)
-
-
-    def update(data,logger,t):
-        # First run one gradient descent step for Q1 and Q2
-        q_optimizer.zero_grad()
-        loss_q, entropy = compute_loss_q(data)
-        logger.add_scalars('value_loss',
-                                {'value_loss': loss_q.item()},
-                                t)
-        loss_q.backward()
-        '''
-        norm, grad_norm = get_p_and_g_mean_norm(ac.q1.parameters())
-        logger.add_scalars('q1_grad_norm',
-                           {'q1_grad_norm': grad_norm},
-                           t)
-        norm, grad_norm = get_p_and_g_mean_norm(ac.q2.parameters())
-        logger.add_scalars('q2_grad_norm',
-                           {'q2_grad_norm': grad_norm},
-                           t)
-        logger.add_scalars('entropy',
-                           {'entropy': entropy.detach()},
-                           t)
-        '''
+    pi_optimizer = make_adam(pi_params, lr=lr)
+    q_optimizer = make_adam(q_params, lr=lr)
+
+    # metrics is a common.metrics.MetricsAccumulator: losses and norms are
+    # summed on-device and written out every metrics.flush_every updates
+    def update(data,metrics,t):
+        # First run one gradient descent step for the critics
+        q_optimizer.zero_grad(set_to_none=True)
+        loss_q, entropy, o = compute_loss_q(data)
+        backward_to(loss_q, q_params)
+        metrics.add('value_loss', loss_q)
+        metrics.add('q_grad_norm', mean_grad_norm(q_params))
+        metrics.add('entropy', entropy)
         #nn.utils.clip_grad_norm_(q_params, 5)
         q_optimizer.step()
 
-        # Freeze Q-networks so you don't waste computational effort
-        # computing gradients for them during the policy learning step.
-        for p in q_params:
-            p.requires_grad = False
-
-        # Next run one gradient descent step for pi.
-        pi_optimizer.zero_grad()
-        loss_pi = compute_loss_pi(data)
-        loss_pi.backward()
-        '''
-        norm, grad_norm = get_p_and_g_mean_norm(ac.pi.parameters())
-        logger.add_scalars('pi_grad_norm',
-                           {'pi_grad_norm': grad_norm},
-                           t)
-        '''
+        # Next run one gradient descent step for pi. Only pi_params receive
+        # gradients, so no effort is wasted on the (unchanged) Q-networks.
+        pi_optimizer.zero_grad(set_to_none=True)
+        # the actor sees the shared features detached, so only critics train the encoder
+        loss_pi = compute_loss_pi([o[0].detach(), o[1]] if shared_encoder else o)
+        backward_to(loss_pi, pi_params)
+        metrics.add('pi_grad_norm', mean_grad_norm(pi_params))
         #nn.utils.clip_grad_norm_(ac.pi.parameters(), 5)
 
         pi_optimizer.step()
 
-        # Unfreeze Q-networks so you can optimize it at next DDPG step.
-        for p in q_params:
-            p.requires_grad = True
-
         # Finally, update target networks by polyak averaging.
-        with torch.no_grad():
-            for p, p_targ in zip(ac.parameters(), ac_target.parameters()):
-                # NB: We use an in-place operations "mul_", "add_" to update target
-                # params, as opposed to "mul" and "add", which would make new tensors.
-                p_targ.data.mul_(polyak)
-                p_targ.data.add_((1 - polyak) * p.data)
+        target_updater.soft(1 - polyak)
+        metrics.step(t)
+
+    # exposed for checkpointing
+    update.optimizers = {'pi_optimizer': pi_optimizer, 'q_optimizer': q_optimizer}
+    return update
+
+def sac(device, seed=1, total_steps=int(510000), replay_size=int(150000), gamma=0.99,
+        polyak=0.995, lr=5e-4, alpha=0.2, batch_size=256, start_steps=5000,
+        update_after=10000, update_every=50, save_freq=3000, sattn= True, n_step=1,
+        shared_encoder=None, num_q=2, num_q_min=2, compile=False, resume=None, keep_last=3,
+        replay_on_disk=False, replay_block_size=1, replay_obs_dtype='uint8', record=False,
+        pretrained=None, surrogate=False):
+    """
+    num_q critics, bootstrapped from the min of num_q_min of them (REDQ). Each
+    critic without a shared encoder runs its own conv stack, so an update costs
+    about num_q / 2 times the double-Q one (4.4x for 10 critics on CPU);
+    shared_encoder (one conv stack trained by the critic loss, the default for
+    num_q > 2) keeps 10 critics at about 1.2x.
+    """
+    ##310000-->410000  1e5--->3e5
+    if shared_encoder is None:
+        shared_encoder = num_q > 2
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    # surrogate: the NumPy stand-in for the simulator (gym_airsim.surrogate)
+    env = AirSimSurrogateEnv() if surrogate else AirSimEnv(need_render=False)
+    #env = gym.make("HalfCheetah-v2")
+    env.seed(seed)
+
+    model_dir = Path('./results') / 'AirSimEnv-v42'/ 'SAC'
+    if not model_dir.exists():
+        curr_run = 'run1'
+    else:
+        exst_run_nums = [int(str(folder.name).split('run')[1]) for folder in model_dir.iterdir() if
+                         str(folder.name).startswith('run')]
+        if len(exst_run_nums) == 0:
+            curr_run = 'run1'
+        else:
+            curr_run = 'run%i' % (max(exst_run_nums) + 1)
+
+    # resume: continue the run in that directory from its latest checkpoint
+    run_dir = Path(resume) if resume is not None else model_dir / curr_run
+    log_dir = run_dir / 'logs'
+    save_dir = run_dir / 'models'
+    os.makedirs(str(log_dir), exist_ok=resume is not None)
+    os.makedirs(str(save_dir), exist_ok=resume is not None)
+    if record:
+        # every episode also goes to run_dir/trajectories for offline training
+        env = TrajectoryRecorder(env, run_dir / 'trajectories')
+
+    # Create actor-critic module and target networks
+    ac = SACActorCritic(env.observation_space, env.action_space, device = device, sattn=sattn,
+                        shared_encoder=shared_encoder, num_q=num_q)
+
+    # Freeze target networks with respect to optimizers (only update via polyak averaging)
+    ac_target = deepcopy(ac)
+    for p in ac_target.parameters():
+        p.requires_grad = False
+
+    if pretrained is not None:
+        # e.g. an actor_model_<t>.pt from offline_sac.py
+        checkpoint = load_checkpoint(pretrained, device)
+        online = dict(sattn=sattn, shared_encoder=shared_encoder, num_q=num_q)
+        stored = {k: checkpoint['config'][k] for k in online if k in checkpoint.get('config', {})}
+        if any(online[k] != v for k, v in stored.items()):
+            raise ValueError("{} was trained with {}, this run builds {}; pass the same "
+                             "sattn / shared_encoder / num_q".format(pretrained, stored, online))
+        ac.load_state_dict(checkpoint['model'])
+        ac_target.load_state_dict(checkpoint.get('ac_target', checkpoint['model']))
+
+    # Experience buffer
+    obs_dim = env.observation_space.shape
+
+    if env.action_space.__class__.__name__ == "Box":
+        act_dim = env.action_space.shape[0]
+        discrete = False
+
+    else:
+        act_dim = 1
+        discrete = True
+
+    if replay_on_disk:
+        # memmapped under the run dir, so --resume also gets the replay back
+        replay_buffer = MemmapReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size,
+                                           path=run_dir / 'replay', block_size=replay_block_size,
+                                           obs_dtype=replay_obs_dtype)
+    else:
+        replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    # stored rewards are n-step returns, so bootstrap with gamma ** n_step
+    nstep = NStepTransitionAssembler(n_step, gamma)
+
+    update = make_update(ac, ac_target, discrete, nstep.discount, alpha, polyak, lr,
+                         num_q, num_q_min, compile)
 
     def get_action(o, deterministic=False):
         return ac.act([torch.as_tensor(o[0], dtype=torch.float32).unsqueeze(0).to(device),
                             torch.as_tensor(o[1], dtype=torch.float32).unsqueeze(0).to(device)],
                       deterministic)
 
+    # periodic checkpoints (last keep_last) and the best success rate are
+    # written as actor_model_<t>.pt / actor_model_best.pt by a background thread
+    checkpoints = CheckpointManager(save_dir, keep_last=keep_last, prefix='actor_model')
+    checkpoints.best_score = 0
+    train_state = dict(model=ac, ac_target=ac_target, **update.optimizers)
+    # constructor arguments, for load_actor_critic
+    config = dict(observation_space=env.observation_space, action_space=env.action_space,
+                  sattn=sattn, shared_encoder=shared_encoder, num_q=num_q)
+
     # Prepare for interaction with environment
-    logger = SummaryWriter(str(log_dir))
+    logger = ScalarWriter(str(log_dir))
+    # one flush per round of update_every//5 gradient steps
+    metrics = MetricsAccumulator(logger, flush_every=max(1, update_every//5))
     o = env.reset()
     ep_ret = 0
     ep_len = 0
@@ -576,8 +737,24 @@ def sac(device, seed=1, total_steps=int(510000), replay_size=int(150000), gamma=
     rews_deque = collections.deque(maxlen=100)
     steps_deque = collections.deque(maxlen=100)
     success_deque = collections.deque(maxlen=100)
+    start_t = 0
+    checkpoint = checkpoints.load() if resume is not None else None
+    if checkpoint is not None:
+        extra = checkpoints.restore(train_state, checkpoint)
+        start_t, num_epi = extra['step'] + 1, extra['num_epi']
+        rews_deque, steps_deque, success_deque = \
+            extra['rews_deque'], extra['steps_deque'], extra['success_deque']
+        print("resumed from step", extra['step'])
+        if replay_buffer.size < update_after:
+            # the in-RAM replay is not checkpointed: refill it before updating again
+            update_after = start_t + update_after
+
+    def save_extra():
+        return dict(config=config, num_epi=num_epi, rews_deque=rews_deque,
+                    steps_deque=steps_deque, success_deque=success_deque)
+
     # Main loop: collect experience in env and update/log each epoch
-    for t in trange(total_steps):
+    for t in trange(start_t, total_steps):
 
         # Until start_steps have elapsed, randomly sample actions
         # from a uniform distribution for better exploration. Afterwards,
@@ -602,12 +779,10 @@ def sac(device, seed=1, total_steps=int(510000), replay_size=int(150000), gamma=
 
         if env.stepN==1 and d:
             print("WTF!")
-            pass
+            nstep.reset()
         else:
-            if discrete:
-                replay_buffer.store(o, a, r, o2, d)
-            else:
-                replay_buffer.store(o,a[0],r,o2,d)
+            for transition in nstep.push(o, a if discrete else a[0], r, o2, d):
+                replay_buffer.store(*transition)
         img = o[0]
         img = np.hstack(img)
         img = np.array(img, dtype=np.uint8)
@@ -641,27 +816,49 @@ def sac(device, seed=1, total_steps=int(510000), replay_size=int(150000), gamma=
         if t>= update_after and t % update_every == 0:
             for j in range(update_every//5):
                 batch = replay_buffer.sample_batch(batch_size, device)
-                update(batch,logger,t)
+                update(batch,metrics,t)
 
 
         if t % save_freq==0 or t ==total_steps-1:
-            torch.save({
-                'model': ac
-            },
-                str(save_dir) +"/actor_model_{}".format(t) + ".pt")
+            replay_buffer.flush()
+            checkpoints.save(t, train_state, **save_extra())
         #env.airgym.client.simPause(False)
-        if d and sum(success_deque) / len(success_deque)>best_sr:
-            torch.save({
-                'model': ac
-            },
-                str(save_dir) + "/actor_model_best" + ".pt")
-            best_sr=sum(success_deque) / len(success_deque)
+        if d:
+            checkpoints.save_best(t, train_state, sum(success_deque) / len(success_deque),
+                                  **save_extra())
+
+    replay_buffer.flush()
+    if record:
+        env.close()
+    checkpoints.close()
+    logger.close()
 
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--env', type=str, default='HalfCheetah-v2')
+    parser.add_argument('--resume', type=str, default=None,
+                        help='run directory (e.g. results/AirSimEnv-v42/SAC/run3) to continue')
+    parser.add_argument('--replay_on_disk', action='store_true', default=False,
+                        help='keep the replay buffer in memmapped files under the run directory')
+    parser.add_argument('--replay_block_size', type=int, default=1,
+                        help='sample runs of consecutive transitions from the on-disk replay')
+    parser.add_argument('--replay_obs_dtype', type=str, choices=['uint8', 'float32'], default='uint8',
+                        help='dtype of the images in the on-disk replay (float32 takes 4x the space; '
+                             'needed to resume runs whose replay was written as float32)')
+    parser.add_argument('--record', action='store_true', default=False,
+                        help='record every episode under <run dir>/trajectories')
+    parser.add_argument('--pretrained', type=str, default=None,
+                        help='checkpoint to initialize the networks from (e.g. from offline_sac.py)')
+    parser.add_argument('--surrogate', action='store_true', default=False,
+                        help='train on the NumPy surrogate of AirSimEnv instead of Unreal')
+    parser.add_argument('--num_q', type=int, default=2, help='critics in the ensemble')
+    parser.add_argument('--num_q_min', type=int, default=2,
+                        help='target critics the bootstrap takes the min over (REDQ when < num_q)')
+    parser.add_argument('--shared_encoder', type=int, choices=[0, 1], default=None,
+                        help='one conv stack for pi and the critics; default 1 when num_q > 2, since '
+                             'separate stacks make an update ~num_q/2 times as costly')
     args = parser.parse_args()
 
     #if torch.cuda.is_available():
@@ -673,4 +870,9 @@ if __name__ == '__main__':
     device = torch.device("cuda:0")
     torch.set_num_threads(torch.get_num_threads())
 
-    sac(device=device)
\ No newline at end of file
+    sac(device=device, resume=args.resume, replay_on_disk=args.replay_on_disk,
+        replay_block_size=args.replay_block_size, replay_obs_dtype=args.replay_obs_dtype,
+        record=args.record,
+        pretrained=args.pretrained, surrogate=args.surrogate, num_q=args.num_q,
+        num_q_min=args.num_q_min,
+        shared_encoder=None if args.shared_encoder is None else bool(args.shared_encoder))
\ No newline at end of file
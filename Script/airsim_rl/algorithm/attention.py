@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from utils.util import init
+
+# scaled_dot_product_attention takes ``scale`` from torch 2.1 on; the SAGAN
+# attention below is unscaled, so older versions use the chunked fallback.
+_HAS_SDPA = tuple(int(x) for x in torch.__version__.split('+')[0].split('.')[:2]) >= (2, 1)
+
+
+def chunked_attention(q, k, v, chunk_size=1024):
+    """softmax(q k^T) v computed over blocks of ``chunk_size`` queries, so only
+    an (N, chunk_size, HW) score block is alive at a time."""
+    k = k.transpose(1, 2)
+    return torch.cat([torch.bmm(F.softmax(torch.bmm(q[:, i:i + chunk_size], k), dim=-1), v)
+                      for i in range(0, q.shape[1], chunk_size)], dim=1)
+
+
+class CNNAttention(nn.Module):
+    """
+    SAGAN-style self-attention over the H*W positions of a conv feature map,
+    ``gamma * attend(q, k, v) + inputs`` with 1x1 conv projections.
+
+    The (N, HW, HW) attention matrix is never materialized: the fused
+    scaled_dot_product_attention kernel is used when available, chunked
+    queries otherwise. For plotting, set ``keep_attention = True`` and read
+    ``attention_map`` (the attention of the first sample summed over queries,
+    shaped (H, W)) after a forward pass.
+    """
+    # class attributes so modules unpickled from older checkpoints get them too
+    keep_attention = False
+    attention_map = None
+    chunk_size = 1024
+
+    def __init__(self, size, name="sa"):
+        super(CNNAttention, self).__init__()
+
+        init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
+                               constant_(x, 0), np.sqrt(2))
+
+        self.w_qs = init_(nn.Conv2d(size, size // 8, 1))
+        self.w_ks = init_(nn.Conv2d(size, size // 8, 1))
+        self.w_vs = init_(nn.Conv2d(size, size, 1))
+        self.gamma = nn.Parameter(torch.zeros(1))
+        self.name = name
+
+    def forward(self, inputs):
+        N, C, H, W = inputs.shape
+        # NCHW-->N,C,H*W-->N,H*W,C
+        q = self.w_qs(inputs).flatten(2).transpose(1, 2)
+        k = self.w_ks(inputs).flatten(2).transpose(1, 2)
+        v = self.w_vs(inputs).flatten(2).transpose(1, 2).contiguous()
+
+        if self.keep_attention:
+            with torch.no_grad():
+                attn = F.softmax(torch.bmm(q[:1], k[:1].transpose(1, 2)), dim=-1)
+                self.attention_map = attn[0].sum(dim=0).view(H, W).cpu()
+
+        # the ONNX exporter only converts 4-D scaled_dot_product_attention
+        if _HAS_SDPA and not torch.onnx.is_in_onnx_export():
+            # the flash kernels want one head dim for q, k and v and a dense last
+            # dim; zero-padding q and k up to C channels leaves q k^T unchanged
+            pad = C - q.shape[-1]
+            out = F.scaled_dot_product_attention(F.pad(q, (0, pad)), F.pad(k, (0, pad)), v,
+                                                 scale=1.0)
+        else:
+            out = chunked_attention(q, k, v, self.chunk_size)
+        out = out.transpose(1, 2).reshape(N, C, H, W)
+
+        return self.gamma * out + inputs
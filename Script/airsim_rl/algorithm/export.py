@@ -0,0 +1,115 @@
+"""
+Export of the SAC actor for onboard / real-drone inference.
+
+``export_actor`` traces ``Actor.forward(deterministic=True)`` (plus the
+shared encoder, if any) for fixed input shapes into a frozen TorchScript
+file or an ONNX graph, optionally with int8 dynamic quantization of the
+Linear layers (TorchScript only; the convolutions stay float).
+``ActorRuntime`` loads the result, owns preallocated input tensors and
+returns actions in the format of ``SACActorCritic.act``.
+
+    python -m algorithm.export --checkpoint results/.../actor_model_best.pt --out actor.ts
+"""
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+OBS_SHAPE = (4, 112, 112)
+
+
+class DeterministicActor(nn.Module):
+    """(img, inform) -> deterministic action of ``ac``, without distributions
+    or log-probs in the graph."""
+
+    def __init__(self, ac):
+        super().__init__()
+        self.pi = ac.pi
+        self.encoder = ac.encoder if ac.shared_encoder else None
+        self.discrete = ac.pi.discrete
+        self.act_limit = getattr(ac.pi, 'act_limit', None)
+
+    def forward(self, img, inform):
+        x = self.pi.encode(img) if self.encoder is None else self.encoder(img / 255.0)
+        x = torch.cat((x, self.pi.layer2(inform)), -1)
+        if self.discrete:
+            # argmax of the logits == argmax of Categorical(logits).probs
+            return self.pi.prob(x).argmax(dim=-1, keepdim=True)
+        return self.act_limit * torch.tanh(self.pi.mu(x))
+
+
+def inform_dim(ac):
+    return ac.pi.layer2[0].in_features
+
+
+def export_actor(ac, path, fmt='torchscript', quantize=False, batch_size=1, obs_shape=OBS_SHAPE):
+    model = DeterministicActor(ac).cpu().eval()
+    if quantize:
+        if fmt != 'torchscript':
+            raise ValueError("dynamic quantization is only exported to TorchScript")
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    example = (torch.zeros((batch_size,) + tuple(obs_shape)), torch.zeros(batch_size, inform_dim(ac)))
+    meta = dict(obs_shape=list(obs_shape), inform_dim=inform_dim(ac), batch_size=batch_size,
+                discrete=ac.pi.discrete, quantized=quantize)
+
+    with torch.no_grad():
+        if fmt == 'torchscript':
+            traced = torch.jit.freeze(torch.jit.trace(model, example).eval())
+            torch.jit.save(traced, path, _extra_files={'meta.json': json.dumps(meta)})
+        elif fmt == 'onnx':
+            torch.onnx.export(model, example, path, input_names=['img', 'inform'],
+                              output_names=['action'], opset_version=17)
+        else:
+            raise ValueError("unknown export format " + fmt)
+    return meta
+
+
+class ActorRuntime(object):
+    """Runs an exported actor; ``act(obs)`` copies ``obs = [img, inform]`` into
+    preallocated inputs (no per-call tensor construction)."""
+
+    def __init__(self, path, num_threads=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.onnx = str(path).endswith('.onnx')
+        if self.onnx:
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(str(path), providers=['CPUExecutionProvider'])
+            shapes = {i.name: i.shape for i in self.session.get_inputs()}
+            self.img = np.zeros(shapes['img'], dtype=np.float32)
+            self.inform = np.zeros(shapes['inform'], dtype=np.float32)
+        else:
+            extra = {'meta.json': ''}
+            self.model = torch.jit.load(str(path), map_location='cpu', _extra_files=extra)
+            meta = json.loads(extra['meta.json'])
+            self.img = torch.zeros([meta['batch_size']] + meta['obs_shape'])
+            self.inform = torch.zeros(meta['batch_size'], meta['inform_dim'])
+            # numpy views of the input tensors, filled in place by act()
+            self._img, self._inform = self.img.numpy(), self.inform.numpy()
+
+    def act(self, obs):
+        if self.onnx:
+            self.img[0] = obs[0]
+            self.inform[0] = obs[1]
+            return self.session.run(None, {'img': self.img, 'inform': self.inform})[0]
+        self._img[0] = obs[0]
+        self._inform[0] = obs[1]
+        with torch.inference_mode():
+            return self.model(self.img, self.inform).numpy()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from SAC import load_actor_critic
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--out', type=str, required=True, help='.ts / .pt for TorchScript, .onnx for ONNX')
+    parser.add_argument('--quantize', action='store_true', default=False)
+    args = parser.parse_args()
+
+    ac = load_actor_critic(args.checkpoint, torch.device('cpu'))
+    fmt = 'onnx' if args.out.endswith('.onnx') else 'torchscript'
+    print(export_actor(ac, args.out, fmt, args.quantize))
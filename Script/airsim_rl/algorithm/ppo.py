@@ -3,6 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import numpy as np
+from common.metrics import MetricsAccumulator, mean_grad_norm
 
 
 def huber_loss(e, d):
@@ -10,17 +11,6 @@ def huber_loss(e, d):
     b = (e>d).float()
     return a*e**2/2 + b*d*(abs(e)-d/2)
 
-def get_p_and_g_mean_norm(it):
-    size = 1e-8
-    su_p = 0
-    su_g = 0
-    for x in it:
-        if x.grad is None:continue
-        size += 1.
-        su_p += x.norm()
-        su_g += x.grad.norm()
-    return su_p / size, su_g / size
-
 class PPO():
     def __init__(self,                 
                  actor_critic,
@@ -37,10 +27,13 @@ class PPO():
                  use_clipped_value_loss=True,
                  use_huber_loss=True,
                  huber_delta=10.0,
-                 device=None):
+                 device=None,
+                 log_every=1):
 
         self.step = 0
         self.logger = logger
+        # minibatch losses/norms are averaged on-device and written every log_every updates
+        self.metrics = MetricsAccumulator(logger, log_every) if logger is not None else None
         self.actor_critic = actor_critic
 
         self.clip_param = clip_param
@@ -129,7 +122,11 @@ class PPO():
                 self.optimizer.zero_grad()
 
                 (value_loss * self.value_loss_coef+action_loss - dist_entropy * self.entropy_coef).backward()
-                norm, grad_norm = get_p_and_g_mean_norm(self.actor_critic.parameters())
+                if self.metrics is not None:
+                    self.metrics.add('value_loss', value_loss)
+                    self.metrics.add('action_loss', action_loss)
+                    self.metrics.add('dist_entropy', dist_entropy)
+                    self.metrics.add('grad_norm', mean_grad_norm(self.actor_critic.parameters()))
                 nn.utils.clip_grad_norm_(self.actor_critic.parameters(),self.max_grad_norm)
                 '''
                 for group in self.optimizer.param_groups:
@@ -141,20 +138,8 @@ class PPO():
 
 
 
-        if self.logger is not None:
-
-            self.logger.add_scalars('value_loss',
-                                    {'value_loss': value_loss},
-                                    self.step)
-            self.logger.add_scalars('action_loss',
-                                    {'action_loss': action_loss},
-                                    self.step)
-            self.logger.add_scalars('dist_entropy',
-                                    {'dist_entropy': dist_entropy},
-                                    self.step)
-            self.logger.add_scalars('grad_norm',
-                                    {'grad_norm': grad_norm},
-                                    self.step)
+        if self.metrics is not None:
+            self.metrics.step(self.step)
 
 
         self.step += 1
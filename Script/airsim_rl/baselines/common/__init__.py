@@ -1,5 +1,22 @@
 # flake8: noqa F403
-from baselines.common.console_util import *
-from baselines.common.dataset import Dataset
-from baselines.common.math_util import *
-from baselines.common.misc_util import *
+# The helpers used to be star-imported here, which made every
+# ``baselines.common.<submodule>`` import (e.g. the subprocess vec env workers)
+# pay for gym, scipy and the rest. They are now resolved on first access; the
+# lookup order reproduces the shadowing of the old star-imports.
+import importlib
+
+_star_modules = ('misc_util', 'math_util', 'console_util')
+
+
+def __getattr__(name):
+    if name == 'Dataset':
+        from baselines.common.dataset import Dataset
+        return Dataset
+    if not name.startswith('_'):
+        for module in _star_modules:
+            module = importlib.import_module('baselines.common.' + module)
+            if hasattr(module, name):
+                value = getattr(module, name)
+                globals()[name] = value
+                return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,5 +1,4 @@
 import numpy as np
-import scipy.signal
 
 
 def discount(x, gamma):
@@ -19,6 +18,7 @@ def discount(x, gamma):
                 where k = len(x) - t - 1
 
     """
+    import scipy.signal
     assert x.ndim >= 1
     return scipy.signal.lfilter([1],[1,-gamma],x[::-1], axis=0)[::-1]
 
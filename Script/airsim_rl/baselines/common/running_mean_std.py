@@ -1,6 +1,4 @@
-import tensorflow as tf
 import numpy as np
-from baselines.common.tf_util import get_session
 
 class RunningMeanStd(object):
     # https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
@@ -40,6 +38,10 @@ class TfRunningMeanStd(object):
     Benefit of this implementation is that it can be saved / loaded together with the tensorflow model
     '''
     def __init__(self, epsilon=1e-4, shape=(), scope=''):
+        # TensorFlow only for this class, so that the numpy RunningMeanStd
+        # (VecNormalize) does not need it
+        import tensorflow as tf
+        from baselines.common.tf_util import get_session
         sess = get_session()
 
         self._new_mean = tf.placeholder(shape=shape, dtype=tf.float64)
@@ -119,6 +121,7 @@ def test_tf_runningmeanstd():
 
 def profile_tf_runningmeanstd():
     import time
+    import tensorflow as tf
     from baselines.common import tf_util
 
     tf_util.get_session( config=tf.ConfigProto(
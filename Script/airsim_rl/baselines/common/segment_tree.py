@@ -1,4 +1,4 @@
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -16,21 +16,26 @@ class SegmentTree(object):
                `reduce` operation which reduces `operation` over
                a contiguous subsequence of items in the array.
 
+        The tree is stored in a flat float64 numpy array, so both
+        item assignment and lookup accept either a single index or
+        an array of indexes; a batch of leaves is propagated to the
+        root one tree level at a time.
+
         Paramters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
+        operation: np.ufunc
+            and operation for combining elements (eg. np.add, np.minimum)
             must form a mathematical group together with the set of
             possible values for array elements (i.e. be associative)
-        neutral_element: obj
+        neutral_element: float
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
@@ -71,22 +76,35 @@ class SegmentTree(object):
         if end < 0:
             end += self._capacity
         end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        return float(self._reduce_helper(start, end, 1, 0, self._capacity - 1))
 
     def __setitem__(self, idx, val):
-        # index of the leaf
-        idx += self._capacity
+        if np.ndim(idx) == 0:
+            # index of the leaf
+            idx = int(idx) + self._capacity
+            self._value[idx] = val
+            idx //= 2
+            while idx >= 1:
+                self._value[idx] = self._operation(
+                    self._value[2 * idx],
+                    self._value[2 * idx + 1]
+                )
+                idx //= 2
+            return
+        # indexes of the leaves; they all sit at the same depth,
+        # so the whole batch climbs towards the root together
+        idx = np.asarray(idx, dtype=np.int64) + self._capacity
         self._value[idx] = val
-        idx //= 2
-        while idx >= 1:
+        for _ in range(self._capacity.bit_length() - 1):
+            idx //= 2
             self._value[idx] = self._operation(
                 self._value[2 * idx],
                 self._value[2 * idx + 1]
             )
-            idx //= 2
 
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
+        idx = np.asarray(idx, dtype=np.int64)
+        assert np.all(0 <= idx) and np.all(idx < self._capacity)
         return self._value[self._capacity + idx]
 
 
@@ -94,7 +112,7 @@ class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -112,30 +130,32 @@ class SumSegmentTree(SegmentTree):
 
         Parameters
         ----------
-        perfixsum: float
-            upperbound on the sum of array prefix
+        perfixsum: float or np.array
+            upperbound on the sum of array prefix, or a batch of them
 
         Returns
         -------
-        idx: int
-            highest index satisfying the prefixsum constraint
+        idx: int or np.array
+            highest index satisfying the prefixsum constraint, with the
+            same shape as `prefixsum`
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        prefixsum = np.array(prefixsum, dtype=np.float64)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        for _ in range(self._capacity.bit_length() - 1):  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = left <= prefixsum
+            prefixsum -= np.where(go_right, left, 0.0)
+            idx = 2 * idx + go_right
+        idx -= self._capacity
+        return int(idx) if idx.ndim == 0 else idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
@@ -95,9 +95,47 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_batch_set():
+    tree = SumSegmentTree(8)
+    mtree = MinSegmentTree(8)
+
+    tree[np.array([1, 4, 6])] = np.array([1.0, 2.0, 0.5])
+    mtree[np.array([1, 4, 6])] = np.array([1.0, 2.0, 0.5])
+
+    assert np.isclose(tree.sum(), 3.5)
+    assert np.isclose(tree.sum(0, 4), 1.0)
+    assert np.isclose(tree.sum(4, 8), 2.5)
+    assert np.allclose(tree[np.array([0, 1, 4, 6])], [0.0, 1.0, 2.0, 0.5])
+    assert np.isclose(mtree.min(), 0.5)
+    assert np.isclose(mtree.min(0, 5), 1.0)
+
+    tree[np.array([4, 6])] = 3.0
+
+    assert np.isclose(tree.sum(), 7.0)
+    assert np.isclose(tree.sum(2, 5), 3.0)
+
+
+def test_batch_prefixsum_idx():
+    tree = SumSegmentTree(4)
+
+    tree[0] = 0.5
+    tree[1] = 1.0
+    tree[2] = 1.0
+    tree[3] = 3.0
+
+    masses = np.array([0.00, 0.55, 0.99, 1.51, 3.00, 5.50])
+    idxes = tree.find_prefixsum_idx(masses)
+
+    assert idxes.shape == masses.shape
+    assert list(idxes) == [0, 1, 1, 2, 3, 3]
+    assert list(idxes) == [tree.find_prefixsum_idx(m) for m in masses]
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_batch_set()
+    test_batch_prefixsum_idx()
@@ -0,0 +1,76 @@
+"""Single-observation CPU latency (p50 / p99) of the SAC actor: eager
+``SACActorCritic.act`` with per-call tensor construction (the last.py /
+eval_SAC.py ``get_action`` path) vs the exported actor run by
+algorithm.export.ActorRuntime: TorchScript float and int8 dynamic-quantized,
+and ONNX Runtime when onnxruntime is installed.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.actor_latency --threads 1 --repeat 500
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+import gym
+import numpy as np
+import torch
+
+from SAC import SACActorCritic
+from algorithm.export import export_actor, ActorRuntime, OBS_SHAPE
+
+
+def latencies(fn, obs, repeat, warmup=20):
+    for _ in range(warmup):
+        fn(obs)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(obs)
+        times.append(time.perf_counter() - start)
+    return np.percentile(np.array(times) * 1e3, [50, 99])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--sattn', action='store_true', default=False)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+    ac = SACActorCritic(gym.spaces.Box(0, 255, OBS_SHAPE, dtype=np.float32), gym.spaces.Discrete(8),
+                        device, sattn=args.sattn)
+    for p in ac.parameters():
+        p.requires_grad = False
+    obs = [np.random.rand(*OBS_SHAPE).astype(np.float32) * 255, np.random.rand(7).astype(np.float32)]
+
+    def eager(o):
+        return ac.act([torch.as_tensor(o[0], dtype=torch.float32).unsqueeze(0).to(device),
+                       torch.as_tensor(o[1], dtype=torch.float32).unsqueeze(0).to(device)], True)
+
+    tmp = tempfile.mkdtemp()
+    rows = [('eager act', eager)]
+    for quantize in (False, True):
+        path = os.path.join(tmp, 'actor_q.ts' if quantize else 'actor.ts')
+        export_actor(ac, path, quantize=quantize)
+        runtime = ActorRuntime(path)
+        assert (runtime.act(obs) == eager(obs)).all() or quantize
+        rows.append(('torchscript' + (' int8' if quantize else ''), runtime.act))
+    if importlib.util.find_spec('onnxruntime') is None:
+        print("onnxruntime not installed, skipping ONNX")
+    else:
+        path = os.path.join(tmp, 'actor.onnx')
+        export_actor(ac, path, fmt='onnx')
+        runtime = ActorRuntime(path)
+        assert (runtime.act(obs) == eager(obs)).all()
+        rows.append(('onnxruntime', runtime.act))
+
+    print("threads={} sattn={}".format(args.threads, args.sattn))
+    for name, fn in rows:
+        p50, p99 = latencies(fn, obs, args.repeat)
+        print("{:<18} p50 {:7.3f} ms   p99 {:7.3f} ms".format(name, p50, p99))
@@ -0,0 +1,75 @@
+"""Control rounds per second over several drones / AirSim instances: the
+synchronous MultirotorClient (one client per instance, stepped in turn)
+versus AsyncMultirotorClient (all instances from one event loop with
+asyncio.gather), plus the blocking AsyncioMultirotorClient adapter that
+AirLearningClient uses with settings.rpc_backend = 'asyncio'.
+
+A round is, per drone, simGetGroundTruthKinematicsArray followed by
+moveByVelocityZ(..., duration=--move_ms). The servers are the local
+msgpack-rpc stub of benchmarks/rpc_lanes.py.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.async_client --drones 1 4 16
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from benchmarks.rpc_lanes import StubServer
+from misc.move_to_airsim.client import MultirotorClient
+from misc.move_to_airsim.aio_client import AsyncMultirotorClient, AsyncioMultirotorClient
+
+
+def sync_rounds(clients, rounds, move_s):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for c in clients:
+            c.simGetGroundTruthKinematicsArray()
+            c.moveByVelocityZAsync(0.5, 0., -0.9, move_s).join()
+    return rounds / (time.perf_counter() - start)
+
+
+async def async_rounds(ports, rounds, move_s):
+    clients = [AsyncMultirotorClient(port=port) for port in ports]
+
+    async def step(c):
+        await c.simGetGroundTruthKinematicsArray()
+        await c.moveByVelocityZ(0.5, 0., -0.9, move_s)
+
+    await asyncio.gather(*[c.ping() for c in clients])
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[step(c) for c in clients])
+    elapsed = time.perf_counter() - start
+    for c in clients:
+        await c.close()
+    return rounds / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--drones', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--move_ms', type=float, default=10.)
+    args = parser.parse_args()
+
+    servers = []
+    for _ in range(max(args.drones)):
+        server = StubServer(('127.0.0.1', 0), 0., 1)
+        server.ping = lambda: True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    ports = [server.server_address[1] for server in servers]
+    move_s = args.move_ms / 1000.
+
+    for n in args.drones:
+        sync_rate = sync_rounds([MultirotorClient(port=port) for port in ports[:n]], args.rounds, move_s)
+        adapter = [AsyncioMultirotorClient(port=port) for port in ports[:n]]
+        adapter_rate = sync_rounds(adapter, args.rounds, move_s)
+        for c in adapter:
+            c.client.close()
+        async_rate = asyncio.run(async_rounds(ports[:n], args.rounds, move_s))
+        print("drones={:<3} rounds/s  sync {:7.1f}  asyncio adapter {:7.1f}  asyncio gather {:7.1f}".format(
+            n, sync_rate, adapter_rate, async_rate))
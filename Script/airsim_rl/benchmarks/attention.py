@@ -0,0 +1,105 @@
+"""Compare CNNAttention against the original bmm implementation, which builds
+the full (N, HW, HW) attention matrix.
+
+Inputs are the feature maps the attention layers see in Actor/Qfunc for a
+4x112x112 depth stack: (N, 16, 27, 27) after the first conv and
+(N, 32, 12, 12) after the second. Each variant runs forward + backward in its
+own process so peak memory (CUDA allocator peak, or max RSS growth on CPU) is
+not shared between them.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.attention --batch_size 256
+"""
+import argparse
+import resource
+import time
+from multiprocessing import get_context
+
+import torch
+import torch.nn.functional as F
+
+from algorithm.attention import CNNAttention
+
+LAYERS = {'l1': (16, 27), 'l2': (32, 12)}
+
+
+class LegacyCNNAttention(CNNAttention):
+    def forward(self, inputs):
+        Batch = inputs.shape[0]
+        output_size = inputs.shape[2] * inputs.shape[3]
+        q = self.w_qs(inputs).view(Batch, -1, output_size).permute(0, 2, 1)
+        k = self.w_ks(inputs).view(Batch, -1, output_size)
+        v = self.w_vs(inputs).view(Batch, -1, output_size)
+        attn = F.softmax(torch.bmm(q, k), dim=-1)
+        out = torch.bmm(v, attn.permute(0, 2, 1)).view(*inputs.shape)
+        return self.gamma * out + inputs
+
+
+def make_module(legacy, channels, device):
+    torch.manual_seed(0)
+    module = (LegacyCNNAttention if legacy else CNNAttention)(channels).to(device)
+    with torch.no_grad():
+        module.gamma.fill_(0.5)
+    return module
+
+
+def run(legacy, layer, batch_size, repeat, device, result):
+    device = torch.device(device)
+    channels, size = LAYERS[layer]
+    module = make_module(legacy, channels, device)
+    x = torch.randn(batch_size, channels, size, size, device=device, requires_grad=True)
+
+    def step():
+        module(x).sum().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    step()
+    if device.type == 'cuda':
+        peak = (torch.cuda.max_memory_allocated() - base) / 2 ** 20
+    else:
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 2 ** 10
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        step()
+    result.put((peak, (time.perf_counter() - start) / repeat))
+
+
+def measure(legacy, layer, args):
+    ctx = get_context('spawn')
+    result = ctx.Queue()
+    proc = ctx.Process(target=run, args=(legacy, layer, args.batch_size, args.repeat,
+                                         args.device, result))
+    proc.start()
+    out = result.get()
+    proc.join()
+    return out
+
+
+def check(layer, device):
+    channels, size = LAYERS[layer]
+    x = torch.randn(8, channels, size, size, device=device)
+    new, old = make_module(False, channels, device), make_module(True, channels, device)
+    return (new(x) - old(x)).abs().max().item()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    print("device={} batch_size={}".format(args.device, args.batch_size))
+    for layer in LAYERS:
+        print("{}: max abs diff vs legacy {:.2e}".format(layer, check(layer, args.device)))
+        for legacy in (True, False):
+            peak, seconds = measure(legacy, layer, args)
+            print("{} {:<8s} peak {:8.1f} MiB   fwd+bwd {:8.2f} ms".format(
+                layer, 'legacy' if legacy else 'fused', peak, seconds * 1e3))
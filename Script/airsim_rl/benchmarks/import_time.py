@@ -0,0 +1,108 @@
+"""Import-time gate: each entry point is imported in a fresh interpreter under
+``python -X importtime`` and its cumulative import time is checked against a
+budget (ms); the slowest imports (self time) are listed for the ones over it.
+A pool of spawned env workers (the setup of baselines' SubprocVecEnv workers:
+fresh interpreter, vec_env + env import, construction, first reset on the
+surrogate env) must be up within ``--worker_budget`` ms.
+
+Exits with status 1 when a budget is exceeded or a module fails to import.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --modules SAC common.utils --top 20
+"""
+import argparse
+import importlib
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+
+BUDGETS = {
+    'common.utils': 300,
+    'baselines.common.vec_env.subproc_vec_env': 400,
+    'gym_airsim.surrogate': 400,
+    'gym_airsim.envs.AirGym': 500,
+    'SAC': 2500,
+    'eval_SAC': 2500,
+    'train_ppo': 3000,
+    'last': 3000,
+}
+
+
+def import_times(module):
+    """(cumulative ms, [(self ms, name)], error) of importing module in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    total, selfs = None, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        selfs.append((int(self_us) / 1000., name.strip()))
+        if name.strip() == module and not name.startswith('  '):
+            total = int(cumulative_us) / 1000.
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1]
+    return total, sorted(selfs, reverse=True), error
+
+
+def worker(remote):
+    importlib.import_module('baselines.common.vec_env.subproc_vec_env')
+    from gym_airsim.surrogate import AirSimSurrogateEnv
+    env = AirSimSurrogateEnv(control_mode="Discrete", seed=os.getpid())
+    env.reset()
+    remote.send(True)
+    remote.close()
+
+
+def worker_startup(num_workers):
+    """Wall time (ms) until num_workers spawned workers have reset their env."""
+    ctx = mp.get_context('spawn')
+    start = time.perf_counter()
+    pipes = [ctx.Pipe(duplex=False) for _ in range(num_workers)]
+    procs = [ctx.Process(target=worker, args=(send,), daemon=True) for _, send in pipes]
+    for p in procs:
+        p.start()
+    ok = all(recv.recv() for recv, _ in pipes)
+    elapsed = (time.perf_counter() - start) * 1000.
+    for p in procs:
+        p.join()
+    return elapsed, ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=str, nargs='+', default=list(BUDGETS.keys()))
+    parser.add_argument('--top', type=int, default=10, help='slowest imports shown per module over budget')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--worker_budget', type=float, default=1000.)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        total, selfs, error = import_times(module)
+        budget = BUDGETS.get(module, float('inf'))
+        if error is not None:
+            failed = True
+            print("{:<45} FAILED  {}".format(module, error))
+            continue
+        over = total > budget
+        failed |= over
+        print("{:<45} {:8.0f} ms  (budget {:.0f}){}".format(module, total, budget, '  OVER' if over else ''))
+        if over:
+            for self_ms, name in selfs[:args.top]:
+                print("    {:8.1f} ms  {}".format(self_ms, name))
+
+    if args.workers > 0:
+        elapsed, ok = worker_startup(args.workers)
+        over = not ok or elapsed > args.worker_budget
+        failed |= over
+        print("{:<45} {:8.0f} ms  (budget {:.0f}){}".format(
+            '{} spawned env workers'.format(args.workers), elapsed, args.worker_budget,
+            '  OVER' if over else ''))
+
+    sys.exit(1 if failed else 0)
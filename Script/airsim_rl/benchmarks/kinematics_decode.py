@@ -0,0 +1,73 @@
+"""Decoding cost of a simGetGroundTruthKinematics response (the msgpack
+decoded dict) into position / orientation / velocities: KinematicsState
+objects with the fields read out by hand, as the client did, versus
+kinematics_to_array into a preallocated float64 array; and Euler angles of a
+batch of quaternions, one at a time versus to_eulerian_angles.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.kinematics_decode --vehicles 1 8 64
+"""
+import argparse
+import math
+import timeit
+
+import numpy as np
+
+from misc.move_to_airsim.types import KinematicsState, KINEMATICS_SIZE, kinematics_to_array, \
+    to_eulerian_angles
+
+
+def random_kinematics(rng):
+    def vec():
+        return dict(zip(('x_val', 'y_val', 'z_val'), rng.randn(3).tolist()))
+    q = rng.randn(4)
+    q /= np.linalg.norm(q)
+    return dict(position=vec(), orientation=dict(zip(('x_val', 'y_val', 'z_val', 'w_val'), q.tolist())),
+                linear_velocity=vec(), angular_velocity=vec(), linear_acceleration=vec(),
+                angular_acceleration=vec())
+
+
+def objects(encoded, out):
+    for i, e in enumerate(encoded):
+        k = KinematicsState.from_msgpack(e)
+        p, q, v, w = k.position, k.orientation, k.linear_velocity, k.angular_velocity
+        out[i] = (p.x_val, p.y_val, p.z_val, q.x_val, q.y_val, q.z_val, q.w_val,
+                  v.x_val, v.y_val, v.z_val, w.x_val, w.y_val, w.z_val)
+
+
+def arrays(encoded, out):
+    for i, e in enumerate(encoded):
+        kinematics_to_array(e, out[i])
+
+
+def euler_loop(q):
+    # VehicleClient.toEulerianAngle, per quaternion
+    angles = []
+    for x, y, z, w in q.tolist():
+        ysqr = y * y
+        roll = math.atan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + ysqr))
+        pitch = math.asin(min(1.0, max(-1.0, 2.0 * (w * y - z * x))))
+        yaw = math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (ysqr + z * z))
+        angles.append((pitch, roll, yaw))
+    return angles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for n in args.vehicles:
+        encoded = [random_kinematics(rng) for _ in range(n)]
+        out = np.empty((n, KINEMATICS_SIZE))
+        t_obj = timeit.timeit(lambda: objects(encoded, out), number=args.number) / args.number
+        t_arr = timeit.timeit(lambda: arrays(encoded, out), number=args.number) / args.number
+        q = out[:, 3:7].copy()
+        t_loop = timeit.timeit(lambda: euler_loop(q), number=args.number) / args.number
+        t_vec = timeit.timeit(lambda: to_eulerian_angles(q), number=args.number) / args.number
+        print("vehicles={:<4} decode: objects {:7.1f} us  array {:7.1f} us   "
+              "euler: loop {:7.1f} us  batched {:7.1f} us".format(
+                  n, 1e6 * t_obj, 1e6 * t_arr, 1e6 * t_loop, 1e6 * t_vec))
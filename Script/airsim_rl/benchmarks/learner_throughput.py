@@ -0,0 +1,162 @@
+"""Throughput of the SAC and PPO learners on a nearly free environment:
+mujoco_envs.navigation.BatchNavigation2DEnv, all envs stepped in one
+vectorized call, so the numbers measure acting, storage and updates rather
+than the simulator.
+
+SAC runs SACActorCritic / make_update / ReplayBuffer on the AirSim
+observation layout: a constant 4x112x112 image and an inform vector with the
+navigation state (goal offset, last action, distance, position). PPO runs
+algorithm.model.Policy (MLP base on the 2-d state), RolloutStorage with one
+rollout thread per env and PPO.update.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.learner_throughput --algo sac ppo --num_envs 1 8 32
+"""
+import argparse
+import time
+from copy import deepcopy
+
+import gym
+import numpy as np
+import torch
+
+from SAC import SACActorCritic, ReplayBuffer, make_update
+from algorithm.model import Policy
+from algorithm.ppo import PPO
+from common.metrics import MetricsAccumulator
+from mujoco_envs.navigation import BatchNavigation2DEnv
+from utils.storage import RolloutStorage
+
+OBS_SHAPE = (4, 112, 112)
+
+
+class NullLogger(object):
+    def add_scalars(self, *args):
+        pass
+
+
+def make_env(num_envs, seed=0):
+    env = BatchNavigation2DEnv(num_envs)
+    env.seed(seed)
+    env.reset_task(env.sample_tasks(num_envs))
+    return env
+
+
+def inform(state, goal, action):
+    offset = goal - state
+    return np.concatenate((offset, action, np.linalg.norm(offset, axis=1, keepdims=True), state),
+                          axis=1).astype(np.float32)
+
+
+def sac_throughput(num_envs, iterations, batch_size, update_every, device):
+    torch.manual_seed(0)
+    env = make_env(num_envs)
+    state = env.reset()
+    ac = SACActorCritic(gym.spaces.Box(0, 255, OBS_SHAPE, dtype=np.float32),
+                        env.single_action_space, device, sattn=False)
+    ac_target = deepcopy(ac)
+    for p in ac_target.parameters():
+        p.requires_grad = False
+    update = make_update(ac, ac_target, False, 0.99)
+    metrics = MetricsAccumulator(NullLogger(), flush_every=100)
+    replay = ReplayBuffer(OBS_SHAPE, 2, max(2000, 2 * batch_size))
+
+    img = np.zeros((num_envs,) + OBS_SHAPE, dtype=np.float32)
+    img_t = torch.as_tensor(img, device=device)
+    action = np.zeros((num_envs, 2), dtype=np.float32)
+    env_time, grad_steps, t = 0., 0, 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        o = inform(state, env._goal, action)
+        action = ac.act([img_t, torch.as_tensor(o, device=device)])
+
+        tic = time.perf_counter()
+        state2, reward, done, infos = env.step(action)
+        env_time += time.perf_counter() - tic
+
+        final = state2.copy()
+        if done.any():
+            final[done] = infos['terminal_observation']
+        o2 = inform(final, infos['goal'], action)
+        for i in range(num_envs):
+            replay.store([img[i], o[i]], action[i], reward[i], [img[i], o2[i]], float(done[i]))
+        state = state2
+
+        # update_every env steps -> update_every gradient steps, as in SAC.py
+        t += num_envs
+        while replay.size >= batch_size and t >= update_every:
+            t -= update_every
+            for _ in range(update_every):
+                update(replay.sample_batch(batch_size, device), metrics, grad_steps)
+                grad_steps += 1
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return iterations * num_envs / elapsed, grad_steps / elapsed, env_time / elapsed
+
+
+def ppo_throughput(num_envs, iterations, episode_length, device):
+    torch.manual_seed(0)
+    env = make_env(num_envs)
+    actor_critic = Policy((2,), env.single_action_space,
+                          base_kwargs={'recurrent': False, 'recurrent_input_size': 64,
+                                       'recurrent_hidden_size': 64, 'hidden_size': 64}).to(device)
+    agent = PPO(actor_critic, 0.15, 8, 1, 8, 1.0, 0.01, lr=5e-4, eps=1e-5, max_grad_norm=0.5,
+                device=device)
+    rollout = RolloutStorage(episode_length, num_envs, (2,), env.single_action_space,
+                             actor_critic.recurrent_hidden_state_size)
+    rollout.obs[0].copy_(torch.as_tensor(env.reset()))
+    rollout.to(device)
+
+    env_time, update_time = 0., 0.
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for step in range(episode_length):
+            with torch.no_grad():
+                value, action, action_log_prob, hidden = actor_critic.act(
+                    rollout.obs[step], rollout.recurrent_hidden_states[step], rollout.masks[step])
+            tic = time.perf_counter()
+            obs, reward, done, _ = env.step(action.cpu().numpy())
+            env_time += time.perf_counter() - tic
+            mask = torch.as_tensor(1. - done, dtype=torch.float32).view(-1, 1)
+            rollout.insert(torch.as_tensor(obs), rollout.inform[0], hidden, action, action_log_prob,
+                           value, torch.as_tensor(reward, dtype=torch.float32).view(-1, 1), mask, mask)
+        with torch.no_grad():
+            next_value = actor_critic.get_value(rollout.obs[-1], rollout.recurrent_hidden_states[-1],
+                                                rollout.masks[-1])
+        rollout.compute_returns(next_value, True, 0.99, 0.95)
+        tic = time.perf_counter()
+        agent.update(rollout)
+        update_time += time.perf_counter() - tic
+        rollout.obs[0].copy_(rollout.obs[-1])
+        rollout.masks[0].copy_(rollout.masks[-1])
+    elapsed = time.perf_counter() - start
+    return iterations * episode_length * num_envs / elapsed, update_time / elapsed, env_time / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algo', type=str, nargs='+', default=['sac', 'ppo'])
+    parser.add_argument('--num_envs', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=20, help='PPO rollouts + updates')
+    parser.add_argument('--sac_rounds', type=int, default=3, help='rounds of update_every SAC steps')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--update_every', type=int, default=50)
+    parser.add_argument('--episode_length', type=int, default=128)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    for num_envs in args.num_envs:
+        if 'sac' in args.algo:
+            iterations = -(-(args.sac_rounds * args.update_every + args.batch_size) // num_envs)
+            env_rate, grad_rate, env_share = sac_throughput(num_envs, iterations, args.batch_size,
+                                                            args.update_every, device)
+            print("sac num_envs={:<3} {:9.0f} env steps/s {:7.1f} grad steps/s  env {:4.1f}% of time".format(
+                num_envs, env_rate, grad_rate, 100 * env_share))
+        if 'ppo' in args.algo:
+            env_rate, update_share, env_share = ppo_throughput(num_envs, args.iterations,
+                                                               args.episode_length, device)
+            print("ppo num_envs={:<3} {:9.0f} env steps/s  update {:4.1f}%  env {:4.1f}% of time".format(
+                num_envs, env_rate, 100 * update_share, 100 * env_share))
@@ -0,0 +1,88 @@
+"""Samples per second of the offline training input pipeline: the
+TrajectoryDataset read in the training process vs the multi-worker
+DataLoader (common.trajectory.make_loader), each including the uint8 ->
+float32 device conversion.
+
+--data is a directory written by ``SAC.py --record``; without it a synthetic
+one (random 4x112x112 depth stacks) is recorded first.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.offline_loader --batch_size 256 --workers 0 2 4
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from common.trajectory import (TrajectoryRecorder, TrajectoryDataset, make_loader,
+                               batch_to_device)
+
+
+class RandomEnv(object):
+    success = False
+
+    def reset(self):
+        self.t = 0
+        return [np.random.rand(4, 112, 112) * 255, np.random.rand(7)]
+
+    def step(self, action):
+        self.t += 1
+        return [np.random.rand(4, 112, 112) * 255, np.random.rand(7)], 0., self.t >= 200, None
+
+
+def record(path, steps):
+    """Whole 200-step episodes until at least ``steps`` transitions."""
+    env = TrajectoryRecorder(RandomEnv(), path)
+    t = 0
+    while t < steps:
+        env.reset()
+        done = False
+        while not done:
+            _, _, done, _ = env.step(np.array([t % 8]))
+            t += 1
+    env.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default=None)
+    parser.add_argument('--steps', type=int, default=20000)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--batches', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    path = args.data
+    if path is None:
+        path = tempfile.mkdtemp()
+        record(path, args.steps)
+
+    dataset = TrajectoryDataset(path)
+    print("{} transitions, batch_size={}, device={}".format(len(dataset), args.batch_size, device))
+    dataset.sample_batch(args.batch_size, device)
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        dataset.sample_batch(args.batch_size, device)
+    print("in-process sample_batch   {:9.0f} samples/s".format(
+        args.batches * args.batch_size / (time.perf_counter() - start)))
+
+    for num_workers in args.workers:
+        loader = iter(make_loader(path, args.batch_size, num_workers,
+                                  pin_memory=device.type == 'cuda'))
+        for _ in range(5):
+            batch_to_device(next(loader), device)
+        start = time.perf_counter()
+        for _ in range(args.batches):
+            batch_to_device(next(loader), device)
+        print("make_loader workers={:<2}  {:9.0f} samples/s".format(
+            num_workers, args.batches * args.batch_size / (time.perf_counter() - start)))
+        del loader
+
+    if args.data is None:
+        shutil.rmtree(path)
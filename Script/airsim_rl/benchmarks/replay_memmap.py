@@ -0,0 +1,68 @@
+"""Sampling throughput of SAC.MemmapReplayBuffer from a cold page cache,
+uniform indices vs runs of ``block_size`` consecutive transitions.
+
+The buffer is filled with random transitions once (``--size`` transitions of
+the default 4x112x112 observation), then every measurement drops the page
+cache (needs root; otherwise the numbers are warm-cache) and draws
+``--batches`` batches.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.replay_memmap --size 20000 --obs_dtype uint8
+"""
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+from SAC import MemmapReplayBuffer
+
+OBS_SHAPE = (4, 112, 112)
+
+
+def drop_page_cache():
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+def fill(path, size, obs_dtype):
+    shutil.rmtree(path, ignore_errors=True)
+    buffer = MemmapReplayBuffer(OBS_SHAPE, 1, size, path, obs_dtype=obs_dtype)
+    chunk = 500
+    for start in range(0, size, chunk):
+        n = min(chunk, size - start)
+        img = np.random.randint(0, 256, (n,) + OBS_SHAPE).astype(obs_dtype)
+        for name in ('obs_buf', 'obs2_buf'):
+            getattr(buffer, name)[start:start + n] = img
+    buffer.ptr, buffer.size = 0, size
+    buffer.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', type=str, default='/tmp/replay_memmap_bench')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--obs_dtype', type=str, default='uint8')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--batches', type=int, default=20)
+    args = parser.parse_args()
+
+    fill(args.path, args.size, args.obs_dtype)
+    for block_size in (1, 8, 32):
+        buffer = MemmapReplayBuffer(OBS_SHAPE, 1, args.size, args.path, block_size=block_size,
+                                    obs_dtype=args.obs_dtype)
+        cold = drop_page_cache()
+        start = time.perf_counter()
+        for _ in range(args.batches):
+            buffer.sample_batch(args.batch_size)
+        elapsed = time.perf_counter() - start
+        print("block_size={:<3} {} {:8.1f} samples/s".format(
+            block_size, 'cold' if cold else 'warm', args.batches * args.batch_size / elapsed))
+    shutil.rmtree(args.path)
@@ -0,0 +1,83 @@
+"""Drive the Ape-X replay server with local stand-in actors and a learner loop.
+
+Each actor process pushes batches of random AirSim-shaped transitions
+([4x112x112 uint8 depth stack, 7-d inform]) with random initial priorities;
+the learner samples, sleeps for a fake gradient step and sends priorities back.
+The learner gets the images through shared memory, or pickled with --pickle.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.replay_server --num_actors 4 --duration 20
+    python -m benchmarks.replay_server --num_actors 4 --duration 20 --pickle
+"""
+import argparse
+import time
+from multiprocessing import Process
+
+import numpy as np
+
+from common.replay_server import start_replay_server, ActorClient, LearnerClient
+
+OBS_SHAPE = (4, 112, 112)
+INFORM_DIM = 7
+
+
+def fake_batch(n, rng):
+    img = rng.integers(0, 255, size=(n,) + OBS_SHAPE, dtype=np.uint8)
+    inform = rng.standard_normal((n, INFORM_DIM)).astype(np.float32)
+    return ([img, inform], rng.integers(0, 8, size=n), rng.standard_normal(n).astype(np.float32),
+            [img, inform], (rng.random(n) < 0.01).astype(np.float32), rng.random(n) + 1e-3)
+
+
+def run_actor(address, seed, batch_size, duration):
+    rng = np.random.default_rng(seed)
+    actor = ActorClient(address)
+    batch = fake_batch(batch_size, rng)
+    end = time.time() + duration
+    while time.time() < end:
+        actor.add_batch(*batch)
+    actor.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=6101)
+    parser.add_argument('--num_actors', type=int, default=4)
+    parser.add_argument('--capacity', type=int, default=50000)
+    parser.add_argument('--actor_batch', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--train_step', type=float, default=0.005, help='seconds per fake gradient step')
+    parser.add_argument('--duration', type=float, default=20.)
+    parser.add_argument('--pickle', action='store_true', default=False,
+                        help='send the sampled images over the socket instead of shared memory')
+    args = parser.parse_args()
+
+    address = ('localhost', args.port)
+    server = start_replay_server(address, capacity=args.capacity, obs_shape=OBS_SHAPE,
+                                 inform_dim=INFORM_DIM, max_pending=8)
+    actors = [Process(target=run_actor, args=(address, i, args.actor_batch, args.duration))
+              for i in range(args.num_actors)]
+    for p in actors:
+        p.start()
+
+    learner = LearnerClient(address, batch_size=args.batch_size, prefetch=2,
+                            shared_memory=not args.pickle)
+    while learner.stats()['size'] < args.batch_size:
+        time.sleep(0.1)
+
+    steps = 0
+    start = time.time()
+    while any(p.is_alive() for p in actors):
+        *_, indices, weights = learner.sample()
+        time.sleep(args.train_step)
+        learner.update_priorities(indices, np.random.random(args.batch_size) + 1e-3)
+        steps += 1
+    elapsed = time.time() - start
+
+    stats = learner.stats()
+    print("learner steps/s: {:.1f}".format(steps / elapsed))
+    print("transitions added/s: {:.1f}".format(stats.get('added', 0) / stats['uptime']))
+    for key in sorted(stats):
+        print("{:<20s} {}".format(key, stats[key]))
+    learner.close()
+    server.terminate()
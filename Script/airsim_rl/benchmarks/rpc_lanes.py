@@ -0,0 +1,138 @@
+"""Control step latency while images are being fetched: one msgpackrpc
+connection shared by all threads (what MultirotorClient does) versus an
+RpcPool with separate control / kinematics / image lanes.
+
+The AirSim server is replaced by a local stub speaking msgpack-rpc: one
+thread per connection, requests of a connection answered in order (as
+AirSim's rpclib server does), simGetImages takes --render_ms and returns a
+--image_kb payload, moveByVelocityZ takes its duration. One thread fetches
+images in a loop; the control thread measures steps of
+simGetGroundTruthKinematics + moveByVelocityZ(...).join(). Then kinematics
++ images and, on a pool with two image connections, two simGetImages, each
+sequentially and through call_many.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.rpc_lanes --steps 200
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+import msgpack
+import numpy as np
+
+from misc.move_to_airsim.client import RpcPool, call_many
+
+
+class StubHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        while True:
+            data = self.request.recv(1 << 16)
+            if not data:
+                return
+            unpacker.feed(data)
+            for _, msgid, method, params in unpacker:
+                result = getattr(self.server, method)(*params)
+                self.request.sendall(msgpack.packb([1, msgid, None, result], use_bin_type=True))
+
+
+class StubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, render_ms, image_kb):
+        socketserver.ThreadingTCPServer.__init__(self, address, StubHandler)
+        self.render = render_ms / 1000.
+        self.image = dict(image_data_uint8=bytes(image_kb * 1024), width=1, height=1)
+
+    def simGetImages(self, requests, vehicle_name):
+        time.sleep(self.render)
+        return [self.image for _ in requests]
+
+    def simGetGroundTruthKinematics(self, vehicle_name):
+        v = dict(x_val=0., y_val=0., z_val=0.)
+        return dict(position=v, orientation=dict(w_val=1., x_val=0., y_val=0., z_val=0.),
+                    linear_velocity=v, angular_velocity=v, linear_acceleration=v, angular_acceleration=v)
+
+    def moveByVelocityZ(self, vx, vy, z, duration, drivetrain, yaw_mode, vehicle_name):
+        time.sleep(duration)
+        return True
+
+
+class SharedConnection(object):
+    """A single msgpackrpc.Client used from several threads, one call at a time."""
+
+    def __init__(self, address):
+        import msgpackrpc
+        self.rpc = msgpackrpc.Client(msgpackrpc.Address(*address), timeout=30,
+                                     pack_encoding='utf-8', unpack_encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def call(self, method, *args):
+        with self.lock:
+            return self.rpc.call(method, *args)
+
+    def close(self):
+        self.rpc.close()
+
+
+def step_latencies(rpc, steps, move_s):
+    stop = threading.Event()
+
+    def grab_images():
+        while not stop.is_set():
+            rpc.call('simGetImages', [dict(camera_name='front', image_type=0)], '')
+
+    images = threading.Thread(target=grab_images, daemon=True)
+    images.start()
+    latencies = []
+    for _ in range(steps):
+        tic = time.perf_counter()
+        rpc.call('simGetGroundTruthKinematics', '')
+        rpc.call('moveByVelocityZ', 0.5, 0., -0.9, move_s, 1, dict(is_rate=False, yaw_or_rate=0.), '')
+        latencies.append(time.perf_counter() - tic)
+    stop.set()
+    images.join()
+    return 1000. * np.array(latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--move_ms', type=float, default=5.)
+    parser.add_argument('--render_ms', type=float, default=20.)
+    parser.add_argument('--image_kb', type=int, default=1200)
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', 0), args.render_ms, args.image_kb)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = server.server_address
+
+    for name, rpc in [('shared connection', SharedConnection(address)),
+                      ('RpcPool lanes', RpcPool(*address))]:
+        lat = step_latencies(rpc, args.steps, args.move_ms / 1000.)
+        print("{:<18} step latency p50 {:6.1f} ms  p99 {:6.1f} ms  max {:6.1f} ms".format(
+            name, np.percentile(lat, 50), np.percentile(lat, 99), lat.max()))
+        rpc.close()
+
+    def sequential_and_many(pool, requests, n=20):
+        tic = time.perf_counter()
+        for _ in range(n):
+            for request in requests:
+                pool.call(*request)
+        sequential = (time.perf_counter() - tic) / n
+        tic = time.perf_counter()
+        for _ in range(n):
+            call_many(pool, requests)
+        return 1000. * sequential, 1000. * (time.perf_counter() - tic) / n
+
+    image = ('simGetImages', [dict(camera_name='front', image_type=0)], '')
+    for name, lanes, requests in [('kinematics + images', None, [('simGetGroundTruthKinematics', ''), image]),
+                                  ('2 x images, 2 image connections', dict(images=2), [image, image])]:
+        pool = RpcPool(*address, lanes=lanes)
+        print("{:<32} sequential {:6.1f} ms  call_many {:6.1f} ms".format(
+            name, *sequential_and_many(pool, requests)))
+        pool.close()
@@ -0,0 +1,74 @@
+"""SAC gradient steps per second for the default AirSim observation
+(4x112x112 depth stack + 7-d inform, Discrete(8) actions), eager vs
+torch.compile'd losses, with and without self-attention.
+
+The update is SAC.make_update, fed a fixed replay-shaped batch; compile time
+is excluded (the first steps are warm-up).
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.sac_update --batch_size 256 --device cpu
+"""
+import argparse
+import time
+from copy import deepcopy
+
+import gym
+import numpy as np
+import torch
+
+from SAC import SACActorCritic, make_update
+from common.metrics import MetricsAccumulator
+
+OBS_SHAPE = (4, 112, 112)
+INFORM_DIM = 7
+
+
+class NullLogger(object):
+    def add_scalars(self, *args):
+        pass
+
+
+def make_batch(batch_size, device):
+    obs = lambda: [torch.randint(0, 256, (batch_size,) + OBS_SHAPE, device=device).float(),
+                   torch.randn(batch_size, INFORM_DIM, device=device)]
+    return {'obs': obs(), 'obs2': obs(),
+            'act': torch.randint(0, 8, (batch_size, 1), device=device),
+            'rew': torch.randn(batch_size, device=device),
+            'done': torch.zeros(batch_size, device=device)}
+
+
+def steps_per_second(sattn, compile, batch_size, repeat, warmup, device):
+    torch.manual_seed(0)
+    observation_space = gym.spaces.Box(0, 255, OBS_SHAPE, dtype=np.float32)
+    ac = SACActorCritic(observation_space, gym.spaces.Discrete(8), device, sattn=sattn)
+    ac_target = deepcopy(ac)
+    for p in ac_target.parameters():
+        p.requires_grad = False
+    update = make_update(ac, ac_target, True, 0.99, compile=compile)
+
+    data, metrics = make_batch(batch_size, device), MetricsAccumulator(NullLogger(), flush_every=10)
+    for t in range(warmup):
+        update(data, metrics, t)
+    start = time.perf_counter()
+    for t in range(repeat):
+        update(data, metrics, t)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return repeat / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    print("device={} batch_size={}".format(args.device, args.batch_size))
+    for sattn in (False, True):
+        for compile in (False, True):
+            rate = steps_per_second(sattn, compile, args.batch_size, args.repeat, args.warmup, device)
+            print("sattn={!s:<5} compile={!s:<5} {:8.2f} grad steps/s".format(sattn, compile, rate))
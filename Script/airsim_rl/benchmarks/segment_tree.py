@@ -0,0 +1,80 @@
+"""Benchmark the array-backed segment trees and the prioritized replay
+buffer built on top of them.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.segment_tree --capacity 1000000 --batch_size 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from Rainbow.common.replay_buffer import SumSegmentTree, PrioritizedReplayBuffer
+
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_tree(capacity, batch_size, repeat):
+    it_capacity = 1
+    while it_capacity < capacity:
+        it_capacity *= 2
+    tree = SumSegmentTree(it_capacity)
+    tree[np.arange(capacity)] = np.random.random(capacity)
+
+    idxes = np.random.randint(0, capacity, size=batch_size)
+    prios = np.random.random(batch_size)
+    masses = np.random.random(batch_size) * tree.sum()
+
+    def update_loop():
+        for idx, prio in zip(idxes, prios):
+            tree[idx] = prio
+
+    def update_batch():
+        tree[idxes] = prios
+
+    def find_loop():
+        return [tree.find_prefixsum_idx(m) for m in masses]
+
+    def find_batch():
+        return tree.find_prefixsum_idx(masses)
+
+    return {
+        'update (per-leaf loop)': timeit(update_loop, repeat),
+        'update (batched)': timeit(update_batch, repeat),
+        'find_prefixsum_idx (per-sample loop)': timeit(find_loop, repeat),
+        'find_prefixsum_idx (batched)': timeit(find_batch, repeat),
+    }
+
+
+def bench_buffer(capacity, batch_size, repeat):
+    buffer = PrioritizedReplayBuffer(capacity, alpha=0.6)
+    obs = np.zeros(7, dtype=np.float32)
+    for _ in range(capacity):
+        buffer.push(obs, 0, 0.0, obs, False)
+
+    def sample_and_update():
+        *_, weights, idxes = buffer.sample(batch_size, beta=0.4)
+        buffer.update_priorities(idxes, np.random.random(batch_size) + 1e-5)
+
+    return {'sample + update_priorities': timeit(sample_and_update, repeat)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capacity', type=int, default=1000000)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print("capacity={} batch_size={}".format(args.capacity, args.batch_size))
+    results = bench_tree(args.capacity, args.batch_size, args.repeat)
+    results.update(bench_buffer(args.capacity, args.batch_size, args.repeat))
+    for name, seconds in results.items():
+        print("{:<40s} {:10.3f} ms".format(name, seconds * 1e3))
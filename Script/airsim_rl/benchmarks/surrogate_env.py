@@ -0,0 +1,43 @@
+"""Env steps per second of gym_airsim.surrogate.VecAirSimSurrogate for a
+range of batch sizes (random discrete actions, auto-reset), and of the single
+AirSimSurrogateEnv the trainers use.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.surrogate_env --num_envs 1 8 32 128
+"""
+import argparse
+import time
+
+import numpy as np
+
+from gym_airsim.surrogate import VecAirSimSurrogate, AirSimSurrogateEnv
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_envs', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for num_envs in args.num_envs:
+        env = VecAirSimSurrogate(num_envs, control_mode="Discrete", seed=0)
+        env.reset()
+        episodes = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            _, _, done, _ = env.step(rng.randint(0, 8, size=(num_envs, 1)))
+            episodes += done.sum()
+        elapsed = time.perf_counter() - start
+        print("VecAirSimSurrogate num_envs={:<4} {:9.0f} env steps/s  ({} episodes)".format(
+            num_envs, num_envs * args.steps / elapsed, episodes))
+
+    env = AirSimSurrogateEnv(control_mode="Discrete", seed=0)
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        _, _, done, _ = env.step(np.array([[rng.randint(0, 8)]]))
+        if done:
+            env.reset()
+    print("AirSimSurrogateEnv           {:9.0f} env steps/s".format(
+        args.steps / (time.perf_counter() - start)))
@@ -0,0 +1,124 @@
+"""Latency of the non-network parts of a SAC gradient step: optimizer steps,
+critic freezing and the polyak update.
+
+'legacy' is the old SAC.update() path: default Adam, requires_grad toggled
+per critic parameter around the policy step, and a per-parameter
+mul_/add_ polyak loop. 'fused' is common.train_utils: make_adam,
+backward_to and TargetUpdater. The networks are SAC-shaped stand-ins
+(4x112x112 conv trunk + 512-unit head for pi, q1 and q2) so the benchmark
+runs without AirSim; a small batch keeps the forward/backward cost low.
+
+Run from Script/airsim_rl:
+
+    python -m benchmarks.update_step --batch_size 8
+"""
+import argparse
+import time
+from copy import deepcopy
+
+import torch
+import torch.nn as nn
+from torch.optim import Adam
+
+from common.train_utils import make_adam, TargetUpdater, backward_to
+
+
+def make_net(num_outputs):
+    return nn.Sequential(
+        nn.Conv2d(4, 16, 8, stride=4), nn.ReLU(),
+        nn.Conv2d(16, 32, 4, stride=2), nn.ReLU(),
+        nn.Conv2d(32, 64, 3, stride=2), nn.ReLU(),
+        nn.Conv2d(64, 32, 1, stride=1), nn.ReLU(),
+        nn.Flatten(),
+        nn.Linear(800, 512), nn.ReLU(),
+        nn.Linear(512, num_outputs),
+    )
+
+
+class StandIn(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.pi = make_net(8)
+        self.q1 = make_net(8)
+        self.q2 = make_net(8)
+
+
+def make_step(fused, device, polyak=0.995):
+    torch.manual_seed(0)
+    ac = StandIn().to(device)
+    ac_target = deepcopy(ac)
+    for p in ac_target.parameters():
+        p.requires_grad = False
+    q_params = list(ac.q1.parameters()) + list(ac.q2.parameters())
+    pi_params = list(ac.pi.parameters())
+
+    if fused:
+        q_optimizer, pi_optimizer = make_adam(q_params, lr=5e-4), make_adam(pi_params, lr=5e-4)
+        target_updater = TargetUpdater(ac, ac_target)
+    else:
+        q_optimizer, pi_optimizer = Adam(q_params, lr=5e-4), Adam(pi_params, lr=5e-4)
+
+    def step(o, timings):
+        start = time.perf_counter()
+        q_optimizer.zero_grad()
+        loss_q = ac.q1(o).pow(2).mean() + ac.q2(o).pow(2).mean()
+        if fused:
+            backward_to(loss_q, q_params)
+        else:
+            loss_q.backward()
+        t0 = time.perf_counter()
+        q_optimizer.step()
+        t1 = time.perf_counter()
+
+        if not fused:
+            for p in q_params:
+                p.requires_grad = False
+        pi_optimizer.zero_grad()
+        probs = ac.pi(o).softmax(-1)
+        loss_pi = -(probs * torch.min(ac.q1(o), ac.q2(o))).sum(-1).mean()
+        if fused:
+            backward_to(loss_pi, pi_params)
+        else:
+            loss_pi.backward()
+        t2 = time.perf_counter()
+        pi_optimizer.step()
+        if not fused:
+            for p in q_params:
+                p.requires_grad = True
+        t3 = time.perf_counter()
+
+        if fused:
+            target_updater.soft(1 - polyak)
+        else:
+            with torch.no_grad():
+                for p, p_targ in zip(ac.parameters(), ac_target.parameters()):
+                    p_targ.data.mul_(polyak)
+                    p_targ.data.add_((1 - polyak) * p.data)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        t4 = time.perf_counter()
+        timings['optimizer steps'] += (t1 - t0) + (t3 - t2)
+        timings['polyak'] += t4 - t3
+        timings['total'] += t4 - start
+
+    return step
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    o = torch.rand(args.batch_size, 4, 112, 112, device=device)
+    print("device={} batch_size={}".format(args.device, args.batch_size))
+    for fused in (False, True):
+        step = make_step(fused, device)
+        timings = dict.fromkeys(('optimizer steps', 'polyak', 'total'), 0.)
+        step(o, dict(timings))
+        for _ in range(args.repeat):
+            step(o, timings)
+        print(('fused ' if fused else 'legacy') + '  ' + '   '.join(
+            "{} {:7.3f} ms".format(k, v / args.repeat * 1e3) for k, v in timings.items()))
@@ -0,0 +1,199 @@
+"""
+Asynchronous, resumable checkpoints.
+
+``CheckpointManager.save`` takes ``state_dict()`` snapshots of the given
+modules / optimizers on the CPU (the only part that runs on the training
+thread) and hands them to a writer thread, which ``torch.save``s to a
+temporary file and atomically renames it into place, so a crash never leaves
+a truncated checkpoint behind. Only the last ``keep_last`` periodic
+checkpoints are kept, plus ``<prefix>_best.pt`` for the best score (success
+rate) seen so far.
+
+Every checkpoint also stores the Python / NumPy / torch RNG states and any
+plain values passed in (step counters, episode deques, ...), so
+
+    ckpt = checkpoints.load()               # latest periodic checkpoint
+    extra = checkpoints.restore({'ac': ac, 'q_optimizer': q_optimizer}, ckpt)
+
+puts a run back where it stopped.
+"""
+import collections
+import glob
+import os
+import queue
+import random
+import re
+import threading
+
+import numpy as np
+import torch
+
+
+def _to_cpu(obj):
+    """Copy of ``obj`` with every tensor detached and cloned to the CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, collections.deque):
+        return collections.deque((_to_cpu(v) for v in obj), maxlen=obj.maxlen)
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def atomic_save(obj, path):
+    tmp = path + '.tmp'
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, map_location='cpu'):
+    # our own files: they hold RNG states and plain Python values as well
+    try:
+        return torch.load(path, map_location=map_location, weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no weights_only
+        return torch.load(path, map_location=map_location)
+
+
+def list_checkpoints(save_dir, prefix='checkpoint'):
+    """[(step, path)] of the periodic checkpoints in ``save_dir``, oldest first."""
+    pattern = re.compile(re.escape(prefix) + r'_(\d+)\.pt$')
+    found = []
+    for path in glob.glob(os.path.join(str(save_dir), prefix + '_*.pt')):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def latest_checkpoint(save_dir, prefix='checkpoint'):
+    found = list_checkpoints(save_dir, prefix)
+    return found[-1][1] if found else None
+
+
+class CheckpointManager(object):
+    def __init__(self, save_dir, keep_last=3, prefix='checkpoint', max_pending=2):
+        self.save_dir = str(save_dir)
+        self.keep_last = keep_last
+        self.prefix = prefix
+        self.best_score = None
+        os.makedirs(self.save_dir, exist_ok=True)
+        # periodic checkpoints already on disk (resumed run), oldest first
+        self.saved = [path for _, path in list_checkpoints(self.save_dir, prefix)]
+
+        # bounded, so a slow disk throttles training instead of filling RAM
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='CheckpointManager', daemon=True)
+        self._thread.start()
+
+    def path(self, step):
+        return os.path.join(self.save_dir, '{}_{}.pt'.format(self.prefix, step))
+
+    @property
+    def best_path(self):
+        return os.path.join(self.save_dir, self.prefix + '_best.pt')
+
+    def snapshot(self, step, objects, **extra):
+        """CPU copy of ``objects`` (anything with ``state_dict()`` is stored as its
+        state dict) plus ``extra`` values, the step and the RNG states."""
+        state = {name: obj.state_dict() if hasattr(obj, 'state_dict') else obj
+                 for name, obj in objects.items()}
+        state.update(extra)
+        state = _to_cpu(state)
+        state['step'] = step
+        state['best_score'] = self.best_score
+        state['rng'] = get_rng_state()
+        return state
+
+    def save(self, step, objects, **extra):
+        """Queue a periodic checkpoint; the oldest beyond ``keep_last`` is removed."""
+        self._check()
+        path = self.path(step)
+        self._queue.put((path, self.snapshot(step, objects, **extra)))
+        if path not in self.saved:
+            self.saved.append(path)
+        while len(self.saved) > self.keep_last:
+            self._queue.put((self.saved.pop(0), None))
+
+    def save_best(self, step, objects, score, **extra):
+        """Queue ``<prefix>_best.pt`` if ``score`` beats the best so far."""
+        self._check()
+        if self.best_score is not None and score <= self.best_score:
+            return False
+        self.best_score = score
+        self._queue.put((self.best_path, self.snapshot(step, objects, score=score, **extra)))
+        return True
+
+    def latest(self):
+        return latest_checkpoint(self.save_dir, self.prefix)
+
+    def load(self, path=None, map_location='cpu'):
+        """Load ``path`` (default: the latest periodic checkpoint), or None."""
+        self.wait()
+        path = path or self.latest()
+        if path is None:
+            return None
+        checkpoint = load_checkpoint(path, map_location)
+        if checkpoint.get('best_score') is not None:
+            self.best_score = checkpoint['best_score']
+        return checkpoint
+
+    def restore(self, objects, checkpoint):
+        """``load_state_dict`` every object in ``objects`` from ``checkpoint``, reset
+        the RNGs and return the remaining (non-state-dict) entries."""
+        for name, obj in objects.items():
+            obj.load_state_dict(checkpoint[name])
+        if 'rng' in checkpoint:
+            set_rng_state(checkpoint['rng'])
+        return {k: v for k, v in checkpoint.items() if k not in objects and k != 'rng'}
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("writing a checkpoint failed") from error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, state = item
+                if state is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    atomic_save(state, path)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,39 @@
+"""
+Deferred imports for heavy or simulator-only dependencies.
+
+``lazy_import(name)`` returns a module object whose first attribute access
+imports ``name``; until then nothing is loaded, so scripts and worker
+processes that never touch e.g. matplotlib, pyglet or airsim do not pay
+for (or need) them:
+
+    plt = lazy_import('matplotlib.pyplot')
+    ...
+    plt.figure()    # matplotlib is imported here
+
+A missing package only raises (ImportError) where it is used.
+``python -m benchmarks.import_time`` checks the resulting start-up times.
+"""
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        # later lookups hit the copied attributes without __getattr__
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """``name`` itself when it is already imported, else a LazyModule."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -0,0 +1,64 @@
+"""
+Training metrics without a host sync per gradient step.
+
+Trainers ``add`` losses and norms as tensors; the accumulator keeps running
+sums on the tensors' device and only moves them to the host (one sync) when
+it writes the interval means to the SummaryWriter every ``flush_every``
+steps. Grad norms come from one ``torch._foreach_norm`` call instead of a
+Python loop of ``x.grad.norm()``.
+"""
+import collections
+
+import torch
+
+
+def mean_grad_norm(params):
+    """Mean L2 norm of the gradients of ``params``, as a 0-d tensor on their device."""
+    params = list(params)
+    grads = [p.grad for p in params if p.grad is not None]
+    if not grads:
+        return torch.zeros((), device=params[0].device if params else None)
+    return torch.stack(torch._foreach_norm(grads)).mean()
+
+
+class MetricsAccumulator(object):
+    def __init__(self, logger, flush_every=100):
+        self.logger = logger
+        self.flush_every = flush_every
+        self.sums = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.steps = 0
+
+    def add(self, name, value):
+        """Accumulate a scalar; tensors stay on their device and out of the graph."""
+        if torch.is_tensor(value):
+            value = value.detach().float().reshape(())
+            if name in self.sums:
+                self.sums[name].add_(value)
+            else:
+                self.sums[name] = value.clone()
+        else:
+            self.sums[name] = self.sums.get(name, 0.) + value
+        self.counts[name] += 1
+
+    def step(self, t):
+        """Count one training step and flush every ``flush_every`` steps."""
+        self.steps += 1
+        if self.steps % self.flush_every == 0:
+            self.flush(t)
+
+    def flush(self, t):
+        if not self.sums:
+            return
+        names = list(self.sums)
+        values = [self.sums[name] for name in names]
+        tensors = [i for i, v in enumerate(values) if torch.is_tensor(v)]
+        if tensors:
+            device = values[tensors[0]].device
+            host = torch.stack([values[i].to(device) for i in tensors]).tolist()
+            for i, v in zip(tensors, host):
+                values[i] = v
+        for name, value in zip(names, values):
+            self.logger.add_scalars(name, {name: value / self.counts[name]}, t)
+        self.sums.clear()
+        self.counts.clear()
@@ -0,0 +1,48 @@
+import collections
+
+
+class NStepTransitionAssembler(object):
+    """
+    Turns the 1-step transitions coming out of ``env.step`` into n-step ones
+
+        (s_t, a_t, r_t + gamma * r_t+1 + ... + gamma^(k-1) * r_t+k-1, s_t+k, done)
+
+    with k = n_step, or fewer when the episode ends inside the window (the
+    return is truncated at ``done`` and every pending transition is flushed
+    with done=True). Non-terminal transitions always span exactly n_step steps,
+    so the bootstrap term of any replay buffer fed by this is discounted by
+    ``self.discount`` (gamma ** n_step) instead of gamma.
+
+    Only references to the observations are kept in the window; frames are
+    copied once, by the replay buffer that stores the emitted transitions.
+    """
+
+    def __init__(self, n_step, gamma):
+        assert n_step >= 1
+        self.n_step = n_step
+        self.gamma = gamma
+        self.discount = gamma ** n_step
+        self.window = collections.deque(maxlen=n_step)
+
+    def reset(self):
+        self.window.clear()
+
+    def push(self, state, action, reward, next_state, done):
+        """Add one env step and return the n-step transitions it completes."""
+        self.window.append((state, action, reward))
+        ready = []
+        if done:
+            while self.window:
+                ready.append(self._assemble(next_state, done))
+                self.window.popleft()
+        elif len(self.window) == self.n_step:
+            ready.append(self._assemble(next_state, done))
+            self.window.popleft()
+        return ready
+
+    def _assemble(self, next_state, done):
+        ret = 0.
+        for _, _, reward in reversed(self.window):
+            ret = reward + self.gamma * ret
+        state, action, _ = self.window[0]
+        return state, action, ret, next_state, done
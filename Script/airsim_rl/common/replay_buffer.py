@@ -0,0 +1,199 @@
+import time
+
+import numpy as np
+import torch
+
+from Rainbow.common.replay_buffer import SumSegmentTree
+
+
+def combined_shape(length, shape=None):
+    if shape is None:
+        return (length,)
+    return (length, shape) if np.isscalar(shape) else (length, *shape)
+
+
+class TransitionStorage(object):
+    """
+    Preallocated, typed ring storage for (state, action, reward, next_state, done).
+
+    A state is either a single array of shape ``obs_shape`` or, when
+    ``inform_dim`` is given, the AirSim ``[img, inform]`` pair. Images are kept
+    in ``obs_dtype`` (uint8 for depth/pixel stacks), inform vectors in float32.
+    """
+
+    def __init__(self, capacity, obs_shape, inform_dim=None, obs_dtype=np.uint8,
+                 act_shape=None, act_dtype=np.int64):
+        self.capacity = capacity
+        self.inform_dim = inform_dim
+        self.obs_buf = np.zeros(combined_shape(capacity, obs_shape), dtype=obs_dtype)
+        self.obs2_buf = np.zeros(combined_shape(capacity, obs_shape), dtype=obs_dtype)
+        if inform_dim is not None:
+            self.inform_buf = np.zeros(combined_shape(capacity, inform_dim), dtype=np.float32)
+            self.inform2_buf = np.zeros(combined_shape(capacity, inform_dim), dtype=np.float32)
+        self.act_buf = np.zeros(combined_shape(capacity, act_shape), dtype=act_dtype)
+        self.rew_buf = np.zeros(capacity, dtype=np.float32)
+        self.done_buf = np.zeros(capacity, dtype=np.float32)
+        self.pos, self.size = 0, 0
+
+    def _store(self, state, action, reward, next_state, done):
+        idx = self.pos
+        if self.inform_dim is None:
+            self.obs_buf[idx] = state
+            self.obs2_buf[idx] = next_state
+        else:
+            self.obs_buf[idx] = state[0]
+            self.inform_buf[idx] = state[1]
+            self.obs2_buf[idx] = next_state[0]
+            self.inform2_buf[idx] = next_state[1]
+        self.act_buf[idx] = action
+        self.rew_buf[idx] = reward
+        self.done_buf[idx] = done
+        self.pos = (self.pos + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return idx
+
+    def _store_batch(self, states, actions, rewards, next_states, dones):
+        idxes = (self.pos + np.arange(len(actions))) % self.capacity
+        if self.inform_dim is None:
+            self.obs_buf[idxes] = states
+            self.obs2_buf[idxes] = next_states
+        else:
+            self.obs_buf[idxes] = states[0]
+            self.inform_buf[idxes] = states[1]
+            self.obs2_buf[idxes] = next_states[0]
+            self.inform2_buf[idxes] = next_states[1]
+        self.act_buf[idxes] = actions
+        self.rew_buf[idxes] = rewards
+        self.done_buf[idxes] = dones
+        self.pos = (self.pos + len(actions)) % self.capacity
+        self.size = min(self.size + len(actions), self.capacity)
+        return idxes
+
+    def push(self, state, action, reward, next_state, done):
+        self._store(state, action, reward, next_state, done)
+
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        """Store a batch of transitions, laid out like the output of ``_encode_sample``."""
+        self._store_batch(states, actions, rewards, next_states, dones)
+
+    def _encode_sample(self, idxes):
+        if self.inform_dim is None:
+            states = self.obs_buf[idxes]
+            next_states = self.obs2_buf[idxes]
+        else:
+            states = [self.obs_buf[idxes], self.inform_buf[idxes]]
+            next_states = [self.obs2_buf[idxes], self.inform2_buf[idxes]]
+        return states, self.act_buf[idxes], self.rew_buf[idxes], next_states, self.done_buf[idxes]
+
+    def __len__(self):
+        return self.size
+
+
+class ReplayBuffer(TransitionStorage):
+    """
+    Uniform replay over the columnar storage.
+
+    Indices are drawn with one ``np.random.randint`` call and each column is
+    gathered once, straight into tensors on ``device``. The time spent in
+    ``sample`` is accumulated so trainers can report sampling throughput.
+    """
+
+    def __init__(self, capacity, obs_shape, inform_dim=None, obs_dtype=np.uint8,
+                 act_shape=None, act_dtype=np.int64, device=torch.device("cpu")):
+        super(ReplayBuffer, self).__init__(capacity, obs_shape, inform_dim,
+                                           obs_dtype, act_shape, act_dtype)
+        self.device = device
+        self.sample_time = 0.
+        self.sampled = 0
+
+    def _to_tensor(self, x):
+        x = torch.from_numpy(x)
+        if self.device.type == "cuda":
+            x = x.pin_memory()
+        return x.to(self.device, non_blocking=True)
+
+    def sample(self, batch_size):
+        start = time.perf_counter()
+        idxes = np.random.randint(0, self.size, size=batch_size)
+        state, action, reward, next_state, done = self._encode_sample(idxes)
+        if self.inform_dim is None:
+            state = self._to_tensor(state).float()
+            next_state = self._to_tensor(next_state).float()
+        else:
+            state = [self._to_tensor(state[0]).float(), self._to_tensor(state[1])]
+            next_state = [self._to_tensor(next_state[0]).float(), self._to_tensor(next_state[1])]
+        batch = (state, self._to_tensor(action), self._to_tensor(reward),
+                 next_state, self._to_tensor(done))
+        self.sample_time += time.perf_counter() - start
+        self.sampled += batch_size
+        return batch
+
+    def throughput(self, reset=True):
+        """Transitions sampled per second of ``sample`` time since the last reset."""
+        rate = self.sampled / self.sample_time if self.sample_time > 0 else 0.
+        if reset:
+            self.sample_time, self.sampled = 0., 0
+        return rate
+
+
+class PrioritizedReplayBuffer(TransitionStorage):
+    """
+    Proportional prioritized replay on top of a sum-tree.
+
+    Pushing and sampling are O(log N): new transitions get the running max
+    priority, and importance weights are computed only for the sampled
+    indices (normalized by the largest weight in the batch).
+    """
+
+    def __init__(self, capacity, obs_shape, inform_dim=None, prob_alpha=0.6,
+                 obs_dtype=np.uint8, act_shape=None, act_dtype=np.int64):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, obs_shape, inform_dim,
+                                                      obs_dtype, act_shape, act_dtype)
+        self.prob_alpha = prob_alpha
+
+        it_capacity = 1
+        while it_capacity < capacity:
+            it_capacity *= 2
+        self._it_sum = SumSegmentTree(it_capacity)
+        self.max_prio = 1.0
+
+    def push(self, state, action, reward, next_state, done):
+        idx = self._store(state, action, reward, next_state, done)
+        self._it_sum[idx] = self.max_prio ** self.prob_alpha
+
+    def push_batch(self, states, actions, rewards, next_states, dones, priorities=None):
+        """
+        Store a batch of transitions with their initial priorities (e.g. TD errors
+        computed by the actor that collected them); without priorities the batch
+        gets the running max priority. Returns the slots written.
+        """
+        idxes = self._store_batch(states, actions, rewards, next_states, dones)
+        if priorities is None:
+            priorities = self.max_prio
+        else:
+            priorities = np.asarray(priorities, dtype=np.float64)
+            self.max_prio = max(self.max_prio, float(priorities.max()))
+        self._it_sum[idxes] = priorities ** self.prob_alpha
+        return idxes
+
+    def sample_indices(self, batch_size, beta=0.4):
+        """Sampled slots and their importance weights, without gathering the transitions."""
+        total = self._it_sum.sum()
+        mass = np.random.random(batch_size) * total
+        indices = np.minimum(self._it_sum.find_prefixsum_idx(mass), self.size - 1)
+
+        probs = self._it_sum[indices] / total
+        weights = (self.size * probs) ** (-beta)
+        weights /= weights.max()
+        weights = np.array(weights, dtype=np.float32)
+        return indices, weights
+
+    def sample(self, batch_size, beta=0.4):
+        indices, weights = self.sample_indices(batch_size, beta)
+        states, actions, rewards, next_states, dones = self._encode_sample(indices)
+        return states, actions, rewards, next_states, dones, indices, weights
+
+    def update_priorities(self, batch_indices, batch_priorities):
+        batch_priorities = np.asarray(batch_priorities, dtype=np.float64)
+        self._it_sum[batch_indices] = batch_priorities ** self.prob_alpha
+        self.max_prio = max(self.max_prio, float(batch_priorities.max()))
@@ -0,0 +1,95 @@
+"""
+Buffered scalar logging for the training scripts.
+
+``SummaryWriter.add_scalars(tag, {tag: v}, step)`` opens a separate
+sub-writer (and event file) per tag and writes every call through it.
+``ScalarWriter`` keeps the same ``add_scalars`` / ``add_scalar`` / ``close``
+API, but only appends to an in-memory list; a background thread drains the
+list every ``flush_secs`` seconds into one tensorboardX event file and,
+optionally, into baselines.logger output formats ('csv', 'json', 'log',
+'stdout').
+
+    logger = ScalarWriter(str(log_dir), flush_secs=10, formats=('csv',))
+    logger.add_scalars('success_rate', {'success_rate': 0.5}, num_epi)
+"""
+import atexit
+import threading
+import time
+
+from tensorboardX import SummaryWriter
+
+
+class ScalarWriter(object):
+    def __init__(self, log_dir, flush_secs=10, formats=(), max_pending=100000):
+        self.log_dir = log_dir
+        self.flush_secs = flush_secs
+        self.max_pending = max_pending
+        self.writer = SummaryWriter(log_dir, flush_secs=flush_secs)
+        self.kv_writers = []
+        if formats:
+            from baselines import logger as baselines_logger
+            self.kv_writers = [baselines_logger.make_output_format(f, log_dir) for f in formats]
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='ScalarWriter', daemon=True)
+        self._thread.start()
+        # the scripts rarely call close(); don't lose the last interval at exit
+        atexit.register(self.close)
+
+    def add_scalar(self, tag, scalar_value, global_step=None, walltime=None):
+        if hasattr(scalar_value, 'item'):
+            scalar_value = scalar_value.item()
+        item = (tag, float(scalar_value), global_step, walltime or time.time())
+        with self._lock:
+            self._pending.append(item)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def add_scalars(self, main_tag, tag_scalar_dict, global_step=None, walltime=None):
+        """Drop-in for SummaryWriter.add_scalars. A single-entry dict is logged
+        under ``main_tag``, several entries as ``main_tag/key``."""
+        walltime = walltime or time.time()
+        if len(tag_scalar_dict) == 1:
+            value, = tag_scalar_dict.values()
+            self.add_scalar(main_tag, value, global_step, walltime)
+        else:
+            for key, value in tag_scalar_dict.items():
+                self.add_scalar(main_tag + '/' + key, value, global_step, walltime)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        with self._write_lock:
+            for tag, value, step, walltime in pending:
+                self.writer.add_scalar(tag, value, step, walltime)
+            self.writer.flush()
+            if self.kv_writers:
+                # one row per flush: the latest value of every tag
+                kvs = {tag: value for tag, value, _, _ in pending}
+                for kv_writer in self.kv_writers:
+                    kv_writer.writekvs(kvs)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_secs)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self.writer.close()
+        for kv_writer in self.kv_writers:
+            if hasattr(kv_writer, 'close'):
+                kv_writer.close()
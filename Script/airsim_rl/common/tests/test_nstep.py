@@ -0,0 +1,87 @@
+import numpy as np
+
+from common.nstep import NStepTransitionAssembler
+from common.replay_buffer import TransitionStorage
+
+
+def test_nstep_return():
+    nstep = NStepTransitionAssembler(3, 0.9)
+
+    assert nstep.push(0, 10, 1.0, 1, False) == []
+    assert nstep.push(1, 11, 2.0, 2, False) == []
+    ready = nstep.push(2, 12, 3.0, 3, False)
+
+    assert len(ready) == 1
+    state, action, ret, next_state, done = ready[0]
+    assert (state, action, next_state, done) == (0, 10, 3, False)
+    assert np.isclose(ret, 1.0 + 0.9 * 2.0 + 0.81 * 3.0)
+    assert np.isclose(nstep.discount, 0.729)
+
+    # the window slides by one step
+    state, action, ret, next_state, done = nstep.push(3, 13, 4.0, 4, False)[0]
+    assert (state, action, next_state, done) == (1, 11, 4, False)
+    assert np.isclose(ret, 2.0 + 0.9 * 3.0 + 0.81 * 4.0)
+
+
+def test_episode_ends_before_n():
+    nstep = NStepTransitionAssembler(3, 0.9)
+
+    assert nstep.push(0, 10, 1.0, 1, False) == []
+    ready = nstep.push(1, 11, 2.0, 2, True)
+
+    # every pending transition is flushed, truncated at done
+    assert len(ready) == 2
+    state, action, ret, next_state, done = ready[0]
+    assert (state, action, next_state, done) == (0, 10, 2, True)
+    assert np.isclose(ret, 1.0 + 0.9 * 2.0)
+    state, action, ret, next_state, done = ready[1]
+    assert (state, action, next_state, done) == (1, 11, 2, True)
+    assert np.isclose(ret, 2.0)
+    assert len(nstep.window) == 0
+
+    # the next episode does not see the previous one's rewards
+    nstep.push(5, 15, 7.0, 6, False)
+    nstep.push(6, 16, 0.0, 7, False)
+    state, action, ret, next_state, done = nstep.push(7, 17, 0.0, 8, False)[0]
+    assert (state, action) == (5, 15)
+    assert np.isclose(ret, 7.0)
+
+
+def test_reset():
+    nstep = NStepTransitionAssembler(2, 0.5)
+
+    nstep.push(0, 10, 1.0, 1, False)
+    nstep.reset()
+    assert nstep.push(3, 13, 2.0, 4, False) == []
+    state, action, ret, next_state, done = nstep.push(4, 14, 4.0, 5, False)[0]
+    assert (state, action, next_state) == (3, 13, 5)
+    assert np.isclose(ret, 2.0 + 0.5 * 4.0)
+
+
+def test_buffer_wrap():
+    # 2-step transitions of a 7-step episode into a 4-slot ring buffer
+    gamma = 0.5
+    nstep = NStepTransitionAssembler(2, gamma)
+    buffer = TransitionStorage(4, (1,), obs_dtype=np.float32)
+    rewards = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+
+    for t, r in enumerate(rewards):
+        done = t == len(rewards) - 1
+        for transition in nstep.push(np.array([t]), t, r, np.array([t + 1]), done):
+            buffer.push(*transition)
+
+    # 7 transitions were stored (t = 0..6), slots hold t = 4, 5, 6, 3
+    assert len(buffer) == 4
+    assert buffer.pos == 3
+    assert list(buffer.obs_buf[:, 0]) == [4, 5, 6, 3]
+    assert list(buffer.act_buf) == [4, 5, 6, 3]
+    assert np.allclose(buffer.rew_buf, [5.0 + gamma * 6.0, 6.0 + gamma * 7.0, 7.0, 4.0 + gamma * 5.0])
+    assert list(buffer.obs2_buf[:, 0]) == [6, 7, 7, 5]
+    assert list(buffer.done_buf) == [0.0, 1.0, 1.0, 0.0]
+
+
+if __name__ == '__main__':
+    test_nstep_return()
+    test_episode_ends_before_n()
+    test_reset()
+    test_buffer_wrap()
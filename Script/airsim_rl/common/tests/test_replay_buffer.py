@@ -0,0 +1,92 @@
+import numpy as np
+
+from common.replay_buffer import PrioritizedReplayBuffer
+
+
+def filled_buffer(n, capacity=4, prob_alpha=0.6):
+    buffer = PrioritizedReplayBuffer(capacity, (2,), inform_dim=3, prob_alpha=prob_alpha,
+                                     obs_dtype=np.float32)
+    for i in range(n):
+        state = [np.full(2, i), np.full(3, i)]
+        next_state = [np.full(2, i + 1), np.full(3, i + 1)]
+        buffer.push(state, i, float(i), next_state, False)
+    return buffer
+
+
+def test_importance_weights():
+    np.random.seed(0)
+    alpha, beta = 0.6, 0.4
+    buffer = filled_buffer(4, prob_alpha=alpha)
+    priorities = np.array([1.0, 2.0, 3.0, 4.0])
+    buffer.update_priorities(np.arange(4), priorities)
+
+    states, actions, rewards, next_states, dones, indices, weights = buffer.sample(256, beta)
+
+    probs = priorities ** alpha / (priorities ** alpha).sum()
+    expected = (4 * probs[indices]) ** (-beta)
+    expected /= expected.max()
+    assert weights.dtype == np.float32
+    assert np.allclose(weights, expected)
+    # the lowest priority gets the largest weight
+    assert np.isclose(weights[indices == 0].max(), 1.0)
+    # the transitions belong to the sampled slots
+    assert np.array_equal(actions, indices)
+    assert np.array_equal(states[0][:, 0], indices)
+    assert np.array_equal(next_states[1][:, 0], indices + 1)
+
+
+def test_sampling_follows_priorities():
+    np.random.seed(0)
+    buffer = filled_buffer(4)
+    buffer.update_priorities(np.arange(4), [0.0, 0.0, 1.0, 0.0])
+
+    indices = buffer.sample(64)[5]
+
+    assert np.all(indices == 2)
+
+
+def test_update_priorities_keeps_running_max():
+    alpha = 0.6
+    buffer = filled_buffer(3, prob_alpha=alpha)
+    assert np.isclose(buffer.max_prio, 1.0)
+
+    buffer.update_priorities(np.array([0, 1]), [5.0, 0.5])
+    assert np.isclose(buffer.max_prio, 5.0)
+    assert np.allclose(buffer._it_sum[np.array([0, 1, 2])], np.array([5.0, 0.5, 1.0]) ** alpha)
+
+    # lower priorities do not lower the max
+    buffer.update_priorities(np.array([0]), [2.0])
+    assert np.isclose(buffer.max_prio, 5.0)
+
+    # new transitions get the running max
+    state = [np.zeros(2), np.zeros(3)]
+    buffer.push(state, 3, 0.0, state, False)
+    assert np.isclose(buffer._it_sum[3], 5.0 ** alpha)
+
+
+def test_push_batch_priorities():
+    alpha = 0.6
+    buffer = filled_buffer(2, prob_alpha=alpha)
+    states = [np.zeros((3, 2)), np.zeros((3, 3))]
+
+    # wraps around: slots 2, 3, 0
+    idxes = buffer.push_batch(states, np.arange(3), np.zeros(3), states, np.zeros(3),
+                              priorities=[0.5, 7.0, 2.0])
+
+    assert list(idxes) == [2, 3, 0]
+    assert len(buffer) == 4
+    assert buffer.pos == 1
+    assert np.isclose(buffer.max_prio, 7.0)
+    assert np.allclose(buffer._it_sum[idxes], np.array([0.5, 7.0, 2.0]) ** alpha)
+    assert np.isclose(buffer._it_sum.sum(), 1.0 + 0.5 ** alpha + 7.0 ** alpha + 2.0 ** alpha)
+
+    # without priorities a batch gets the running max
+    idxes = buffer.push_batch(states, np.arange(3), np.zeros(3), states, np.zeros(3))
+    assert np.allclose(buffer._it_sum[idxes], 7.0 ** alpha)
+
+
+if __name__ == '__main__':
+    test_importance_weights()
+    test_sampling_follows_priorities()
+    test_update_priorities_keeps_running_max()
+    test_push_batch_priorities()
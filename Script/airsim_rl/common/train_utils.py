@@ -0,0 +1,59 @@
+"""
+Training-step helpers shared by the SAC / DQN / Rainbow trainers.
+
+- ``make_adam``: Adam with the fused kernel where the build supports it for
+  the parameters' device, the multi-tensor (foreach) one otherwise.
+- ``soft_update`` / ``TargetUpdater``: polyak averaging of a target network
+  as one ``torch._foreach_lerp_`` over all parameters instead of a Python
+  loop with two in-place ops per tensor.
+- ``backward_to``: backpropagate into a subset of parameters only, e.g. the
+  policy loss into the actor; frozen modules (critics) get neither gradient
+  computation nor ``.grad`` writes, with no per-parameter requires_grad
+  toggling.
+"""
+import torch
+from torch.optim import Adam
+
+
+def make_adam(params, lr, eps=1e-8):
+    params = list(params)
+    try:
+        return Adam(params, lr=lr, eps=eps, fused=True)
+    except (RuntimeError, TypeError):
+        # fused Adam not available for this device / torch version
+        return Adam(params, lr=lr, eps=eps, foreach=True)
+
+
+class TargetUpdater(object):
+    """Caches the (target, source) parameter lists of two identical modules."""
+
+    def __init__(self, current_model, target_model):
+        self.src = list(current_model.parameters())
+        self.targ = list(target_model.parameters())
+        assert len(self.src) == len(self.targ)
+
+    @torch.no_grad()
+    def soft(self, tau):
+        """target <- (1 - tau) * target + tau * source"""
+        torch._foreach_lerp_(self.targ, self.src, tau)
+
+    @torch.no_grad()
+    def hard(self):
+        torch._foreach_copy_(self.targ, self.src)
+
+
+def soft_update(current_model, target_model, tau):
+    """
+    Perform DDPG soft update (move target params toward source based on weight
+    factor tau)
+    Inputs:
+        target (torch.nn.Module): Net to copy parameters to
+        source (torch.nn.Module): Net whose parameters to copy
+        tau (float, 0 < x < 1): Weight factor for update
+    """
+    TargetUpdater(current_model, target_model).soft(tau)
+
+
+def backward_to(loss, params):
+    """``loss.backward()`` accumulating into ``params`` (a list) only."""
+    loss.backward(inputs=params)
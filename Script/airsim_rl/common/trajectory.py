@@ -0,0 +1,287 @@
+"""
+Recording AirSimEnv trajectories for offline RL / behaviour cloning.
+
+``TrajectoryRecorder`` wraps the env and keeps every episode: the depth
+frames as uint8 (each step adds one frame to the stack, so only the newest
+frame is stored), inform vectors, actions, rewards, dones, success and a
+snapshot of the active GameConfig. Finished episodes go to a writer thread
+that packs them into compressed chunk files (``chunk_<n>.npz``, written to a
+temp name and renamed), so ``step`` / ``reset`` never wait for the disk.
+
+``TrajectoryDataset`` opens a directory of chunks. Each chunk is unpacked
+once into a cache directory of .npy files that are then memory-mapped, and
+transitions are served as SAC replay batches (``sample_batch``) or whole
+episodes (``episode`` / ``episodes``). ``make_loader`` wraps it in a
+multi-worker DataLoader for offline training (offline_sac.py).
+
+    env = TrajectoryRecorder(AirSimEnv(), run_dir / 'trajectories')
+    ...
+    dataset = TrajectoryDataset(run_dir / 'trajectories')
+    batch = dataset.sample_batch(256, device)
+"""
+import atexit
+import copy
+import glob
+import json
+import os
+import queue
+import shutil
+import threading
+
+import numpy as np
+import torch
+
+ARRAYS = ('frames', 'inform', 'act', 'rew', 'done', 'ep_len')
+
+
+def chunk_paths(path):
+    return sorted(f for f in glob.glob(os.path.join(str(path), 'chunk_*.npz'))
+                  if not f.endswith('.tmp.npz'))
+
+
+def to_uint8(img):
+    return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+
+class TrajectoryRecorder(object):
+    def __init__(self, env, path, chunk_steps=10000):
+        self.env = env
+        self.path = str(path)
+        self.chunk_steps = chunk_steps
+        os.makedirs(self.path, exist_ok=True)
+        self.chunk_id = len(chunk_paths(self.path))
+        self.episode = None
+
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='TrajectoryRecorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __getattr__(self, name):
+        # everything else (success, stepN, seed, action_space, ...) is the env's
+        return getattr(self.env, name)
+
+    def game_config(self):
+        handler = getattr(self.env, 'game_config_handler', None)
+        config = {'level': getattr(self.env, 'level', None),
+                  'goal': np.asarray(getattr(self.env, 'goal', [])).tolist()}
+        if handler is not None:
+            config['game_config'] = copy.deepcopy(handler.cur_game_config.config_data)
+        return config
+
+    def reset(self, **kwargs):
+        if self.episode is not None and self.episode['rew']:
+            self._finish(complete=False)
+        obs = self.env.reset(**kwargs)
+        self.episode = {'frames': [to_uint8(f) for f in obs[0]],
+                        'inform': [np.asarray(obs[1], dtype=np.float32)],
+                        'act': [], 'rew': [], 'done': [],
+                        'config': self.game_config()}
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        if self.episode is not None:
+            self.episode['frames'].append(to_uint8(obs[0][-1]))
+            self.episode['inform'].append(np.asarray(obs[1], dtype=np.float32))
+            self.episode['act'].append(np.asarray(action, dtype=np.float32).reshape(-1))
+            self.episode['rew'].append(reward)
+            self.episode['done'].append(float(done))
+            if done:
+                self._finish(complete=True)
+        return obs, reward, done, info
+
+    def _finish(self, complete):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("writing trajectories failed") from error
+        episode, self.episode = self.episode, None
+        episode['success'] = bool(getattr(self.env, 'success', False)) if complete else False
+        episode['complete'] = complete
+        self._queue.put(episode)
+
+    def _run(self):
+        pending, steps = [], 0
+        while True:
+            episode = self._queue.get()
+            try:
+                if episode is not None:
+                    pending.append(episode)
+                    steps += len(episode['rew'])
+                if pending and (episode is None or steps >= self.chunk_steps):
+                    self._write_chunk(pending)
+                    pending, steps = [], 0
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+            if episode is None:
+                return
+
+    def _write_chunk(self, episodes):
+        stack = len(episodes[0]['frames']) - len(episodes[0]['rew'])
+        meta = [dict(config=ep['config'], success=ep['success'], complete=ep['complete'])
+                for ep in episodes]
+        arrays = dict(
+            frames=np.stack([f for ep in episodes for f in ep['frames']]),
+            inform=np.stack([x for ep in episodes for x in ep['inform']]),
+            act=np.stack([a for ep in episodes for a in ep['act']]),
+            rew=np.asarray([r for ep in episodes for r in ep['rew']], dtype=np.float32),
+            done=np.asarray([d for ep in episodes for d in ep['done']], dtype=np.float32),
+            ep_len=np.asarray([len(ep['rew']) for ep in episodes], dtype=np.int64),
+            meta=np.asarray(json.dumps({'stack': stack, 'episodes': meta})))
+        path = os.path.join(self.path, 'chunk_{:06d}'.format(self.chunk_id))
+        # np.savez appends .npz to names that lack it
+        np.savez_compressed(path + '.tmp.npz', **arrays)
+        os.replace(path + '.tmp.npz', path + '.npz')
+        self.chunk_id += 1
+
+    def flush(self):
+        """Block until every finished episode has been handed to the writer."""
+        self._queue.join()
+
+    def close(self):
+        """Write out the finished episodes (an unfinished one is dropped)."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+
+class TrajectoryDataset(object):
+    def __init__(self, path, cache_dir=None):
+        self.path = str(path)
+        self.cache_dir = str(cache_dir or os.path.join(self.path, 'cache'))
+        self.chunks = [self._open(f) for f in chunk_paths(self.path)]
+        if not self.chunks:
+            raise ValueError("no trajectory chunks in " + self.path)
+        self.stack = self.chunks[0]['stack']
+
+        # flat transition index -> (chunk, transition within chunk)
+        sizes = [len(c['rew']) for c in self.chunks]
+        self.chunk_of = np.repeat(np.arange(len(sizes)), sizes)
+        self.local = np.concatenate([np.arange(n) for n in sizes])
+        self.episode_index = [(i, e) for i, c in enumerate(self.chunks) for e in range(len(c['ep_len']))]
+
+    def _open(self, chunk_path):
+        name = os.path.basename(chunk_path)[:-len('.npz')]
+        cache = os.path.join(self.cache_dir, name)
+        if not os.path.isdir(cache):
+            # unpack once; the rename makes a half-written cache impossible
+            tmp = cache + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            with np.load(chunk_path) as data:
+                for key in ARRAYS:
+                    np.save(os.path.join(tmp, key + '.npy'), data[key])
+                with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                    f.write(str(data['meta']))
+            os.replace(tmp, cache)
+        chunk = {key: np.load(os.path.join(cache, key + '.npy'), mmap_mode='r') for key in ARRAYS}
+        with open(os.path.join(cache, 'meta.json')) as f:
+            meta = json.load(f)
+        chunk['stack'], chunk['episodes'] = meta['stack'], meta['episodes']
+
+        # per transition: first frame of its observation stack and its inform row
+        ep_len = np.asarray(chunk['ep_len'])
+        ep_start = np.concatenate([[0], np.cumsum(ep_len)[:-1]])
+        t = np.arange(ep_len.sum()) - np.repeat(ep_start, ep_len)
+        episode = np.repeat(np.arange(len(ep_len)), ep_len)
+        chunk['frame_idx'] = ep_start[episode] + episode * chunk['stack'] + t
+        chunk['inform_idx'] = ep_start[episode] + episode + t
+        chunk['ep_start'] = ep_start
+        return chunk
+
+    def __len__(self):
+        return len(self.chunk_of)
+
+    @property
+    def num_episodes(self):
+        return len(self.episode_index)
+
+    def get(self, idxs):
+        """Transitions ``idxs`` (flat indices) as numpy arrays, obs images in uint8."""
+        idxs = np.sort(np.asarray(idxs))
+        offsets = np.arange(self.stack)
+        out = {k: [] for k in ('obs', 'inform', 'obs2', 'inform2', 'act', 'rew', 'done')}
+        for c in np.unique(self.chunk_of[idxs]):
+            chunk = self.chunks[c]
+            local = self.local[idxs[self.chunk_of[idxs] == c]]
+            frame, inform = chunk['frame_idx'][local], chunk['inform_idx'][local]
+            out['obs'].append(chunk['frames'][frame[:, None] + offsets])
+            out['obs2'].append(chunk['frames'][frame[:, None] + offsets + 1])
+            out['inform'].append(chunk['inform'][inform])
+            out['inform2'].append(chunk['inform'][inform + 1])
+            out['act'].append(chunk['act'][local])
+            out['rew'].append(chunk['rew'][local])
+            out['done'].append(chunk['done'][local])
+        return {k: np.concatenate(v) for k, v in out.items()}
+
+    def sample_batch(self, batch_size=32, device=torch.device("cpu")):
+        """Uniform minibatch in the layout of SAC.ReplayBuffer.sample_batch."""
+        data = self.get(np.random.randint(0, len(self), size=batch_size))
+        as_tensor = lambda x: torch.as_tensor(x, dtype=torch.float32).to(device)
+        return dict(obs=[as_tensor(data['obs']), as_tensor(data['inform'])],
+                    obs2=[as_tensor(data['obs2']), as_tensor(data['inform2'])],
+                    act=as_tensor(data['act']), rew=as_tensor(data['rew']),
+                    done=as_tensor(data['done']))
+
+    def episode(self, i):
+        """Episode ``i``: frames (T + stack, H, W) uint8, inform (T + 1, d), act,
+        rew, done (T, ...) and its success / GameConfig metadata."""
+        c, e = self.episode_index[i]
+        chunk = self.chunks[c]
+        start, length = int(chunk['ep_start'][e]), int(chunk['ep_len'][e])
+        frame0, inform0 = start + e * chunk['stack'], start + e
+        out = dict(chunk['episodes'][e])
+        out.update(frames=np.asarray(chunk['frames'][frame0:frame0 + length + chunk['stack']]),
+                   inform=np.asarray(chunk['inform'][inform0:inform0 + length + 1]),
+                   act=np.asarray(chunk['act'][start:start + length]),
+                   rew=np.asarray(chunk['rew'][start:start + length]),
+                   done=np.asarray(chunk['done'][start:start + length]))
+        return out
+
+    def episodes(self):
+        for i in range(self.num_episodes):
+            yield self.episode(i)
+
+
+class TrajectoryBatches(torch.utils.data.IterableDataset):
+    """
+    Endless uniform minibatches from a trajectory directory, for a DataLoader
+    with ``batch_size=None``. Every worker opens the memory-mapped chunks
+    itself and returns images as uint8 tensors (a quarter of the float32
+    bytes through the worker queues); ``batch_to_device`` converts them.
+    """
+
+    def __init__(self, path, batch_size, seed=0):
+        super().__init__()
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def __iter__(self):
+        worker = torch.utils.data.get_worker_info()
+        rng = np.random.RandomState(self.seed + (worker.id if worker is not None else 0))
+        dataset = TrajectoryDataset(self.path)
+        while True:
+            data = dataset.get(rng.randint(0, len(dataset), size=self.batch_size))
+            yield {k: torch.from_numpy(np.ascontiguousarray(v)) for k, v in data.items()}
+
+
+def make_loader(path, batch_size, num_workers=4, seed=0, pin_memory=False):
+    # unpack the chunk caches once here, not concurrently in every worker
+    TrajectoryDataset(path)
+    return torch.utils.data.DataLoader(TrajectoryBatches(path, batch_size, seed), batch_size=None,
+                                       num_workers=num_workers, pin_memory=pin_memory,
+                                       persistent_workers=num_workers > 0,
+                                       prefetch_factor=4 if num_workers > 0 else None)
+
+
+def batch_to_device(data, device):
+    """A TrajectoryBatches item in the SAC.ReplayBuffer.sample_batch layout."""
+    to = lambda x: x.to(device, non_blocking=True).float()
+    return dict(obs=[to(data['obs']), to(data['inform'])],
+                obs2=[to(data['obs2']), to(data['inform2'])],
+                act=to(data['act']), rew=to(data['rew']), done=to(data['done']))
@@ -2,12 +2,15 @@ import random
 import os
 import subprocess
 import numpy as np
-import psutil
 import json
 from settings_folder import settings
 import msgs
 import time
-import airsim
+from common.lazy import lazy_import
+# only a few helpers need these; importing them here cost every trainer and
+# env worker the airsim / psutil start-up
+psutil = lazy_import('psutil')
+airsim = lazy_import('airsim')
 #from game_handling.game_handler_class import *
 
 def parse_data(file_name):
@@ -51,6 +51,8 @@ def get_config():
     # save
     parser.add_argument("--save_interval", type=int, default=20)
     parser.add_argument("--continue_last", default=False)
+    parser.add_argument("--keep_last", type=int, default=3, help='number of periodic checkpoints to keep')
+    parser.add_argument("--surrogate", action='store_true', default=False, help='use the NumPy surrogate of AirSimEnv')
 
     # log
     parser.add_argument("--log_interval", type=int, default=1)
@@ -1,46 +1,23 @@
 import math, random
 from gym_airsim.envs.AirGym import AirSimEnv
+from gym_airsim.surrogate import AirSimSurrogateEnv
 import gym
 import numpy as np
-from tensorboardX import SummaryWriter
+from common.scalar_writer import ScalarWriter
 import torch
 import torch.nn as nn
-import torch.optim as optim
 import torch.autograd as autograd
 import torch.nn.functional as F
 from pathlib import Path
 from collections import deque
 import os
 from tqdm import trange
-INCORPORATE=9
-
-class ReplayBuffer(object):
-    def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
-
-    def push(self, state, action, reward, next_state, done):
-
-        s = np.expand_dims(state[0], 0)
-        inform=np.expand_dims(state[1],0)
-        next_s= np.expand_dims(next_state[0], 0)
-        next_inform = np.expand_dims(next_state[1], 0)
-        state=[s,inform]
-        next_state=[next_s,next_inform]
-
-        self.buffer.append((state, action, reward, next_state, done))
-
-    def sample(self, batch_size):
-        state, action, reward, next_state, done = zip(*random.sample(self.buffer, batch_size))
-        s=[i[0] for i in state]
-        inform=[i[1] for i in state]
-        next_s=[i[0] for i in next_state]
-        next_inform = [i[1] for i in next_state]
-
-        return [np.concatenate(s),np.concatenate(inform)], action, reward, \
-               [np.concatenate(next_s),np.concatenate(next_inform)], done
-
-    def __len__(self):
-        return len(self.buffer)
+from common.replay_buffer import ReplayBuffer
+from common.nstep import NStepTransitionAssembler
+from common.train_utils import make_adam, soft_update
+from common.metrics import MetricsAccumulator
+from common.checkpoint import CheckpointManager
+INCORPORATE=7
 
 class Flatten(nn.Module):
     def forward(self, x):
@@ -100,24 +77,17 @@ class CnnDQN(nn.Module):
 
 
 def compute_td_loss(batch_size):
+    # the buffer hands back tensors already on the training device
     state, action, reward, next_state, done = replay_buffer.sample(batch_size)
-    state = [Variable(torch.as_tensor(np.float32(state[0]), dtype=torch.float32)),
-             Variable(torch.as_tensor(np.float32(state[1]), dtype=torch.float32))]
-    next_state = [Variable(torch.as_tensor(np.float32(next_state[0]), dtype=torch.float32)),
-                  Variable(torch.as_tensor(np.float32(next_state[1]), dtype=torch.float32))]
-
-    action = Variable(torch.as_tensor(action).long())
-    reward = Variable(torch.as_tensor(reward, dtype=torch.float32))
-    done = Variable(torch.as_tensor(done, dtype=torch.float32))
     q_values = current_model(state)
     next_q_values = current_model(next_state)
     next_q_state_values = target_model(next_state)
 
     q_value = q_values.gather(1, action.unsqueeze(1)).squeeze(1)
     next_q_value = next_q_state_values.gather(1, torch.max(next_q_values, 1)[1].unsqueeze(1)).squeeze(1)
-    expected_q_value = reward + gamma * next_q_value * (1 - done)
+    expected_q_value = reward + nstep.discount * next_q_value * (1 - done)
 
-    loss = F.smooth_l1_loss(q_value, Variable(expected_q_value.data).detach())
+    loss = F.smooth_l1_loss(q_value, expected_q_value.detach())
 
     #loss = (q_value - Variable(expected_q_value.data).detach()).pow(2).mean()
 
@@ -129,18 +99,6 @@ def compute_td_loss(batch_size):
 
     return loss
 
-def soft_update(current_model, target_model, tau):
-    """
-    Perform DDPG soft update (move target params toward source based on weight
-    factor tau)
-    Inputs:
-        target (torch.nn.Module): Net to copy parameters to
-        source (torch.nn.Module): Net whose parameters to copy
-        tau (float, 0 < x < 1): Weight factor for update
-    """
-    for target_param, param in zip(target_model.parameters(), current_model.parameters()):
-        target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
-
 
 # https://github.com/ikostrikov/pytorch-ddpg-naf/blob/master/ddpg.py#L15
 def hard_update(current_model, target_model):
@@ -158,8 +116,13 @@ USE_CUDA = torch.cuda.is_available()
 Variable = lambda *args, **kwargs: autograd.Variable(*args, **kwargs).cuda() \
                     if USE_CUDA else autograd.Variable(*args, **kwargs)
 
-env = AirSimEnv(need_render=False)
+# True: train on the NumPy surrogate of AirSimEnv instead of Unreal
+use_surrogate = False
+env = AirSimSurrogateEnv() if use_surrogate else AirSimEnv(need_render=False)
 model_dir = Path('./results') / 'AirSimEnv-v42'/ 'dqn'
+# set to a run directory (e.g. results/AirSimEnv-v42/dqn/run2) to continue it
+# from its latest checkpoint
+resume_dir = None
 if not model_dir.exists():
     curr_run = 'run1'
 else:
@@ -170,12 +133,14 @@ else:
     else:
         curr_run = 'run%i' % (max(exst_run_nums) + 1)
 
-run_dir = model_dir / curr_run
+run_dir = Path(resume_dir) if resume_dir is not None else model_dir / curr_run
 log_dir = run_dir / 'logs'
 save_dir = run_dir / 'models'
-os.makedirs(str(log_dir))
-os.makedirs(str(save_dir))
-logger = SummaryWriter(str(log_dir))
+os.makedirs(str(log_dir), exist_ok=resume_dir is not None)
+os.makedirs(str(save_dir), exist_ok=resume_dir is not None)
+logger = ScalarWriter(str(log_dir))
+# per-step losses are averaged on-device and written once per update round
+metrics = MetricsAccumulator(logger, flush_every=50)
 
 
 if USE_CUDA:
@@ -183,13 +148,14 @@ if USE_CUDA:
     current_model = CnnDQN(env.observation_space.shape, env.action_space.n).to(device)
     target_model = CnnDQN(env.observation_space.shape, env.action_space.n).to(device)
 else:
+    device = torch.device("cpu")
     current_model = CnnDQN(env.observation_space.shape, env.action_space.n)
     target_model = CnnDQN(env.observation_space.shape, env.action_space.n)
 
 target_model.load_state_dict(current_model.state_dict())
 target_model.eval()
 
-optimizer = optim.Adam(current_model.parameters(), lr=0.0005)
+optimizer = make_adam(current_model.parameters(), lr=0.0005)
 
 
 
@@ -200,7 +166,7 @@ epsilon_decay = 100000
 
 epsilon_by_frame = lambda frame_idx: epsilon_final + (epsilon_start - epsilon_final) * math.exp(-1. * frame_idx / epsilon_decay)
 replay_initial = 5000
-replay_buffer = ReplayBuffer(100000)
+replay_buffer = ReplayBuffer(100000, env.observation_space.shape, inform_dim=INCORPORATE, device=device)
 
 
 #hard_update(current_model, target_model)
@@ -208,6 +174,8 @@ replay_buffer = ReplayBuffer(100000)
 num_frames = 300000
 batch_size = 256
 gamma = 0.99
+n_step = 1
+nstep = NStepTransitionAssembler(n_step, gamma)
 
 
 ep_ret = 0
@@ -218,13 +186,28 @@ steps_deque = deque(maxlen=100)
 success_deque = deque(maxlen=100)
 save_freq=6000
 
+# last 3 periodic checkpoints + best success rate, written in the background
+checkpoints = CheckpointManager(save_dir, keep_last=3, prefix='actor_model')
+checkpoints.best_score = 0
+train_state = dict(model=current_model, target_model=target_model, optimizer=optimizer)
+save_extra = lambda: dict(num_epi=num_epi, rews_deque=rews_deque, steps_deque=steps_deque,
+                          success_deque=success_deque)
+start_frame = 1
+checkpoint = checkpoints.load() if resume_dir is not None else None
+if checkpoint is not None:
+    extra = checkpoints.restore(train_state, checkpoint)
+    start_frame, num_epi = extra['step'] + 1, extra['num_epi']
+    rews_deque, steps_deque, success_deque = \
+        extra['rews_deque'], extra['steps_deque'], extra['success_deque']
+
 state = env.reset()
-for frame_idx in trange(1, num_frames + 1):
+for frame_idx in trange(start_frame, num_frames + 1):
     epsilon = epsilon_by_frame(frame_idx)
     action = current_model.act(state, epsilon)
 
     next_state, reward, done, _ = env.step([action])
-    replay_buffer.push(state, action, reward, next_state, done)
+    for transition in nstep.push(state, action, reward, next_state, done):
+        replay_buffer.push(*transition)
 
     state = next_state
     ep_ret += reward
@@ -256,17 +239,21 @@ for frame_idx in trange(1, num_frames + 1):
         print("update at ",frame_idx)
         for i in range(50):
             loss = compute_td_loss(batch_size)
-            logger.add_scalars('value_loss',
-                                    {'value_loss': loss.detach().cpu().numpy()},
-                                    frame_idx)
+            metrics.add('value_loss', loss)
+            metrics.step(frame_idx)
             soft_update(current_model, target_model,tua)
+        logger.add_scalars('sample_throughput',
+                           {'sample_throughput': replay_buffer.throughput()},
+                           frame_idx)
 
     #if frame_idx % 1000 == 0:
     #    hard_update(current_model, target_model)
 
 
     if frame_idx % save_freq == 0 or frame_idx == num_frames - 1:
-        torch.save({
-            'model': current_model
-        },
-            str(save_dir) + "/actor_model_{}".format(frame_idx) + ".pt")
+        checkpoints.save(frame_idx, train_state, **save_extra())
+    if done:
+        checkpoints.save_best(frame_idx, train_state, sum(success_deque) / len(success_deque),
+                              **save_extra())
+
+checkpoints.close()
@@ -0,0 +1,203 @@
+"""
+Evaluation of many SAC checkpoints on a fixed list of arenas.
+
+Every checkpoint matching ``--checkpoints`` runs ``--episodes`` episodes on
+each arena of ``--arenas`` (GameConfig json items such as Seed, ArenaSize and
+End, see DEFAULT_ARENAS) with the deterministic policy. The episodes are
+spread over a pool of envs, one Unreal / AirSim instance per ``--ports``
+entry, each with its own EnvGenConfig json (``--json_files``). The envs step
+in threads and a single batched forward of the policy serves all of them.
+
+Results are cached in ``--cache_dir`` under the sha1 of the checkpoint file
+and the evaluation settings, so re-running over a growing run only evaluates
+the new checkpoints. The success rate / episode length table is printed and
+written to ``--out`` as csv.
+
+    python eval_checkpoints.py --checkpoints "results/AirSimEnv-v42/SAC/run7/models/actor_model_*.pt" \
+        --ports 41451 41452 --json_files EnvGenConfig0.json EnvGenConfig1.json
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from SAC import load_actor_critic
+from settings_folder import settings
+
+DEFAULT_ARENAS = [
+    dict(Seed=0, ArenaSize=[27, 27, 10], End=[8, 9, 0]),
+    dict(Seed=1, ArenaSize=[27, 27, 10], End=[-9, 7, 0]),
+    dict(Seed=2, ArenaSize=[30, 30, 10], End=[10, -10, 0]),
+    dict(Seed=3, ArenaSize=[30, 30, 10], End=[-11, -9, 0]),
+    dict(Seed=4, ArenaSize=[40, 40, 10], End=[14, 15, 0]),
+    dict(Seed=5, ArenaSize=[50, 50, 10], End=[-18, 16, 0]),
+]
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_key(checkpoint_hash, arenas, episodes, max_steps):
+    spec = json.dumps([checkpoint_hash, arenas, episodes, max_steps], sort_keys=True)
+    return hashlib.sha1(spec.encode()).hexdigest()
+
+
+class EnvPool(object):
+    """Envs reset / stepped concurrently, one thread each (they wait on RPCs)."""
+
+    def __init__(self, envs):
+        self.envs = envs
+        self.executor = ThreadPoolExecutor(max_workers=len(envs))
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self, idxs, arenas):
+        return list(self.executor.map(lambda i, arena: self.envs[i].reset(game_config=arena),
+                                      idxs, arenas))
+
+    def step(self, idxs, actions):
+        return list(self.executor.map(lambda i, a: self.envs[i].step(a), idxs, actions))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def evaluate(ac, pool, arenas, episodes, max_steps, device):
+    """Run every (arena, episode) on the pool; returns one dict per episode."""
+    tasks = [(a, k) for a in range(len(arenas)) for k in range(episodes)]
+    tasks.reverse()
+    slot_task = [None] * len(pool)
+    slot_obs = [None] * len(pool)
+    slot_len = np.zeros(len(pool), dtype=np.int64)
+    slot_ret = np.zeros(len(pool))
+    results = []
+
+    while True:
+        # hand the next episodes to the free envs
+        free = [i for i in range(len(pool)) if slot_task[i] is None and tasks]
+        for i in free:
+            slot_task[i] = tasks.pop()
+        if free:
+            for i, obs in zip(free, pool.reset(free, [arenas[slot_task[i][0]] for i in free])):
+                slot_obs[i], slot_len[i], slot_ret[i] = obs, 0, 0.
+
+        active = [i for i in range(len(pool)) if slot_task[i] is not None]
+        if not active:
+            return results
+
+        img = torch.as_tensor(np.stack([slot_obs[i][0] for i in active]), dtype=torch.float32)
+        inform = torch.as_tensor(np.stack([slot_obs[i][1] for i in active]), dtype=torch.float32)
+        actions = ac.act([img.to(device), inform.to(device)], deterministic=True)
+
+        # actions[j:j + 1] keeps the (1, act_dim) shape of a single-env get_action
+        steps = pool.step(active, [actions[j:j + 1] for j in range(len(active))])
+        for i, (obs, reward, done, _) in zip(active, steps):
+            slot_obs[i] = obs
+            slot_len[i] += 1
+            slot_ret[i] += reward
+            if done or slot_len[i] >= max_steps:
+                arena, episode = slot_task[i]
+                results.append(dict(arena=arena, episode=episode, length=int(slot_len[i]),
+                                    ret=float(slot_ret[i]),
+                                    success=bool(done and pool.envs[i].success)))
+                slot_task[i] = None
+
+
+def summarize(name, arenas, results):
+    rows = []
+    groups = [(str(a), [r for r in results if r['arena'] == a]) for a in range(len(arenas))]
+    for arena, group in groups + [('all', results)]:
+        rows.append(dict(checkpoint=name, arena=arena, episodes=len(group),
+                         success_rate=np.mean([r['success'] for r in group]),
+                         mean_length=np.mean([r['length'] for r in group]),
+                         mean_return=np.mean([r['ret'] for r in group])))
+    return rows
+
+
+def print_table(rows):
+    header = "{:<40} {:>5} {:>8} {:>8} {:>8} {:>9}".format(
+        'checkpoint', 'arena', 'episodes', 'success', 'length', 'return')
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print("{:<40} {:>5} {:>8} {:>8.2f} {:>8.1f} {:>9.2f}".format(
+            r['checkpoint'][-40:], r['arena'], r['episodes'], r['success_rate'],
+            r['mean_length'], r['mean_return']))
+
+
+def eval_checkpoints(device, checkpoints, make_env, num_envs, arenas=DEFAULT_ARENAS, episodes=5,
+                     max_steps=settings.nb_max_episodes_steps, cache_dir='./results/eval_cache'):
+    os.makedirs(cache_dir, exist_ok=True)
+    pool = None
+    rows = []
+    for path in checkpoints:
+        key = cache_key(file_hash(path), arenas, episodes, max_steps)
+        cache_file = os.path.join(cache_dir, key + '.json')
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                results = json.load(f)['results']
+        else:
+            # the Unreal instances are only started up when something is left to run
+            if pool is None:
+                pool = EnvPool([make_env(i) for i in range(num_envs)])
+            ac = load_actor_critic(path, device)
+            ac.eval()
+            results = evaluate(ac, pool, arenas, episodes, max_steps, device)
+            with open(cache_file + '.tmp', 'w') as f:
+                json.dump(dict(checkpoint=os.path.abspath(path), arenas=arenas, episodes=episodes,
+                               max_steps=max_steps, results=results), f)
+            os.replace(cache_file + '.tmp', cache_file)
+        rows += summarize(path, arenas, results)
+
+    if pool is not None:
+        pool.close()
+    # best checkpoints first, by their overall success rate
+    overall = {r['checkpoint']: r['success_rate'] for r in rows if r['arena'] == 'all'}
+    rows.sort(key=lambda r: (-overall[r['checkpoint']], r['checkpoint'], r['arena'] == 'all'))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, required=True, help='glob of actor_model_*.pt')
+    parser.add_argument('--arenas', type=str, default=None,
+                        help='json file with a list of GameConfig items per arena')
+    parser.add_argument('--episodes', type=int, default=5, help='episodes per arena')
+    parser.add_argument('--max_steps', type=int, default=settings.nb_max_episodes_steps)
+    parser.add_argument('--ports', type=int, nargs='+', default=[41451])
+    parser.add_argument('--json_files', type=str, nargs='+', default=[settings.json_file_addr],
+                        help='EnvGenConfig json of each Unreal instance, in --ports order')
+    parser.add_argument('--cache_dir', type=str, default='./results/eval_cache')
+    parser.add_argument('--out', type=str, default='./results/eval_checkpoints.csv')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+    assert len(args.ports) == len(args.json_files), "one json file per Unreal instance"
+
+    arenas = DEFAULT_ARENAS
+    if args.arenas is not None:
+        with open(args.arenas) as f:
+            arenas = json.load(f)
+
+    def make_env(i):
+        from gym_airsim.envs.AirGym import AirSimEnv
+        return AirSimEnv(need_render=False, port=args.ports[i], json_file_addr=args.json_files[i])
+
+    rows = eval_checkpoints(torch.device(args.device), sorted(glob.glob(args.checkpoints)), make_env,
+                            len(args.ports), arenas, args.episodes, args.max_steps, args.cache_dir)
+    print_table(rows)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
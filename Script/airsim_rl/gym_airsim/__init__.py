@@ -4,3 +4,8 @@ register(
 	id='AirSimEnv-v42',
 	entry_point='gym_airsim.envs:AirSimEnv',
 )
+
+register(
+	id='AirSimSurrogate-v0',
+	entry_point='gym_airsim.surrogate:AirSimSurrogateEnv',
+)
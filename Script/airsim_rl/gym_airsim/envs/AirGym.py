@@ -1,6 +1,8 @@
 from settings_folder import settings
 import msgs
-import rendering
+from common.lazy import lazy_import
+# pyglet, only when need_render
+rendering = lazy_import('rendering')
 from environment_randomization.game_config_handler_class import *
 import gym
 import collections
@@ -11,7 +13,7 @@ from common.utils import *
 
 
 class AirSimEnv(gym.Env):
-    def __init__(self, need_render=False):
+    def __init__(self, need_render=False, ip=None, port=41451, json_file_addr=None):
 
         # if need_render is True, then we can use the 2d windows to render the env
 
@@ -27,17 +29,20 @@ class AirSimEnv(gym.Env):
         #eithor your speed is more than 2, or your duration is more than 0.4
         #otherwise, it dose not work well !
         if (settings.control_mode == "moveByVelocity"):
-            self.action_space = spaces.Box(np.array([-0.3, -0.3]),
-                                           np.array([+0.3, +0.3]),
+            # one (dvx, dvy) per control period of an action chunk
+            self.action_space = spaces.Box(np.full(2 * settings.action_chunk, -0.3),
+                                           np.full(2 * settings.action_chunk, +0.3),
                                            dtype=np.float32)
         else:
             self.action_space = spaces.Discrete(8)
 
         #UE4 env config
-        self.game_config_handler = GameConfigHandler()
+        #each Unreal instance of an env pool reads its own json
+        self.json_file_addr = settings.json_file_addr if json_file_addr is None else json_file_addr
+        self.game_config_handler = GameConfigHandler(input_file_addr=self.json_file_addr)
 
         #uav api
-        self.airgym = AirLearningClient()
+        self.airgym = AirLearningClient(ip, port)
 
         #reset the env var
         self.success_count = 0
@@ -157,8 +162,13 @@ class AirSimEnv(gym.Env):
         distance = np.sqrt(np.power((self.goal[0] - now[0]), 2)
                            +np.power((self.goal[1] - now[1]), 2)
                            )
+        closest = distance
+        if settings.action_chunk > 1:
+            # the goal can be reached in the middle of a chunk
+            passed = self.airgym.chunk_kinematics[:, client.KINEMATICS_POSITION]
+            closest = min(distance, np.sqrt(((np.asarray(self.goal[:2]) - passed[:, :2]) ** 2).sum(-1)).min())
 
-        if distance < settings.success_distance_to_goal:
+        if closest < settings.success_distance_to_goal:
             self.success_count += 1
             done = True
             self.print_msg_of_inspiration()
@@ -209,23 +219,30 @@ class AirSimEnv(gym.Env):
         self.stepN = 0
         self.episodeN += 1
 
-    def reset(self):
+    def reset(self, game_config=None):
+        # game_config: a fixed {json key: value} arena (Seed, ArenaSize, End, ...)
+        # replacing the curriculum and the randomization, for evaluation
 
         #'''
-        if len(self.success_deque)>0:
+        if game_config is None and len(self.success_deque)>0:
             succes_rate=sum(self.success_deque) / len(self.success_deque)
             if succes_rate>0.7 and self.level==0 and self.success_count>300:
                 self.level=1
-                self.game_config_handler=GameConfigHandler(range_dic_name="settings.medium_range_dic")
+                self.game_config_handler=GameConfigHandler(range_dic_name="settings.medium_range_dic",
+                                                           input_file_addr=self.json_file_addr)
             elif succes_rate > 0.7 and self.level == 1 and self.success_count>600:
                 self.level = 2
-                self.game_config_handler = GameConfigHandler(range_dic_name="settings.hard_range_dic")
+                self.game_config_handler = GameConfigHandler(range_dic_name="settings.hard_range_dic",
+                                                             input_file_addr=self.json_file_addr)
         #'''
         if self.need_render:
             self.viewer.geoms.clear()
             self.viewer.onetime_geoms.clear()
         print("enter reset")
-        self.randomize_env()
+        if game_config is None:
+            self.randomize_env()
+        else:
+            self.updateJson(*game_config.items())
         print("done randomizing")
         self.airgym.unreal_reset()
         print("done unreal_resetting")
@@ -254,6 +271,8 @@ class AirSimEnv(gym.Env):
         self.airgym.client.moveByVelocityZAsync(0,0,self.airgym.z, 1).join()
 
         self.goal=np.array([30,40,0])
+        if game_config is not None and "End" in game_config:
+            self.goal = airsimize_coordinates(game_config["End"])
 
 
         self.on_episode_start()
@@ -1,30 +1,83 @@
-import airsim
 import numpy as np
 import math
 import time
-import cv2
 from settings_folder import settings
-from misc.move_to_airsim import client
+from common.lazy import lazy_import
+# the RPC stack is only needed once a client connects (not by the surrogate
+# env or by processes that just import AirGym)
+airsim = lazy_import('airsim')
+cv2 = lazy_import('cv2')
+client = lazy_import('misc.move_to_airsim.client')
+aio_client = lazy_import('misc.move_to_airsim.aio_client')
+
+
+def make_client(ip, port):
+    if settings.rpc_backend == 'asyncio':
+        return aio_client.AsyncioMultirotorClient(ip, port, lanes=settings.rpc_lanes)
+    return client.MultirotorClient(ip, port, lanes=settings.rpc_lanes)
 
 
 
 class AirLearningClient(object):
-    def __init__(self):
+    def __init__(self, ip=None, port=41451):
 
+        # one Unreal / AirSim instance per (ip, port), e.g. for an eval env pool
+        self.ip = settings.ip if ip is None else ip
+        self.port = port
         self.last_img = np.zeros((1, 112, 112))
         self.last_grey = np.zeros((112, 112))
         self.last_rgb = np.zeros((112, 112, 3))
         self.width, self.height=84,84 ##deepmind settings
 
         # connect to the AirSim simulator
-        self.client = client.MultirotorClient(settings.ip)
+        self.client = make_client(self.ip, self.port)
         self.client.confirmConnection()
         self.client.enableApiControl(True)
         self.client.armDisarm(True)
 
+        # position, orientation and velocities of the last kinematics() call
+        self.kinematics_buf = np.zeros(client.KINEMATICS_SIZE)
+        # kinematics at the end of each control period of the last action
+        self.chunk_kinematics = np.zeros((settings.action_chunk, client.KINEMATICS_SIZE))
+
         #self.z=-3
         self.z = -0.9
 
+    def kinematics(self):
+        # one RPC decoded into kinematics_buf, instead of a getPosition() /
+        # getVelocity() round trip (and object tree) per field
+        return self.client.simGetGroundTruthKinematicsArray(out=self.kinematics_buf)
+
+    def wait(self, future, duration):
+        samples = self.chunk_kinematics
+        if len(samples) == 1:
+            future.join()
+            return
+        # sample every control period while the move runs; the kinematics
+        # lane is not queued behind the move
+        if settings.rpc_lanes is not None:
+            start = time.time()
+            for i in range(len(samples) - 1):
+                time.sleep(max(0., start + (i + 1) * duration / len(samples) - time.time()))
+                self.client.simGetGroundTruthKinematicsArray(out=samples[i])
+        future.join()
+        samples[-1] = self.kinematics()
+        if settings.rpc_lanes is None:
+            samples[:-1] = samples[-1]
+
+    def fly_chunk(self, deltas):
+        """(action_chunk, 2) velocity deltas, one per control period, flown as
+        a single moveOnPath through the positions they integrate to."""
+        k = self.kinematics()
+        velocities = k[client.KINEMATICS_LINEAR_VELOCITY][:2] + np.cumsum(deltas, axis=0)
+        waypoints = k[client.KINEMATICS_POSITION][:2] + np.cumsum(velocities, axis=0) * settings.control_dt
+        duration = len(deltas) * settings.control_dt
+        path = [client.Vector3r(float(x), float(y), self.z) for x, y in waypoints]
+        # path length / duration
+        speed = max(float(np.linalg.norm(velocities, axis=1).mean()), 0.1)
+        yaw_mode = airsim.YawMode(is_rate=False, yaw_or_rate=0)
+        self.wait(self.client.moveOnPathAsync(path, speed, duration + 1., 1, yaw_mode), duration)
+
     def goal_direction(self, goal, pos):
 
         pitch, roll, yaw = self.client.getPitchRollYaw()
@@ -98,32 +151,26 @@ class AirLearningClient(object):
         return np.array([yaw])
 
     def drone_pos(self):
-        x = self.client.getPosition().x_val
-        y = self.client.getPosition().y_val
-        z = self.client.getPosition().z_val
-
-        return np.array([x, y, z])
+        return self.kinematics()[client.KINEMATICS_POSITION].copy()
 
     def drone_velocity(self):
-        v_x = self.client.getVelocity().x_val
-        v_y = self.client.getVelocity().y_val
-        v_z = self.client.getVelocity().z_val
+        v_x, v_y, v_z = self.kinematics()[client.KINEMATICS_LINEAR_VELOCITY]
         speed = np.sqrt(v_x ** 2 + v_y ** 2)
         return np.array([v_x, v_y, speed])
 
     def get_distance(self, goal):
-        now = self.client.getPosition()
-        xdistance = (goal[0] - now.x_val)
-        ydistance = (goal[1] - now.y_val)
-        #zdistance = (goal[2] - now.z_val)
+        now = self.kinematics()[client.KINEMATICS_POSITION]
+        xdistance = (goal[0] - now[0])
+        ydistance = (goal[1] - now[1])
+        #zdistance = (goal[2] - now[2])
         euclidean = np.sqrt(np.power(xdistance,2) + np.power(ydistance,2))
         return np.array([xdistance, ydistance])
 
     def get_velocity(self):
-        return np.array([self.client.getVelocity().x_val, self.client.getVelocity().y_val, self.client.getVelocity().z_val])
+        return self.kinematics()[client.KINEMATICS_LINEAR_VELOCITY].copy()
 
     def AirSim_reset(self):
-        self.client=client.MultirotorClient(settings.ip)
+        self.client=make_client(self.ip, self.port)
         connection_established = False
         # wait till connected to the multi rotor
         while not (connection_established):
@@ -133,7 +180,7 @@ class AirLearningClient(object):
             except Exception as e:
                 #self.client.reset()
                 time.sleep(5)
-                self.client = client.MultirotorClient(settings.ip)
+                self.client = make_client(self.ip, self.port)
 
 
         #self.client.confirmConnection()
@@ -150,14 +197,17 @@ class AirLearningClient(object):
         if(settings.control_mode=="moveByVelocity"):
             action=np.clip(action, -0.3, 0.3)
 
-            detla_x = action[0]
-            detla_y = action[1]
-            v=self.drone_velocity()
-            v_x = v[0] + detla_x
-            v_y = v[1] + detla_y
+            if settings.action_chunk > 1:
+                self.fly_chunk(np.reshape(action, (settings.action_chunk, 2)))
+            else:
+                detla_x = action[0]
+                detla_y = action[1]
+                v=self.drone_velocity()
+                v_x = v[0] + detla_x
+                v_y = v[1] + detla_y
 
-            yaw_mode = airsim.YawMode(is_rate=False, yaw_or_rate=0)
-            self.client.moveByVelocityZAsync(v_x, v_y, self.z, 0.35, 1, yaw_mode).join()
+                yaw_mode = airsim.YawMode(is_rate=False, yaw_or_rate=0)
+                self.client.moveByVelocityZAsync(v_x, v_y, self.z, settings.control_dt, 1, yaw_mode).join()
 
         else:
             raise NotImplementedError
@@ -173,7 +223,7 @@ class AirLearningClient(object):
         vx = math.cos(yaw) * speed
         vy = math.sin(yaw) * speed
         yaw_mode = airsim.YawMode(is_rate=False, yaw_or_rate=0)
-        self.client.moveByVelocityZAsync(vx, vy, self.z, duration, 1, yaw_mode).join()
+        self.wait(self.client.moveByVelocityZAsync(vx, vy, self.z, duration, 1, yaw_mode), duration)
 
 
     def move_right(self, speed, duration):
@@ -185,7 +235,7 @@ class AirLearningClient(object):
         return start, duration
 
     def yaw_right(self, rate, duration):
-        self.client.rotateByYawRateAsync(rate, duration).join()
+        self.wait(self.client.rotateByYawRateAsync(rate, duration), duration)
         start = time.time()
         return start, duration
 
@@ -203,57 +253,60 @@ class AirLearningClient(object):
     def move_forward_Speed(self, speed_x = 0.5, speed_y = 0.5, duration = 0.5):
         #speedx is in the FLU
         #z = self.drone_pos()[2]
-        pitch, roll, yaw  = self.client.getPitchRollYaw()
-        vel = self.client.getVelocity()
+        k = self.kinematics()
+        pitch, roll, yaw = client.to_eulerian_angles(k[client.KINEMATICS_ORIENTATION])
+        vel = k[client.KINEMATICS_LINEAR_VELOCITY]
         vx = math.cos(yaw) * speed_x + math.sin(yaw) * speed_y
         vy = math.sin(yaw) * speed_x - math.cos(yaw) * speed_y
 
         drivetrain = 1
         yaw_mode = airsim.YawMode(is_rate= False, yaw_or_rate = 0)
 
-        self.client.moveByVelocityZAsync(vx = (vx +vel.x_val)/2 ,
-                             vy = (vy +vel.y_val)/2 , #do this to try and smooth the movement
+        self.wait(self.client.moveByVelocityZAsync(vx = (vx +vel[0])/2 ,
+                             vy = (vy +vel[1])/2 , #do this to try and smooth the movement
                              z = self.z,
                              duration = duration,
                              drivetrain = drivetrain,
                              yaw_mode=yaw_mode
-                            ).join()
+                            ), duration)
         start = time.time()
         return start, duration
 
     def take_discrete_action(self, action):
+        # action repeat: one RPC covers the action_chunk control periods
+        dur = settings.rot_dur * settings.action_chunk
 
         if action == 0:
-            self.straight(settings.mv_fw_spd_2, settings.rot_dur)
+            self.straight(settings.mv_fw_spd_2, dur)
         if action == 1:
-            self.straight(settings.mv_fw_spd_3, settings.rot_dur)
+            self.straight(settings.mv_fw_spd_3, dur)
         if action == 2:
             #self.yaw_right(settings.yaw_rate_1_2, settings.rot_dur/2)
             #self.straight(settings.mv_fw_spd_3, settings.rot_dur/2)
             self.move_forward_Speed(settings.mv_fw_spd_2*math.cos(0.314),
-                                    settings.mv_fw_spd_2*math.sin(0.314), settings.rot_dur)
+                                    settings.mv_fw_spd_2*math.sin(0.314), dur)
 
         if action == 3:
             #self.yaw_right(settings.yaw_rate_1_2, settings.rot_dur / 2)
             #self.straight(settings.mv_fw_spd_4, settings.rot_dur / 2)
             self.move_forward_Speed(settings.mv_fw_spd_3 * math.cos(0.314),
-                                    settings.mv_fw_spd_3 * math.sin(0.314), settings.rot_dur)
+                                    settings.mv_fw_spd_3 * math.sin(0.314), dur)
 
         if action == 4:
             #self.yaw_right(settings.yaw_rate_2_2, settings.rot_dur / 2)
             #self.straight(settings.mv_fw_spd_4, settings.rot_dur / 2)
             self.move_forward_Speed(settings.mv_fw_spd_2 * math.cos(0.314),
-                                    -settings.mv_fw_spd_2 * math.sin(0.314), settings.rot_dur)
+                                    -settings.mv_fw_spd_2 * math.sin(0.314), dur)
         if action == 5:
             #self.yaw_right(settings.yaw_rate_2_2, settings.rot_dur / 2)
             #self.straight(settings.mv_fw_spd_4, settings.rot_dur / 2)
             self.move_forward_Speed(settings.mv_fw_spd_3 * math.cos(0.314),
-                                    -settings.mv_fw_spd_3 * math.sin(0.314), settings.rot_dur)
+                                    -settings.mv_fw_spd_3 * math.sin(0.314), dur)
 
         if action == 6:
-            self.yaw_right(settings.yaw_rate_1_2, settings.rot_dur )
+            self.yaw_right(settings.yaw_rate_1_2, dur )
         if action == 7:
-            self.yaw_right(settings.yaw_rate_2_2, settings.rot_dur)
+            self.yaw_right(settings.yaw_rate_2_2, dur)
         '''
         yaw_mode = airsim.YawMode(is_rate=False, yaw_or_rate=0)
         if action == 0:
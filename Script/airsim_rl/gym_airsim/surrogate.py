@@ -0,0 +1,396 @@
+"""
+A NumPy surrogate of AirSimEnv: no Unreal, no AirSim, N drones stepped at
+once. For pretraining, throughput measurements and tests.
+
+The arena is the 2.5-D world of the Unreal map: an ArenaSize[0] x
+ArenaSize[1] room centred on the start, ArenaSize[2] high, with
+NumberOfObjects full-height cylinders and boxes laid out from Seed and a goal
+sampled like GameConfigHandler samples a "Mutable" End. All of it comes from
+the ``settings.*_range_dic`` dictionaries (or a fixed ``game_config``, as for
+AirSimEnv.reset), and is re-sampled every
+``settings.environment_change_frequency`` episodes.
+
+Depth images are ray-cast for every env in one go: one horizontal ray per
+image column against the obstacles and walls, then per pixel the nearer of
+that hit and the floor / ceiling, as a 90 degree FOV DepthPerspective image
+clipped at 20 m and scaled to 0..255 like AirLearningClient.getScreenDepth.
+The action kinematics follow AirLearningClient (velocity commands with the
+ForwardOnly drivetrain, yaw turns), the inform vector is AirSimEnv.state and
+the reward / termination rules are those of AirSimEnv.step.
+
+``VecAirSimSurrogate`` is the batched env (auto-reset, numpy in / out);
+``AirSimSurrogateEnv`` is a single env with the AirSimEnv interface that the
+trainers can use in its place (``SAC.py --surrogate``, ``train_ppo.py
+--surrogate``, ``gym.make('AirSimSurrogate-v0')``).
+"""
+import collections
+import math
+
+import gym
+import numpy as np
+from gym import spaces
+
+from settings_folder import settings
+
+IMG_H, IMG_W = 112, 112
+STACK = 4
+FOV = math.pi / 2
+MAX_DEPTH = 20.
+DRONE_RADIUS = 0.3
+# AirLearningClient flies at z = -0.9 (NED), i.e. 0.9 m above the floor
+FLIGHT_Z = -0.9
+# cylinder radius / box half-size of the obstacles, and the free space kept
+# around the start and the goal
+OBJECT_SIZE = (0.3, 1.0)
+CLEARANCE = 2.
+RANDOMIZED = ('ArenaSize', 'Seed', 'NumberOfObjects', 'End')
+
+
+def camera_rays(h=IMG_H, w=IMG_W, fov=FOV):
+    """Per column the horizontal heading offset of the pixel rays; per pixel
+    the vertical slope of the ray over its horizontal length and the ratio
+    of the ray length to its horizontal length."""
+    f = (w / 2.) / math.tan(fov / 2.)
+    u = (np.arange(w) + 0.5 - w / 2.) / f
+    v = (h / 2. - np.arange(h) - 0.5) / f
+    horizontal = np.sqrt(1. + u ** 2)
+    slope = v[:, None] / horizontal[None, :]
+    length = np.sqrt(1. + u[None, :] ** 2 + v[:, None] ** 2) / horizontal[None, :]
+    return np.arctan(u), slope.astype(np.float32), length.astype(np.float32)
+
+
+def random_end_point(arena_size, rng):
+    """common.utils.get_random_end_point for a single split."""
+    goal_halo = settings.slow_down_activation_distance
+    x = rng.uniform(2, (arena_size[0] - goal_halo) / 2.) * rng.choice([1, -1])
+    y = rng.uniform(2, (arena_size[1] - goal_halo) / 2.) * rng.choice([1, -1])
+    return [x, y, 0]
+
+
+def layout(seed, arena_size, num_objects, goal):
+    """Obstacles of one arena: centres (n, 2), sizes (n,) and is_box (n,),
+    deterministic in seed like the Unreal arena generation."""
+    rng = np.random.RandomState(seed)
+    half = np.asarray(arena_size[:2], dtype=np.float64) / 2. - OBJECT_SIZE[1]
+    centers = rng.uniform(-half, half, size=(8 * num_objects + 8, 2))
+    sizes = rng.uniform(OBJECT_SIZE[0], OBJECT_SIZE[1], size=len(centers))
+    is_box = rng.rand(len(centers)) < 0.5
+    keep = ((np.linalg.norm(centers, axis=1) > sizes + CLEARANCE) &
+            (np.linalg.norm(centers - np.asarray(goal[:2]), axis=1) > sizes + CLEARANCE))
+    keep = np.flatnonzero(keep)[:num_objects]
+    return centers[keep], sizes[keep], is_box[keep]
+
+
+class VecAirSimSurrogate(object):
+    """
+    ``num_envs`` surrogate AirSimEnvs. ``reset()`` returns [img (N, 4, 112,
+    112), inform (N, 7)], ``step(actions)`` returns obs, reward (N,), done (N,)
+    and per env info dicts. With ``auto_reset`` finished envs are reset in
+    the same step; their last observation is info['terminal_observation'].
+    """
+
+    def __init__(self, num_envs, range_dic=None, control_mode=None, seed=None, auto_reset=True):
+        self.num_envs = num_envs
+        self.control_mode = settings.control_mode if control_mode is None else control_mode
+        self.range_dic = settings.default_range_dic if range_dic is None else range_dic
+        self.auto_reset = auto_reset
+        self.rng = np.random.RandomState(seed)
+
+        self.observation_space = spaces.Box(low=0, high=255, shape=(STACK, IMG_H, IMG_W))
+        if self.control_mode == "moveByVelocity":
+            self.action_space = spaces.Box(np.full(2 * settings.action_chunk, -0.3),
+                                           np.full(2 * settings.action_chunk, +0.3), dtype=np.float32)
+        else:
+            self.action_space = spaces.Discrete(8)
+
+        self.col_angle, self.slope, self.ray_length = camera_rays()
+        n = num_envs
+        self.pos = np.zeros((n, 2))
+        self.vel = np.zeros((n, 2))
+        self.yaw = np.zeros(n)
+        self.goal = np.zeros((n, 2))
+        self.stepN = np.zeros(n, dtype=np.int64)
+        self.episodeN = np.zeros(n, dtype=np.int64)
+        self.success = np.zeros(n, dtype=bool)
+        self.frames = np.zeros((n, STACK, IMG_H, IMG_W), dtype=np.float32)
+        # horizontal distance at which every pixel ray meets the floor / ceiling
+        self.plane_dist = np.full((n, IMG_H, IMG_W), np.inf, dtype=np.float32)
+        self.game_config = [None] * n
+        self.arena_half = np.zeros((n, 2))
+        self.cylinders = (np.zeros((n, 0, 2)), np.zeros((n, 0)))
+        self.boxes = (np.zeros((n, 0, 2)), np.zeros((n, 0)))
+        self._layouts = [None] * n
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def set_range_dic(self, range_dic):
+        self.range_dic = range_dic
+
+    # ------------------------------------------------------------------ arenas
+    def _sample_config(self, i):
+        """GameConfigHandler.sample of the keys due this episode."""
+        config = dict(self.game_config[i] or {})
+        due = [k for k in RANDOMIZED if self.game_config[i] is None or
+               (self.episodeN[i] + 1) % settings.environment_change_frequency.get(k, 1) == 0]
+        for key in due:
+            values = self.range_dic[key]
+            config[key] = values[self.rng.randint(len(values))]
+        if 'End' in due and self.range_dic['End'][0] == "Mutable":
+            config['End'] = random_end_point(config['ArenaSize'], self.rng)
+        return config
+
+    def _apply_config(self, i, config):
+        if config != self.game_config[i] or self._layouts[i] is None:
+            self._layouts[i] = layout(config['Seed'], config['ArenaSize'],
+                                      config['NumberOfObjects'], config['End'])
+            self.arena_half[i] = np.asarray(config['ArenaSize'][:2], dtype=np.float64) / 2.
+            ceiling = config['ArenaSize'][2]
+            height = -FLIGHT_Z
+            with np.errstate(divide='ignore'):
+                self.plane_dist[i] = np.where(self.slope < 0, height / -self.slope,
+                                              np.where(self.slope > 0, (ceiling - height) / self.slope,
+                                                       np.inf))
+        self.game_config[i] = config
+        self.goal[i] = config['End'][:2]
+
+    def _pack_obstacles(self):
+        """Pad the per-env obstacle lists into (N, M, ...) arrays; padding
+        entries sit far outside every arena with size 0."""
+        def pack(kind):
+            objs = [(c[k == kind], s[k == kind]) for c, s, k in self._layouts]
+            m = max(len(s) for _, s in objs)
+            centers = np.full((self.num_envs, m, 2), 1e6)
+            sizes = np.zeros((self.num_envs, m))
+            for i, (c, s) in enumerate(objs):
+                centers[i, :len(s)], sizes[i, :len(s)] = c, s
+            return centers, sizes
+        self.cylinders, self.boxes = pack(False), pack(True)
+
+    # ---------------------------------------------------------------- sensors
+    def _column_depth(self, idxs):
+        """Horizontal distance along every column ray of envs idxs to the
+        nearest obstacle or wall, (n, W)."""
+        p = self.pos[idxs][:, None, :]
+        heading = self.yaw[idxs][:, None] + self.col_angle[None, :]
+        d = np.stack((np.cos(heading), np.sin(heading)), axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = 1. / d
+            # walls: leave the arena box [-half, half]
+            half = self.arena_half[idxs][:, None, :]
+            t_wall = np.where(inv > 0, (half - p) * inv, (-half - p) * inv)
+            best = np.nanmin(t_wall, axis=-1)
+
+            # cylinders: |p + t d - c| = r
+            centers, radius = self.cylinders
+            if radius.shape[1]:
+                oc = centers[idxs] - self.pos[idxs][:, None, :]
+                b = np.einsum('nwk,nmk->nwm', d, oc)
+                c = (oc ** 2).sum(-1) - radius[idxs] ** 2
+                disc = b ** 2 - c[:, None, :]
+                t = b - np.sqrt(np.maximum(disc, 0.))
+                t = np.where((disc >= 0) & (b + np.sqrt(np.maximum(disc, 0.)) > 0),
+                             np.maximum(t, 0.), np.inf)
+                best = np.minimum(best, t.min(-1))
+
+            # boxes: slab test
+            centers, half_size = self.boxes
+            if half_size.shape[1]:
+                lo = (centers[idxs] - half_size[idxs][..., None])[:, None] - p[:, :, None]
+                hi = (centers[idxs] + half_size[idxs][..., None])[:, None] - p[:, :, None]
+                t1, t2 = lo * inv[:, :, None], hi * inv[:, :, None]
+                near = np.nanmax(np.minimum(t1, t2), axis=-1)
+                far = np.nanmin(np.maximum(t1, t2), axis=-1)
+                t = np.where((near <= far) & (far > 0), np.maximum(near, 0.), np.inf)
+                best = np.minimum(best, t.min(-1))
+        return best.astype(np.float32)
+
+    def _depth(self, idxs):
+        """(n, H, W) DepthPerspective frames of envs idxs, scaled as getScreenDepth."""
+        columns = self._column_depth(idxs)
+        depth = np.minimum(columns[:, None, :], self.plane_dist[idxs])
+        depth *= self.ray_length
+        np.minimum(depth, MAX_DEPTH, out=depth)
+        depth *= 255. / MAX_DEPTH
+        return depth
+
+    def _inform(self):
+        """AirSimEnv.state: goal offset, velocity and speed, yaw, goal bearing."""
+        rel = self.goal - self.pos
+        pos_angle = np.degrees(np.arctan2(rel[:, 1], rel[:, 0])) % 360
+        r_yaw = np.radians(pos_angle - np.degrees(self.yaw))
+        speed = np.sqrt((self.vel ** 2).sum(-1))
+        return np.concatenate((rel, self.vel, speed[:, None], self.yaw[:, None], r_yaw[:, None]),
+                              axis=1).astype(np.float32), speed, r_yaw
+
+    def _collided(self):
+        p = self.pos[:, None, :]
+        centers, radius = self.cylinders
+        hit = (np.sqrt(((p - centers) ** 2).sum(-1)) < radius + DRONE_RADIUS).any(-1)
+        centers, half_size = self.boxes
+        gap = np.maximum(np.abs(p - centers) - half_size[..., None], 0.)
+        hit |= (np.sqrt((gap ** 2).sum(-1)) < DRONE_RADIUS).any(-1)
+        hit |= (np.abs(self.pos) > self.arena_half - DRONE_RADIUS).any(-1)
+        return hit
+
+    # --------------------------------------------------------------- dynamics
+    def _move(self, actions):
+        """Fly one action (settings.action_chunk control periods); returns
+        whether each env collided and its closest approach to the goal, both
+        checked at the end of every period as AirLearningClient samples them."""
+        chunk = settings.action_chunk
+        hit = np.zeros(self.num_envs, dtype=bool)
+        closest = np.full(self.num_envs, np.inf)
+
+        def check():
+            np.logical_or(hit, self._collided(), out=hit)
+            np.minimum(closest, np.sqrt(((self.goal - self.pos) ** 2).sum(-1)), out=closest)
+
+        if self.control_mode == "moveByVelocity":
+            # take_continious_action: current velocity + clipped delta, per period
+            delta = np.clip(np.asarray(actions, dtype=np.float64).reshape(self.num_envs, chunk, 2), -0.3, 0.3)
+            for k in range(chunk):
+                self._fly(self.vel + delta[:, k], settings.control_dt)
+                check()
+            return hit, closest
+
+        # take_discrete_action
+        actions = np.asarray(actions).reshape(self.num_envs).astype(np.int64)
+        s2, s3, a = settings.mv_fw_spd_2, settings.mv_fw_spd_3, 0.314
+        # body frame (forward, right) speed per action; 6 / 7 only yaw
+        body = np.array([[s2, 0], [s3, 0], [s2 * math.cos(a), s2 * math.sin(a)],
+                         [s3 * math.cos(a), s3 * math.sin(a)], [s2 * math.cos(a), -s2 * math.sin(a)],
+                         [s3 * math.cos(a), -s3 * math.sin(a)], [0, 0], [0, 0]])[actions]
+        cos, sin = np.cos(self.yaw), np.sin(self.yaw)
+        # move_forward_Speed's (vx, vy), averaged with the current velocity;
+        # straight() commands (cos, sin) * speed directly
+        cmd = np.stack((cos * body[:, 0] + sin * body[:, 1], sin * body[:, 0] - cos * body[:, 1]), -1)
+        cmd = np.where((actions >= 2)[:, None], (cmd + self.vel) / 2., cmd)
+        turn = actions >= 6
+        rate = np.where(actions == 6, settings.yaw_rate_1_2, settings.yaw_rate_2_2)
+        # the command is held for the whole chunk (action repeat)
+        for k in range(chunk):
+            self.yaw = np.where(turn, self.yaw + np.radians(rate) * settings.rot_dur, self.yaw)
+            self._fly(np.where(turn[:, None], 0., cmd), settings.rot_dur, keep_yaw=turn)
+            check()
+        return hit, closest
+
+    def _fly(self, velocity, duration, keep_yaw=None):
+        """moveByVelocityZAsync with the ForwardOnly drivetrain: the drone
+        flies ``velocity`` for ``duration`` facing its direction of travel."""
+        self.pos = self.pos + velocity * duration
+        self.vel = velocity
+        moving = (velocity ** 2).sum(-1) > 1e-8
+        if keep_yaw is not None:
+            moving &= ~keep_yaw
+        self.yaw = np.where(moving, np.arctan2(velocity[:, 1], velocity[:, 0]), self.yaw)
+        self.yaw = (self.yaw + np.pi) % (2 * np.pi) - np.pi
+
+    # -------------------------------------------------------------------- api
+    def reset(self, idxs=None, game_config=None):
+        """Reset envs idxs (default all); game_config fixes their arena as in
+        AirSimEnv.reset(game_config)."""
+        idxs = np.arange(self.num_envs) if idxs is None else np.asarray(idxs)
+        for i in idxs:
+            if game_config is None:
+                self._apply_config(i, self._sample_config(i))
+            else:
+                self._apply_config(i, dict(self.game_config[i] or self._sample_config(i), **game_config))
+            self.episodeN[i] += 1
+        self._pack_obstacles()
+        self.pos[idxs], self.vel[idxs], self.yaw[idxs] = 0., 0., 0.
+        self.stepN[idxs] = 0
+        self.success[idxs] = False
+        # init_state_f: the hovering drone sees the same frame stack-times
+        self.frames[idxs] = self._depth(idxs)[:, None]
+        return [self.frames.copy(), self._inform()[0]]
+
+    def step(self, actions):
+        self.stepN += 1
+        collided, closest = self._move(actions)
+
+        self.frames[:, :-1] = self.frames[:, 1:]
+        self.frames[:, -1] = self._depth(np.arange(self.num_envs))
+        inform, speed, r_yaw = self._inform()
+
+        # AirSimEnv.step / computeReward
+        distance = np.sqrt(((self.goal - self.pos) ** 2).sum(-1))
+        self.success = closest < settings.success_distance_to_goal
+        altitude = (FLIGHT_Z < -4.5) or (FLIGHT_Z > -0.7)
+        failed = collided | (self.stepN >= settings.nb_max_episodes_steps) | altitude
+        reward = -distance * 0.03 + np.where(np.cos(r_yaw) >= 0, speed * np.cos(r_yaw), 0.)
+        reward = np.where(self.success, 20., np.where(failed, -20., reward))
+        done = self.success | failed
+
+        obs = [self.frames.copy(), inform]
+        infos = [{'success': bool(s), 'collided': bool(c)} for s, c in zip(self.success, collided)]
+        if self.auto_reset and done.any():
+            finished = np.flatnonzero(done)
+            for i in finished:
+                infos[i]['terminal_observation'] = [obs[0][i], obs[1][i]]
+            obs = self.reset(finished)
+        return obs, reward, done, infos
+
+
+class AirSimSurrogateEnv(gym.Env):
+    """A single surrogate env with the interface and curriculum of AirSimEnv."""
+
+    def __init__(self, need_render=False, control_mode=None, seed=None):
+        self.vec = VecAirSimSurrogate(1, settings.easy_range_dic, control_mode, seed, auto_reset=False)
+        self.observation_space = self.vec.observation_space
+        self.action_space = self.vec.action_space
+        self.stack_frames = STACK
+
+        self.success_count = 0
+        self.episodeN = 0
+        self.stepN = 0
+        self.success = False
+        self.level = 0
+        self.success_deque = collections.deque(maxlen=100)
+        self.goal = np.zeros(2)
+
+    def seed(self, seed=None):
+        np.random.seed(seed)
+        return self.vec.seed(seed)
+
+    def getGoal(self):
+        return self.goal
+
+    def get_space(self):
+        return self.observation_space, self.action_space
+
+    def state(self):
+        return self.vec._inform()[0][0]
+
+    def reset(self, game_config=None):
+        # AirSimEnv's curriculum: easy -> medium -> hard range dics
+        if game_config is None and len(self.success_deque) > 0:
+            succes_rate = sum(self.success_deque) / len(self.success_deque)
+            if succes_rate > 0.7 and self.level == 0 and self.success_count > 300:
+                self.level = 1
+                self.vec.set_range_dic(settings.medium_range_dic)
+            elif succes_rate > 0.7 and self.level == 1 and self.success_count > 600:
+                self.level = 2
+                self.vec.set_range_dic(settings.hard_range_dic)
+        obs = self.vec.reset(game_config=game_config)
+        self.goal = self.vec.goal[0].copy()
+        self.stepN = 0
+        self.episodeN += 1
+        self.success = False
+        return [obs[0][0], obs[1][0]]
+
+    def step(self, action):
+        action = action[0]
+        obs, reward, done, infos = self.vec.step(np.asarray(action)[None])
+        self.stepN += 1
+        self.success = infos[0]['success']
+        done = bool(done[0])
+        if self.success:
+            self.success_count += 1
+        if done:
+            self.success_deque.append(1 if self.success else 0)
+        return [obs[0][0], obs[1][0]], float(reward[0]), done, None
+
+    def render(self, mode='human', close=False):
+        pass
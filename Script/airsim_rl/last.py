@@ -7,38 +7,33 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions.normal import Normal
 from common.utils import *
+from algorithm.attention import CNNAttention
+# also the classes of actor models pickled by SAC.py runs
+from SAC import Flatten, conv_encoder, Actor, Qfunc, QEnsemble, SACActorCritic, load_actor_critic
+from algorithm.export import ActorRuntime
 from gym_airsim.envs.AirGym import AirSimEnv
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import matplotlib.ticker as ticker
-
-from smoke.config import cfg
-from smoke.utils.check_point import DetectronCheckpointer
-from smoke.engine import (
-    default_argument_parser,
-    default_setup,
-    launch,
-)
-from smoke.modeling.detector import build_detection_model
-from smoke.modeling.heatmap_coder import get_transfrom_matrix
-from smoke.structures.params_3d import ParamsList
-from smoke.structures.image_list import to_image_list
+from common.lazy import lazy_import
+# plotting, PIL / torchvision and the SMOKE detector are only needed by the
+# detection processes, not to import this module
+plt = lazy_import('matplotlib.pyplot')
+pd = lazy_import('pandas')
+ticker = lazy_import('matplotlib.ticker')
+
 import torch.multiprocessing as mp
 from torch.multiprocessing import Array, Pipe
 
 import torch
-from torchvision.transforms import functional as Func
+Func = lazy_import('torchvision.transforms.functional')
 import os
-from matplotlib.gridspec import GridSpec
-from PIL import Image
-import matplotlib.patches as patches
-from matplotlib.path import Path
+gridspec = lazy_import('matplotlib.gridspec')
+Image = lazy_import('PIL.Image')
+patches = lazy_import('matplotlib.patches')
 import threading
 from tqdm import trange
 from pathlib import Path as path
 from torch.distributions import Categorical,Independent
-import cv2
+cv2 = lazy_import('cv2')
 INCORPORATE = 7
 LOG_STD_MAX = 2
 LOG_STD_MIN = -20
@@ -193,6 +188,7 @@ def compute_3Dbox(P2, line):
     return corners_2D
 
 def draw_3Dbox(ax, P2, line, color):
+    from matplotlib.path import Path
 
     corners_2D = compute_3Dbox(P2, line)
 
@@ -215,6 +211,8 @@ def draw_3Dbox(ax, P2, line, color):
     ax.add_patch(front_fill)
 
 def setup(args):
+    from smoke.config import cfg
+    from smoke.engine import default_setup
     cfg.merge_from_file(args.config_file)
     cfg.merge_from_list(args.opts)
     cfg.freeze()
@@ -264,6 +262,9 @@ def build_transforms(cfg):
     return transform
 
 def img_process(img):
+    from smoke.config import cfg
+    from smoke.modeling.heatmap_coder import get_transfrom_matrix
+    from smoke.structures.params_3d import ParamsList
     # load default parameter here
 
     K=sim_mat
@@ -302,12 +303,6 @@ def img_process(img):
 
     return img,target
 
-def init(module, weight_init, bias_init, gain=1):
-    weight_init(module.weight.data, gain=gain)
-    bias_init(module.bias.data)
-    return module
-
-
 def plot_attention(attention, name):
 
     d = np.array(attention)
@@ -331,318 +326,9 @@ def plot_attention(attention, name):
 
     plt.savefig(name)
 
-class Flatten(nn.Module):
-    def forward(self, x):
-        return x.contiguous().view(x.size(0), -1)
-
-class CNNAttention(nn.Module):
-    def __init__(self,size, name ="sa"):
-        super(CNNAttention,self).__init__()
-
-        init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
-                               constant_(x, 0), np.sqrt(2))
-
-        self.w_qs=init_(nn.Conv2d(size, size//8, 1))
-        self.w_ks=init_(nn.Conv2d(size, size//8, 1))
-        self.w_vs=init_(nn.Conv2d(size, size, 1))
-        self.gamma = nn.Parameter(torch.zeros(1))
-        self.name = name
-
-    def forward(self,inputs):
-
-        Batch=inputs.shape[0]
-        output_size=inputs.shape[2]*inputs.shape[3]
-        # NCHW-->N,C,H*W-->N,H*W,C
-        q=self.w_qs(inputs).view(Batch,-1,output_size).permute(0,2,1) # N,H*W,C
-
-        k = self.w_ks(inputs).view(Batch,-1,output_size)# N,C,H*W
-
-        v = self.w_vs(inputs).view(Batch,-1,output_size)# N,C,H*W
-
-        attn = torch.bmm(q, k) #N,H*W,H*W
-
-        attn=F.softmax(attn,dim=-1)
-        #plot_attention(attn[0].sum(dim=0).view(inputs.shape[2],inputs.shape[3]).detach().cpu().numpy(),
-        #               self.name)
-
-        # N,C,H*W
-        out = torch.bmm(v, attn.permute(0, 2, 1))
-        out=out.view(*inputs.shape)
-
-        out= self.gamma*out + inputs
-
-        return out
-
-class Actor(nn.Module):
-
-    def __init__(self, obs_dim, act_dim, hidden_size, activation, act_limit=None,
-                 discrete=False, sattn = False):
-        super().__init__()
-
-        init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
-                               constant_(x, 0), nn.init.calculate_gain('relu'))
-
-        num_inputs = obs_dim[0]
-        self.discrete = discrete
-        if sattn:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                CNNAttention(16, name = "ac_l1"),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                CNNAttention(32, name = "ac_l2"),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-        else:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-        self.layer2 = nn.Sequential(init_(nn.Linear(INCORPORATE, 64)),
-                                    nn.ReLU(),
-                                    )
-
-        if discrete:
-            self.prob = nn.Sequential(init_(nn.Linear(800 + 64, hidden_size)),
-                                    activation(),
-                                    init_(nn.Linear(hidden_size, act_dim))
-                                    )
-
-        else:
-            self.mu = nn.Sequential(init_(nn.Linear(800 + 64, hidden_size)),
-                                        activation(),
-                                        init_(nn.Linear(hidden_size, act_dim))
-                                        )
-
-            self.log_std = nn.Sequential(init_(nn.Linear(800 + 64, hidden_size)),
-                                    activation(),
-                                    init_(nn.Linear(hidden_size, act_dim))
-                                    )
-
-            self.act_limit=act_limit
-
-        # self.train()
-
-    def evaluate(self,obs):
-        img = obs[0]
-        inform = obs[1]
-
-        x = img / 255.0
-
-        #######TO:(N,C,H,W)
-        x = self.layer1(x)
-        inform = self.layer2(inform)
-        x = torch.cat((x, inform), -1)
-
-        x = self.prob(x)
-
-        distribution = Categorical(logits=x)
-
-        action_probs = F.softmax(x,dim=-1)
-        z = (action_probs==0.0).float()*1e-8
-        log_action_probs = torch.log(action_probs+z)
-
-        return distribution, action_probs, log_action_probs
-
-    def forward(self, obs, deterministic=False, with_logprob=True):
-
-        if self.discrete:
-            img = obs[0]
-            inform = obs[1]
-
-            x = img / 255.0
-
-            #######TO:(N,C,H,W)
-            x = self.layer1(x)
-            inform = self.layer2(inform)
-            x = torch.cat((x, inform), -1)
-
-            x = self.prob(x)
-
-            distribution = Categorical(logits=x)
-
-            if deterministic:
-                action = distribution.probs.argmax(dim=-1)
-            else:
-                action = distribution.sample()
-
-            if with_logprob:
-                action_log_probs = distribution.log_prob(action)
-            else:
-                action_log_probs = None
-
-            return action.unsqueeze(-1), action_log_probs
-
-        else:
-            img = obs[0]
-            inform = obs[1]
-
-            x = img / 255.0
-
-            #######TO:(N,C,H,W)
-            x = self.layer1(x)
-            inform = self.layer2(inform)
-            x = torch.cat((x, inform), -1)
-
-            mu = self.mu(x)
-            log_std = self.log_std(x)
-            log_std = torch.clamp(log_std, LOG_STD_MIN, LOG_STD_MAX)
-            std = torch.exp(log_std)
-
-            pi_dis = Independent(Normal(mu, std),1)
-
-            if deterministic:
-                pi_action = mu
-            else:
-                pi_action = pi_dis.rsample()
-
-            if with_logprob:
-                log_pi = pi_dis.log_prob(pi_action)
-                log_pi -= (2*(np.log(2)-pi_action-F.softplus(-2*pi_action))).sum(axis=1)
-
-            else:
-                log_pi = None
-
-            pi_action = torch.tanh(pi_action)
-            pi_action = self.act_limit*pi_action
-
-            return pi_action, log_pi
-
-class Qfunc(nn.Module):
-    def __init__(self, obs_dim, act_dim, hidden_size, activation, discrete=False,
-                 sattn=False):
-        super().__init__()
-        init_ = lambda m: init(m, nn.init.orthogonal_, lambda x: nn.init.
-                               constant_(x, 0), nn.init.calculate_gain('relu'))
-
-        num_inputs = obs_dim[0]
-        self.discrete = discrete
-        if sattn:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                CNNAttention(16, name = "q_l1"),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                CNNAttention(32, name = "q_l2"),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-        else:
-            self.layer1 = nn.Sequential(
-                init_(nn.Conv2d(num_inputs, 16, 8, stride=4)), nn.ReLU(),
-                init_(nn.Conv2d(16, 32, 4, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(32, 64, 3, stride=2)), nn.ReLU(),
-                init_(nn.Conv2d(64, 32, 1, stride=1)), nn.ReLU(),
-                Flatten(),
-            )
-
-        if discrete:
-            self.layer2 = nn.Sequential(init_(nn.Linear(INCORPORATE, 64)),
-                                        nn.ReLU(),
-                                        )
-            self.q = nn.Sequential(init_(nn.Linear(64+ 800, hidden_size)),
-                                    activation(),
-                                    init_(nn.Linear(hidden_size, act_dim))
-                                    )
-        else:
-            self.layer2 = nn.Sequential(init_(nn.Linear(INCORPORATE + 800, hidden_size)),
-                                        nn.ReLU(),
-                                        )
-            self.q = nn.Sequential(init_(nn.Linear(hidden_size + act_dim, hidden_size)),
-                                    activation(),
-                                    init_(nn.Linear(hidden_size, 1))
-                                    )
-
-    def evaluate(self, obs):
-        img = obs[0]
-        inform = obs[1]
-
-        x = img / 255.0
-
-        #######TO:(N,C,H,W)
-        x = self.layer1(x)
-        inform = self.layer2(inform)
-        x = torch.cat((x, inform), -1)
-
-        q = self.q(x)
-
-        return q
-
-    def forward(self, obs, act):
-
-        if self.discrete:
-            img = obs[0]
-            inform = obs[1]
-
-            x = img / 255.0
-
-            #######TO:(N,C,H,W)
-            x = self.layer1(x)
-            inform = self.layer2(inform)
-            x = torch.cat((x, inform), -1)
-
-
-            q = self.q(x).gather(1,act.long())
-
-            return q.squeeze(-1)
-        else:
-            img = obs[0]
-            inform = obs[1]
-
-            x = img / 255.0
-
-            #######TO:(N,C,H,W)
-            x = self.layer1(x)
-
-            x = torch.cat((x, inform), -1)
-
-            x = self.layer2(x)
-
-            x = torch.cat((x, act), -1)
-
-            q = self.q(x)
-
-            return q.squeeze(-1)
-
-class SACActorCritic(nn.Module):
-    def __init__(self,
-                 observation_space,
-                 action_space,
-                 device,
-                 sattn = False,
-                 hidden_size=512,
-                 activation=nn.ReLU,
-                 ):
-        super().__init__()
-        obs_dim=observation_space.shape
-
-        if action_space.__class__.__name__ == "Box":
-            act_dim = action_space.shape[0]
-            act_limit = action_space.high[0]
-            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, act_limit, sattn=sattn).to(device)
-            self.q1 = Qfunc(obs_dim, act_dim, hidden_size, activation, sattn=sattn).to(device)
-            self.q2 = Qfunc(obs_dim, act_dim, hidden_size, activation, sattn=sattn).to(device)
-
-        else:
-            act_dim = action_space.n
-            self.pi = Actor(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
-            self.q1 = Qfunc(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
-            self.q2 = Qfunc(obs_dim, act_dim, hidden_size, activation, discrete=True, sattn=sattn).to(device)
-
-
-    def act(self, obs, deterministic=False):
-        with torch.no_grad():
-            a, _ = self.pi(obs, deterministic, False)
-            return a.cpu().numpy()
-
-
 def sac(ac,device,goal_share, seed=100, total_steps=int(5000), replay_size=int(1e5), gamma=0.99,
         polyak=0.995, lr=5e-4, alpha=0.2, batch_size=256, start_steps=5000,
-        update_after=10000, update_every=50, save_freq=3000, sattn= True):
+        update_after=10000, update_every=50, save_freq=3000, sattn= True, actor=None):
 
 
     env = AirSimEnv(need_render=False)
@@ -662,6 +348,11 @@ def sac(ac,device,goal_share, seed=100, total_steps=int(5000), replay_size=int(1
                             torch.as_tensor(o[1], dtype=torch.float32).unsqueeze(0).to(device)],
                       deterministic)
 
+    if actor is not None:
+        # exported deterministic actor (algorithm/export.py), run on the CPU
+        runtime = ActorRuntime(actor)
+        get_action = lambda o, deterministic=True: runtime.act(o)
+
     # Prepare for interaction with environment
 
     env.airgym.client.takeoffAsync().join()
@@ -758,10 +449,13 @@ def sac(ac,device,goal_share, seed=100, total_steps=int(5000), replay_size=int(1
             o = o2
 
 def det(model,device,name,goal_share):
+    from smoke.structures.image_list import to_image_list
+    from misc.move_to_airsim.client import MultirotorClient
 
-    client = airsim.MultirotorClient('127.0.0.1')
+    # images come over their own lane, not queued behind control calls
+    client = MultirotorClient(settings.ip, lanes=settings.rpc_lanes)
     client.confirmConnection()
-    gs = GridSpec(1, 1)
+    gs = gridspec.GridSpec(1, 1)
     while True:
 
         batch = []
@@ -886,9 +580,11 @@ def det(model,device,name,goal_share):
 
 
 def initialize_model(device):
+    from smoke.modeling.detector import build_detection_model
+    from smoke.utils.check_point import DetectronCheckpointer
 
     model_dir = path('./results') / 'AirSimEnv-v42' / 'SAC' / 'run6' / 'models'
-    ac = torch.load(str(model_dir) + "/actor_model_309000" + ".pt")['model']
+    ac = load_actor_critic(str(model_dir) + "/actor_model_309000" + ".pt", device)
     ac.to(device)
     print(ac)
 
@@ -923,6 +619,8 @@ if __name__ == '__main__':
         help="The path to the checkpoint for test, default is the latest checkpoint.",
         default=None,
     )
+    parser.add_argument("--actor", type=str, default=None,
+                        help="exported actor (.ts / .onnx from algorithm/export.py) to fly with")
     parser.add_argument("--num-gpus", type=int, default=1, help="number of gpus *per machine*")
     parser.add_argument("--num-machines", type=int, default=1)
     parser.add_argument(
@@ -963,6 +661,6 @@ if __name__ == '__main__':
                mp.Process(target=det, args=(model_1, device,"3d-back",goal_share)),
                mp.Process(target=det, args=(model_2, device,"3d-left",goal_share)),
                mp.Process(target=det, args=(model_3, device,"3d-right",goal_share)),
-               mp.Process(target=sac, args=(ac, device, goal_share)),]
+               mp.Process(target=sac, args=(ac, device, goal_share), kwargs=dict(actor=args.actor)),]
     [p.start() for p in process]
     [p.join() for p in process]
@@ -0,0 +1,275 @@
+"""
+asyncio client for the AirSim multirotor API.
+
+AsyncMultirotorClient speaks msgpack-rpc over asyncio streams, so several
+drones or several AirSim instances can be driven from one event loop:
+
+    clients = [AsyncMultirotorClient(port=41451 + i) for i in range(4)]
+    await asyncio.gather(*[c.moveByVelocityZ(1, 0, -1, 0.5) for c in clients])
+    states = await asyncio.gather(*[c.simGetGroundTruthKinematicsArray() for c in clients])
+
+Every call is bounded by timeout_value; a tighter per-call bound is
+``asyncio.wait_for(client.<call>(...), seconds)``. Cancelling a movement
+(directly or through a timeout) also sends cancelLastTask for the vehicle.
+Calls are spread over control / kinematics / image connections as in
+RpcPool (client.py).
+
+AsyncioMultirotorClient is the blocking MultirotorClient API on top of it
+(event loop in a daemon thread), used by AirLearningClient when
+settings.rpc_backend == 'asyncio'.
+"""
+import asyncio
+import itertools
+import threading
+
+import msgpack
+
+from .types import *
+from .client import IMAGE_METHODS, KINEMATICS_METHODS, MultirotorClient
+
+
+class RPCError(Exception):
+    pass
+
+
+class AsyncRpcConnection(object):
+    """One msgpack-rpc connection; requests are pipelined, matched by msgid."""
+
+    def __init__(self, ip, port):
+        self.ip = ip
+        self.port = port
+        self.reader = self.writer = None
+        self.pending = {}
+        self.msgids = itertools.count()
+        self.packer = msgpack.Packer(use_bin_type=True, default=lambda obj: obj.to_msgpack())
+        self.open_lock = None
+
+    async def connect(self):
+        if self.open_lock is None:
+            self.open_lock = asyncio.Lock()
+        async with self.open_lock:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.ip, self.port)
+                self.reader_task = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        try:
+            while True:
+                data = await self.reader.read(1 << 16)
+                if not data:
+                    raise ConnectionError("AirSim closed the connection")
+                unpacker.feed(data)
+                for message in unpacker:
+                    # responses are [1, msgid, error, result]
+                    if message[0] != 1:
+                        continue
+                    future = self.pending.pop(message[1], None)
+                    if future is None or future.done():
+                        continue
+                    if message[2] is not None:
+                        future.set_exception(RPCError(message[2]))
+                    else:
+                        future.set_result(message[3])
+        except Exception as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.pending.clear()
+            self.writer = None
+
+    async def call(self, method, *args):
+        if self.writer is None:
+            await self.connect()
+        msgid = next(self.msgids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[msgid] = future
+        try:
+            self.writer.write(self.packer.pack([0, msgid, method, list(args)]))
+            await self.writer.drain()
+            return await future
+        finally:
+            # a cancelled call leaves no entry behind; its response is dropped
+            self.pending.pop(msgid, None)
+
+    async def close(self):
+        if self.writer is not None:
+            self.reader_task.cancel()
+            self.writer.close()
+            self.writer = None
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+
+class AsyncMultirotorClient(object):
+    def __init__(self, ip="", port=41451, timeout_value=30, lanes=None):
+        self.ip = ip or "127.0.0.1"
+        self.port = port
+        self.timeout_value = timeout_value
+        sizes = dict(control=1, kinematics=1, images=1)
+        sizes.update(lanes or {})
+        self.lanes = {name: [AsyncRpcConnection(self.ip, port) for _ in range(size)]
+                      for name, size in sizes.items()}
+
+    def _connection(self, method):
+        if method in IMAGE_METHODS:
+            lane = self.lanes['images']
+        elif method in KINEMATICS_METHODS:
+            lane = self.lanes['kinematics']
+        else:
+            lane = self.lanes['control']
+        return min(lane, key=lambda connection: len(connection.pending))
+
+    async def call(self, method, *args, timeout=None):
+        return await asyncio.wait_for(self._connection(method).call(method, *args),
+                                      self.timeout_value if timeout is None else timeout)
+
+    async def _task(self, method, vehicle_name, duration, *args):
+        # movements return when they are done on the server side
+        try:
+            return await self.call(method, *(args + (vehicle_name,)), timeout=duration + self.timeout_value)
+        except asyncio.CancelledError:
+            asyncio.ensure_future(self._connection('cancelLastTask').call('cancelLastTask', vehicle_name))
+            raise
+
+    async def close(self):
+        for lane in self.lanes.values():
+            for connection in lane:
+                await connection.close()
+
+    # -------------------------------------- common ----------------------------------------------
+    async def ping(self):
+        return await self.call('ping')
+
+    async def confirmConnection(self):
+        return await self.ping()
+
+    async def enableApiControl(self, is_enabled, vehicle_name=''):
+        return await self.call('enableApiControl', is_enabled, vehicle_name)
+
+    async def armDisarm(self, arm, vehicle_name=''):
+        return await self.call('armDisarm', arm, vehicle_name)
+
+    async def reset(self):
+        await self.call('reset')
+
+    async def resetUnreal(self, sleep_time_before=.1, sleep_time_after=.1):
+        # see VehicleClient.resetUnreal for the sleeps
+        await asyncio.sleep(sleep_time_before)
+        await self.call('resetUnreal')
+        await asyncio.sleep(sleep_time_after)
+
+    async def simPause(self, is_paused):
+        await self.call('simPause', is_paused)
+
+    async def cancelLastTask(self, vehicle_name=''):
+        await self.call('cancelLastTask', vehicle_name)
+
+    # -------------------------------------- sensing ---------------------------------------------
+    async def simGetGroundTruthKinematics(self, vehicle_name=''):
+        return KinematicsState.from_msgpack(await self.call('simGetGroundTruthKinematics', vehicle_name))
+
+    async def simGetGroundTruthKinematicsArray(self, vehicle_name='', out=None):
+        return kinematics_to_array(await self.call('simGetGroundTruthKinematics', vehicle_name), out)
+
+    async def getPitchRollYaw(self, vehicle_name=''):
+        kinematics = await self.simGetGroundTruthKinematicsArray(vehicle_name)
+        return to_eulerian_angles(kinematics[KINEMATICS_ORIENTATION])
+
+    async def getMultirotorState(self, vehicle_name=''):
+        return MultirotorState.from_msgpack(await self.call('getMultirotorState', vehicle_name))
+
+    async def simGetCollisionInfo(self, vehicle_name=''):
+        return CollisionInfo.from_msgpack(await self.call('simGetCollisionInfo', vehicle_name))
+
+    async def simGetObjectPose(self, object_name):
+        return Pose.from_msgpack(await self.call('simGetObjectPose', object_name))
+
+    async def simGetImages(self, requests, vehicle_name=''):
+        responses_raw = await self.call('simGetImages', requests, vehicle_name)
+        return [ImageResponse.from_msgpack(response_raw) for response_raw in responses_raw]
+
+    async def simGetImage(self, camera_name, image_type, vehicle_name=''):
+        result = await self.call('simGetImage', str(camera_name), image_type, vehicle_name)
+        if (result == "" or result == "\0"):
+            return None
+        return result
+
+    # -------------------------------------- movement --------------------------------------------
+    async def takeoff(self, timeout_sec=20, vehicle_name=''):
+        return await self._task('takeoff', vehicle_name, timeout_sec, timeout_sec)
+
+    async def land(self, timeout_sec=60, vehicle_name=''):
+        return await self._task('land', vehicle_name, timeout_sec, timeout_sec)
+
+    async def hover(self, vehicle_name=''):
+        return await self._task('hover', vehicle_name, 0.)
+
+    async def moveByVelocity(self, vx, vy, vz, duration, drivetrain=DrivetrainType.MaxDegreeOfFreedom,
+                             yaw_mode=YawMode(), vehicle_name=''):
+        return await self._task('moveByVelocity', vehicle_name, duration, vx, vy, vz, duration, drivetrain,
+                                yaw_mode)
+
+    async def moveByVelocityZ(self, vx, vy, z, duration, drivetrain=DrivetrainType.MaxDegreeOfFreedom,
+                              yaw_mode=YawMode(), vehicle_name=''):
+        return await self._task('moveByVelocityZ', vehicle_name, duration, vx, vy, z, duration, drivetrain,
+                                yaw_mode)
+
+    async def moveToPosition(self, x, y, z, velocity, timeout_sec=3e+38, drivetrain=DrivetrainType.MaxDegreeOfFreedom,
+                             yaw_mode=YawMode(), lookahead=-1, adaptive_lookahead=1, vehicle_name=''):
+        return await self._task('moveToPosition', vehicle_name, timeout_sec, x, y, z, velocity, timeout_sec,
+                                drivetrain, yaw_mode, lookahead, adaptive_lookahead)
+
+    async def moveOnPath(self, path, velocity, timeout_sec=3e+38, drivetrain=DrivetrainType.MaxDegreeOfFreedom,
+                         yaw_mode=YawMode(), lookahead=-1, adaptive_lookahead=1, vehicle_name=''):
+        return await self._task('moveOnPath', vehicle_name, timeout_sec, path, velocity, timeout_sec,
+                                drivetrain, yaw_mode, lookahead, adaptive_lookahead)
+
+    async def rotateToYaw(self, yaw, timeout_sec=3e+38, margin=5, vehicle_name=''):
+        return await self._task('rotateToYaw', vehicle_name, timeout_sec, yaw, timeout_sec, margin)
+
+    async def rotateByYawRate(self, yaw_rate, duration, vehicle_name=''):
+        return await self._task('rotateByYawRate', vehicle_name, duration, yaw_rate, duration)
+
+
+class BlockingFuture(object):
+    """join() / get() of a msgpackrpc Future, for a call running on the loop thread."""
+
+    def __init__(self, future):
+        self.future = future
+
+    def join(self):
+        self.future.exception()
+
+    def get(self):
+        return self.future.result()
+
+
+class BlockingTransport(object):
+    """msgpackrpc.Client's call / call_async on an AsyncMultirotorClient whose loop runs in a thread."""
+
+    def __init__(self, ip, port, timeout_value=30, lanes=None):
+        self.aio = AsyncMultirotorClient(ip, port, timeout_value, lanes)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def call_async(self, method, *args):
+        return BlockingFuture(asyncio.run_coroutine_threadsafe(self.aio.call(method, *args), self.loop))
+
+    def call(self, method, *args):
+        return self.call_async(method, *args).get()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.aio.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class AsyncioMultirotorClient(MultirotorClient):
+    """MultirotorClient (same blocking API) whose RPCs go through AsyncMultirotorClient."""
+
+    def __init__(self, ip="", port=41451, timeout_value=30, lanes=None):
+        # not MultirotorClient.__init__, which opens a msgpackrpc connection
+        self.ip = ip or "127.0.0.1"
+        self.client = BlockingTransport(self.ip, port, timeout_value, lanes)
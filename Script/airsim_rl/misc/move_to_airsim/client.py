@@ -11,22 +11,145 @@ import msgpack
 import time
 import math
 import logging
-import airsim
+import threading
+
+
+# -----------------------------------  Connection pool ---------------------------------------------
+# methods served by the image and kinematics lanes, everything else (moves,
+# api control, reset, ...) goes through the control lane
+IMAGE_METHODS = ('simGetImages', 'simGetImage', 'getLidarData')
+KINEMATICS_METHODS = ('simGetGroundTruthKinematics', 'getMultirotorState', 'simGetCollisionInfo',
+                      'simGetVehiclePose', 'simGetObjectPose', 'simGetGroundTruthEnvironment')
+
+
+class LaneFuture(object):
+    """msgpackrpc Future that runs its connection's loop under the connection lock."""
+
+    def __init__(self, future, lock, done):
+        self.future = future
+        self.lock = lock
+        # called once the result is in, to release the connection's in-flight slot
+        self.done = done
+
+    def join(self):
+        with self.lock:
+            self.future.join()
+        if self.done is not None:
+            self.done()
+            self.done = None
+
+    def get(self):
+        self.join()
+        return self.future.get()
+
+
+class RpcPool(object):
+    """
+    msgpackrpc connections to one AirSim server, split into lanes so that a
+    large simGetImages response does not hold up the control and kinematics
+    calls issued meanwhile from other threads (or through call_many).
+
+    lanes maps 'control' / 'kinematics' / 'images' to the number of
+    connections of that lane; connections are opened on first use, so a
+    process that only grabs images only opens image connections. Each
+    connection is used by one thread at a time; a call goes to the
+    connection of its lane with the fewest requests in flight, so the
+    requests of call_many overlap within a lane too.
+    """
+
+    def __init__(self, ip, port, timeout_value=30, lanes=None):
+        self.address = msgpackrpc.Address(ip, port)
+        self.timeout_value = timeout_value
+        sizes = dict(control=1, kinematics=1, images=1)
+        sizes.update(lanes or {})
+        self.lanes = {name: [None] * size for name, size in sizes.items()}
+        self.locks = {name: [threading.Lock() for _ in range(size)] for name, size in sizes.items()}
+        # requests sent and not yet answered, per connection
+        self.in_flight = {name: [0] * size for name, size in sizes.items()}
+        self.open_lock = threading.Lock()
+
+    def lane(self, method):
+        if method in IMAGE_METHODS:
+            return 'images'
+        if method in KINEMATICS_METHODS:
+            return 'kinematics'
+        return 'control'
+
+    def _connection(self, method):
+        name = self.lane(method)
+        in_flight = self.in_flight[name]
+        with self.open_lock:
+            i = min(range(len(in_flight)), key=in_flight.__getitem__)
+            in_flight[i] += 1
+            if self.lanes[name][i] is None:
+                self.lanes[name][i] = msgpackrpc.Client(self.address, timeout=self.timeout_value,
+                                                        pack_encoding='utf-8', unpack_encoding='utf-8')
+        return self.lanes[name][i], self.locks[name][i], lambda: self._release(name, i)
+
+    def _release(self, name, i):
+        with self.open_lock:
+            self.in_flight[name][i] -= 1
+
+    def call(self, method, *args):
+        rpc, lock, release = self._connection(method)
+        try:
+            with lock:
+                return rpc.call(method, *args)
+        finally:
+            release()
+
+    def call_async(self, method, *args):
+        rpc, lock, release = self._connection(method)
+        try:
+            with lock:
+                future = rpc.call_async(method, *args)
+        except Exception:
+            release()
+            raise
+        return LaneFuture(future, lock, release)
+
+    def close(self):
+        for name, connections in self.lanes.items():
+            for i, rpc in enumerate(connections):
+                if rpc is not None:
+                    with self.locks[name][i]:
+                        rpc.close()
+                    connections[i] = None
+
+
+def call_many(rpc, requests):
+    """
+    Results of requests, (method, arg, ...) tuples: all of them are sent
+    before the first result is waited for, so the calls overlap on the
+    server (and over the lanes of an RpcPool).
+    """
+    futures = [rpc.call_async(request[0], *request[1:]) for request in requests]
+    return [future.get() for future in futures]
 
 
 class VehicleClient:
-    def __init__(self, ip="", port=41451, timeout_value=30):
+    def __init__(self, ip="", port=41451, timeout_value=30, lanes=None):
         if (ip == ""):
             self.ip = "127.0.0.1"
         else:
             self.ip = ip
-        self.client = msgpackrpc.Client(msgpackrpc.Address(ip, port), timeout=timeout_value, pack_encoding='utf-8',
-                                        unpack_encoding='utf-8')
+        if lanes is None:
+            self.client = msgpackrpc.Client(msgpackrpc.Address(self.ip, port), timeout=timeout_value,
+                                            pack_encoding='utf-8', unpack_encoding='utf-8')
+        else:
+            # e.g. lanes={} for one control, kinematics and image connection each
+            self.client = RpcPool(self.ip, port, timeout_value, lanes)
+
+    def call_many(self, requests):
+        return call_many(self.client, requests)
 
     # -----------------------------------  Common vehicle APIs ---------------------------------------------
 
     @staticmethod
     def toEulerianAngle(q):
+        # batches of quaternions: (..., 4) arrays, x, y, z, w
+        if not isinstance(q, Quaternionr):
+            return to_eulerian_angles(q)
         z = q.z_val
         y = q.y_val
         x = q.x_val
@@ -204,6 +327,19 @@ class VehicleClient:
 
     simGetGroundTruthKinematics.__annotations__ = {'return': KinematicsState}
 
+    def simGetGroundTruthKinematicsArray(self, vehicle_name='', out=None):
+        """Kinematics as a float64 array (layout KINEMATICS_*), decoded straight
+        from the RPC response; out is filled in place when given."""
+        return kinematics_to_array(self.client.call('simGetGroundTruthKinematics', vehicle_name), out)
+
+    def simGetGroundTruthKinematicsArrays(self, vehicle_names, out=None):
+        """(len(vehicle_names), KINEMATICS_SIZE) array, one row per vehicle."""
+        if out is None:
+            out = np.empty((len(vehicle_names), KINEMATICS_SIZE), dtype=np.float64)
+        for i, vehicle_name in enumerate(vehicle_names):
+            kinematics_to_array(self.client.call('simGetGroundTruthKinematics', vehicle_name), out[i])
+        return out
+
     def simGetGroundTruthEnvironment(self, vehicle_name=''):
         env_state = self.client.call('simGetGroundTruthEnvironment', vehicle_name)
         return EnvironmentState.from_msgpack(env_state)
@@ -371,8 +507,8 @@ class VehicleClient:
 
 # -----------------------------------  Multirotor APIs ---------------------------------------------
 class MultirotorClient(VehicleClient, object):
-    def __init__(self, ip="", port=41451, timeout_value=30):
-        super(MultirotorClient, self).__init__(ip, port, timeout_value)
+    def __init__(self, ip="", port=41451, timeout_value=30, lanes=None):
+        super(MultirotorClient, self).__init__(ip, port, timeout_value, lanes)
 
     def takeoffAsync(self, timeout_sec=20, vehicle_name=''):
         return self.client.call_async('takeoff', timeout_sec, vehicle_name)
@@ -9,3 +9,4 @@ dir_path = os.path.dirname(file_path)
 print(airsim_dir)
 copy2(os.path.join(dir_path, "client.py"), airsim_dir)
 copy2(os.path.join(dir_path, "types.py"), airsim_dir)
+copy2(os.path.join(dir_path, "aio_client.py"), airsim_dir)
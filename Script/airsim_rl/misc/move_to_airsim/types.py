@@ -1,15 +1,22 @@
 from __future__ import print_function
-import msgpackrpc  # install as admin: pip install msgpack-rpc-python
 import numpy as np  # pip install numpy
 
 
-class MsgpackMixin:
+class MsgpackMixin(object):
+	# empty so that the __slots__ of the geometry types below are not undone
+	__slots__ = ()
+
+	def _fields(self):
+		if hasattr(self, '__dict__'):
+			return self.__dict__
+		return {k: getattr(self, k) for k in self.__slots__}
+
 	def __repr__(self):
 		from pprint import pformat
-		return "<" + type(self).__name__ + "> " + pformat(vars(self), indent=4, width=1)
+		return "<" + type(self).__name__ + "> " + pformat(self._fields(), indent=4, width=1)
 
 	def to_msgpack(self, *args, **kwargs):
-		return self.__dict__
+		return self._fields()
 
 	@classmethod
 	def from_msgpack(cls, encoded):
@@ -55,15 +62,17 @@ class WeatherParameter:
 
 
 class Vector3r(MsgpackMixin):
-	x_val = 0.0
-	y_val = 0.0
-	z_val = 0.0
+	__slots__ = ('x_val', 'y_val', 'z_val')
 
 	def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0):
 		self.x_val = x_val
 		self.y_val = y_val
 		self.z_val = z_val
 
+	@classmethod
+	def from_msgpack(cls, encoded):
+		return cls(encoded['x_val'], encoded['y_val'], encoded['z_val'])
+
 	@staticmethod
 	def nanVector3r():
 		return Vector3r(np.nan, np.nan, np.nan)
@@ -115,10 +124,7 @@ class Vector3r(MsgpackMixin):
 
 
 class Quaternionr(MsgpackMixin):
-	w_val = 0.0
-	x_val = 0.0
-	y_val = 0.0
-	z_val = 0.0
+	__slots__ = ('w_val', 'x_val', 'y_val', 'z_val')
 
 	def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0, w_val=1.0):
 		self.x_val = x_val
@@ -126,6 +132,10 @@ class Quaternionr(MsgpackMixin):
 		self.z_val = z_val
 		self.w_val = w_val
 
+	@classmethod
+	def from_msgpack(cls, encoded):
+		return cls(encoded['x_val'], encoded['y_val'], encoded['z_val'], encoded['w_val'])
+
 	@staticmethod
 	def nanQuaternionr():
 		return Quaternionr(np.nan, np.nan, np.nan, np.nan)
@@ -206,13 +216,16 @@ class Quaternionr(MsgpackMixin):
 
 
 class Pose(MsgpackMixin):
-	position = Vector3r()
-	orientation = Quaternionr()
+	__slots__ = ('position', 'orientation')
 
 	def __init__(self, position_val=Vector3r(), orientation_val=Quaternionr()):
 		self.position = position_val
 		self.orientation = orientation_val
 
+	@classmethod
+	def from_msgpack(cls, encoded):
+		return cls(Vector3r.from_msgpack(encoded['position']), Quaternionr.from_msgpack(encoded['orientation']))
+
 	@staticmethod
 	def nanPose():
 		return Pose(Vector3r.nanVector3r(), Quaternionr.nanQuaternionr())
@@ -331,12 +344,59 @@ class CarControls(MsgpackMixin):
 
 
 class KinematicsState(MsgpackMixin):
-	position = Vector3r()
-	orientation = Quaternionr()
-	linear_velocity = Vector3r()
-	angular_velocity = Vector3r()
-	linear_acceleration = Vector3r()
-	angular_acceleration = Vector3r()
+	__slots__ = ('position', 'orientation', 'linear_velocity', 'angular_velocity', 'linear_acceleration',
+	             'angular_acceleration')
+
+	def __init__(self, position=None, orientation=None, linear_velocity=None, angular_velocity=None,
+	             linear_acceleration=None, angular_acceleration=None):
+		self.position = Vector3r() if position is None else position
+		self.orientation = Quaternionr() if orientation is None else orientation
+		self.linear_velocity = Vector3r() if linear_velocity is None else linear_velocity
+		self.angular_velocity = Vector3r() if angular_velocity is None else angular_velocity
+		self.linear_acceleration = Vector3r() if linear_acceleration is None else linear_acceleration
+		self.angular_acceleration = Vector3r() if angular_acceleration is None else angular_acceleration
+
+	@classmethod
+	def from_msgpack(cls, encoded):
+		v = Vector3r.from_msgpack
+		return cls(v(encoded['position']), Quaternionr.from_msgpack(encoded['orientation']),
+		           v(encoded['linear_velocity']), v(encoded['angular_velocity']),
+		           v(encoded['linear_acceleration']), v(encoded['angular_acceleration']))
+
+
+# layout of the float64 arrays filled by kinematics_to_array
+# (quaternions x, y, z, w as in Quaternionr.to_numpy_array)
+KINEMATICS_POSITION = slice(0, 3)
+KINEMATICS_ORIENTATION = slice(3, 7)
+KINEMATICS_LINEAR_VELOCITY = slice(7, 10)
+KINEMATICS_ANGULAR_VELOCITY = slice(10, 13)
+KINEMATICS_SIZE = 13
+
+
+def kinematics_to_array(encoded, out=None):
+	"""Position, orientation, linear and angular velocity of a raw (msgpack
+	decoded dict) KinematicsState written into out, without building the
+	KinematicsState / Vector3r objects."""
+	if out is None:
+		out = np.empty(KINEMATICS_SIZE, dtype=np.float64)
+	p, q = encoded['position'], encoded['orientation']
+	v, w = encoded['linear_velocity'], encoded['angular_velocity']
+	out[0], out[1], out[2] = p['x_val'], p['y_val'], p['z_val']
+	out[3], out[4], out[5], out[6] = q['x_val'], q['y_val'], q['z_val'], q['w_val']
+	out[7], out[8], out[9] = v['x_val'], v['y_val'], v['z_val']
+	out[10], out[11], out[12] = w['x_val'], w['y_val'], w['z_val']
+	return out
+
+
+def to_eulerian_angles(q):
+	"""(pitch, roll, yaw) arrays of a (..., 4) array of x, y, z, w quaternions."""
+	q = np.asarray(q, dtype=np.float64)
+	x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+	ysqr = y * y
+	roll = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + ysqr))
+	pitch = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+	yaw = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (ysqr + z * z))
+	return pitch, roll, yaw
 
 
 class EnvironmentState(MsgpackMixin):
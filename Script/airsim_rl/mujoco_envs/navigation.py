@@ -62,3 +62,86 @@ class Navigation2DEnv(gym.Env):
         done = ((np.abs(x) < 0.01) and (np.abs(y) < 0.01))
 
         return self._state, reward, done, {'task': self._task}
+
+
+class BatchNavigation2DEnv(gym.Env):
+    """`num_envs` copies of `Navigation2DEnv` stepped in one vectorized call.
+
+    The points are held in a `(num_envs, 2)` state array and the goals in a
+    `(num_envs, 2)` array. Actions are clipped to [-0.1, 0.1] like in
+    `Navigation2DEnv.step`, but without the per-call `action_space.contains`
+    check. An env whose episode ends (goal reached or `max_episode_steps`,
+    the limit `2DNavigation-v1` is registered with) is reset in the same call
+    and, with `resample_tasks`, gets a new goal from `sample_tasks`; its final
+    state is returned in `infos['terminal_observation']`.
+    """
+    def __init__(self, num_envs, tasks=None, low=-0.5, high=0.5,
+                 max_episode_steps=100, resample_tasks=True):
+        super(BatchNavigation2DEnv, self).__init__()
+        self.num_envs = num_envs
+        self.low = low
+        self.high = high
+        self.max_episode_steps = max_episode_steps
+        self.resample_tasks = resample_tasks
+
+        self.single_observation_space = spaces.Box(low=-np.inf, high=np.inf,
+            shape=(2,), dtype=np.float32)
+        self.single_action_space = spaces.Box(low=-0.1, high=0.1,
+            shape=(2,), dtype=np.float32)
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf,
+            shape=(num_envs, 2), dtype=np.float32)
+        self.action_space = spaces.Box(low=-0.1, high=0.1,
+            shape=(num_envs, 2), dtype=np.float32)
+
+        self._state = np.zeros((num_envs, 2), dtype=np.float32)
+        self._goal = np.zeros((num_envs, 2), dtype=np.float32)
+        self._elapsed = np.zeros(num_envs, dtype=np.int64)
+        self.seed()
+        if tasks is not None:
+            self.reset_task(tasks)
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def sample_tasks(self, num_tasks):
+        goals = self.np_random.uniform(self.low, self.high, size=(num_tasks, 2))
+        tasks = [{'goal': goal} for goal in goals]
+        return tasks
+
+    def reset_task(self, tasks):
+        """One task for every env, or a single task shared by all of them."""
+        if isinstance(tasks, dict):
+            tasks = [tasks] * self.num_envs
+        self._goal[:] = [task['goal'] for task in tasks]
+
+    @property
+    def tasks(self):
+        return [{'goal': goal} for goal in self._goal.copy()]
+
+    def reset(self, env=True):
+        self._state[:] = 0
+        self._elapsed[:] = 0
+        return self._state.copy()
+
+    def step(self, actions):
+        actions = np.clip(actions, -0.1, 0.1)
+        self._state += actions
+        self._elapsed += 1
+
+        diff = self._state - self._goal
+        rewards = -np.sqrt((diff ** 2).sum(axis=1))
+        success = (np.abs(diff) < 0.01).all(axis=1)
+        dones = success | (self._elapsed >= self.max_episode_steps)
+
+        observations = self._state.copy()
+        infos = {'success': success, 'goal': self._goal.copy()}
+        if dones.any():
+            infos['terminal_observation'] = observations[dones]
+            self._state[dones] = 0
+            self._elapsed[dones] = 0
+            if self.resample_tasks:
+                self._goal[dones] = self.np_random.uniform(self.low, self.high,
+                    size=(int(dones.sum()), 2))
+            observations[dones] = 0
+        return observations, rewards, dones, infos
@@ -0,0 +1,164 @@
+"""
+Offline pre-training of the SAC agent from trajectories recorded with
+``SAC.py --record`` (common.trajectory), without Unreal / AirSim:
+
+1. behaviour cloning of the policy on the dataset actions (``bc_steps``),
+2. conservative offline SAC, i.e. make_update with the CQL penalty
+   ``cql_alpha`` (``sac_steps``). The penalty is implemented for the discrete
+   actions only; with ``--continuous`` this phase is plain offline SAC
+   (``cql_alpha`` defaults to 0 there and has to stay 0).
+
+Batches come from a multi-worker DataLoader over the memory-mapped chunks.
+Checkpoints have the SAC.py layout (actor_model_<t>.pt with 'model' and
+'config'), so eval_SAC.py loads them and ``SAC.py --pretrained`` starts
+online training from them.
+
+    python offline_sac.py --data results/AirSimEnv-v42/SAC/run3/trajectories
+"""
+import argparse
+import os
+import time
+from copy import deepcopy
+from pathlib import Path
+
+import gym
+import numpy as np
+import torch
+from tqdm import trange
+
+from SAC import SACActorCritic, make_update
+from common.checkpoint import CheckpointManager
+from common.metrics import MetricsAccumulator
+from common.scalar_writer import ScalarWriter
+from common.train_utils import make_adam, backward_to
+from common.trajectory import TrajectoryDataset, make_loader, batch_to_device
+
+
+def make_bc_update(ac, discrete, lr=5e-4):
+    """Behaviour-cloning step ``update(data, metrics, t)`` for ac.pi (and the
+    shared encoder): NLL of the dataset actions, MSE for continuous ones."""
+    params = list(ac.pi.parameters())
+    if ac.shared_encoder:
+        params += list(ac.encoder.parameters())
+    optimizer = make_adam(params, lr=lr)
+
+    def update(data, metrics, t):
+        o, a = ac.encode(data['obs']), data['act']
+        if discrete:
+            _, _, log_prob = ac.pi.evaluate(o)
+            loss = -log_prob.gather(1, a.long()).mean()
+        else:
+            pi, _ = ac.pi(o, True, False)
+            loss = ((pi - a) ** 2).sum(dim=-1).mean()
+        optimizer.zero_grad(set_to_none=True)
+        backward_to(loss, params)
+        optimizer.step()
+        metrics.add('bc_loss', loss)
+        metrics.step(t)
+
+    update.optimizers = {'bc_optimizer': optimizer}
+    return update
+
+
+def offline_sac(device, data, seed=1, bc_steps=20000, sac_steps=100000, batch_size=256,
+                num_workers=4, gamma=0.99, polyak=0.995, lr=5e-4, alpha=0.2, cql_alpha=None,
+                sattn=True, shared_encoder=None, num_q=2, num_q_min=2, discrete=True,
+                num_actions=8, save_freq=10000, log_every=100):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    if cql_alpha is None:
+        cql_alpha = 1.0 if discrete else 0.
+    # as in SAC.sac: separate conv stacks make a wide ensemble conv-bound
+    if shared_encoder is None:
+        shared_encoder = num_q > 2
+
+    dataset = TrajectoryDataset(data)
+    sample = dataset.get([0])
+    observation_space = gym.spaces.Box(0, 255, sample['obs'].shape[1:], dtype=np.float32)
+    if discrete:
+        action_space = gym.spaces.Discrete(num_actions)
+    else:
+        # AirSimEnv's moveByVelocity action space
+        action_space = gym.spaces.Box(-0.3, 0.3, sample['act'].shape[1:], dtype=np.float32)
+    print("{} transitions, {} episodes".format(len(dataset), dataset.num_episodes))
+
+    model_dir = Path('./results') / 'AirSimEnv-v42' / 'SAC_offline'
+    if not model_dir.exists():
+        curr_run = 'run1'
+    else:
+        exst_run_nums = [int(str(folder.name).split('run')[1]) for folder in model_dir.iterdir() if
+                         str(folder.name).startswith('run')]
+        if len(exst_run_nums) == 0:
+            curr_run = 'run1'
+        else:
+            curr_run = 'run%i' % (max(exst_run_nums) + 1)
+    run_dir = model_dir / curr_run
+    log_dir = run_dir / 'logs'
+    save_dir = run_dir / 'models'
+    os.makedirs(str(log_dir))
+    os.makedirs(str(save_dir))
+
+    ac = SACActorCritic(observation_space, action_space, device=device, sattn=sattn,
+                        shared_encoder=shared_encoder, num_q=num_q)
+    config = dict(observation_space=observation_space, action_space=action_space,
+                  sattn=sattn, shared_encoder=shared_encoder, num_q=num_q)
+
+    logger = ScalarWriter(str(log_dir))
+    metrics = MetricsAccumulator(logger, flush_every=log_every)
+    checkpoints = CheckpointManager(save_dir, prefix='actor_model')
+    loader = iter(make_loader(data, batch_size, num_workers, seed,
+                              pin_memory=device.type == 'cuda'))
+
+    def run(phase, update, steps, start, train_state):
+        tic, t = time.perf_counter(), start
+        for t in trange(start, start + steps, desc=phase):
+            update(batch_to_device(next(loader), device), metrics, t)
+            if (t + 1) % log_every == 0:
+                rate = log_every * batch_size / (time.perf_counter() - tic)
+                logger.add_scalars('samples_per_second', {'samples_per_second': rate}, t)
+                tic = time.perf_counter()
+            if (t + 1) % save_freq == 0:
+                checkpoints.save(t, train_state, config=config, phase=phase)
+        return t + 1
+
+    # 1. behaviour cloning warm start of the policy
+    bc_update = make_bc_update(ac, discrete, lr)
+    t = run('bc', bc_update, bc_steps, 0, dict(model=ac, **bc_update.optimizers))
+
+    # 2. conservative SAC; the target critics start from the current ones
+    ac_target = deepcopy(ac)
+    for p in ac_target.parameters():
+        p.requires_grad = False
+    update = make_update(ac, ac_target, discrete, gamma, alpha, polyak, lr,
+                         num_q, num_q_min, cql_alpha=cql_alpha)
+    train_state = dict(model=ac, ac_target=ac_target, **update.optimizers)
+    t = run('sac', update, sac_steps, t, train_state)
+
+    checkpoints.save(t - 1, train_state, config=config, phase='sac')
+    checkpoints.close()
+    logger.close()
+    return ac
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, required=True,
+                        help='trajectory directory written by SAC.py --record')
+    parser.add_argument('--bc_steps', type=int, default=20000)
+    parser.add_argument('--sac_steps', type=int, default=100000)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--cql_alpha', type=float, default=None,
+                        help='CQL penalty weight (discrete actions only); default 1.0, 0 with --continuous')
+    # SAC.py builds its networks with self-attention, so --pretrained needs the same
+    parser.add_argument('--no_sattn', action='store_true', default=False)
+    parser.add_argument('--continuous', action='store_true', default=False)
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+    if args.continuous and args.cql_alpha:
+        parser.error('the CQL penalty is implemented for discrete actions; use --cql_alpha 0 with --continuous')
+
+    offline_sac(torch.device(args.device), args.data, bc_steps=args.bc_steps,
+                sac_steps=args.sac_steps, batch_size=args.batch_size,
+                num_workers=args.num_workers, cql_alpha=args.cql_alpha, sattn=not args.no_sattn,
+                discrete=not args.continuous)
@@ -3,105 +3,19 @@ import gym
 import numpy as np
 from pathlib import Path
 import torch
-from tensorboardX import SummaryWriter
+from common.scalar_writer import ScalarWriter
 import torch.nn as nn
-import torch.optim as optim
 import torch.autograd as autograd
 import gym_airsim
 from game_handling.game_handler_class import *
 from Rainbow.common.wrappers import make_atari, wrap_deepmind, wrap_pytorch
+from common.replay_buffer import PrioritizedReplayBuffer
+from common.train_utils import make_adam, soft_update
+from common.metrics import MetricsAccumulator, mean_grad_norm
 from tqdm import trange
 import cv2
 
-
-def get_p_and_g_mean_norm(it):
-
-    size = 1e-8
-    su_p = 0
-    su_g = 0
-    for x in it:
-        if x.grad is None:continue
-        size += 1.
-        su_p += x.norm()
-        su_g += x.grad.norm()
-    return su_p / size, su_g / size
-
-class NaivePrioritizedBuffer(object):
-    def __init__(self, capacity, prob_alpha=0.6):
-        self.prob_alpha = prob_alpha
-        self.capacity = capacity
-        self.buffer = []
-        self.pos = 0
-        self.priorities = np.zeros((capacity,), dtype=np.float32)
-
-
-    def push(self, state, action, reward, next_state, done):
-        assert state.ndim == next_state.ndim
-        state = np.expand_dims(state, 0)
-        next_state = np.expand_dims(next_state, 0)
-
-        max_prio = self.priorities.max() if self.buffer else 1.0
-
-
-        if len(self.buffer) < self.capacity:
-            self.buffer.append((state, action, reward, next_state, done))
-        else:
-            self.buffer[self.pos] = (state, action, reward, next_state, done)
-
-        self.priorities[self.pos] = max_prio
-        self.pos = (self.pos + 1) % self.capacity
-
-    def push_airsim(self, state, action, reward, next_state, done):
-        img=state[0]
-        inform=state[1]
-        state = [img,inform]
-        img = next_state[0]
-        inform = next_state[1]
-        next_state = [img,inform]
-
-        max_prio = self.priorities.max() if self.buffer else 1.0
-
-
-        if len(self.buffer) < self.capacity:
-            self.buffer.append((state, action, reward, next_state, done))
-        else:
-            self.buffer[self.pos] = (state, action, reward, next_state, done)
-
-        self.priorities[self.pos] = max_prio
-        self.pos = (self.pos + 1) % self.capacity
-
-    def sample(self, batch_size, beta=0.4):
-        if len(self.buffer) == self.capacity:
-            prios = self.priorities
-        else:
-            prios = self.priorities[:self.pos]
-
-        probs  = prios ** self.prob_alpha
-        probs /= probs.sum()
-
-        indices = np.random.choice(len(self.buffer), batch_size, p=probs)
-        samples = [self.buffer[idx] for idx in indices]
-
-        total    = len(self.buffer)
-        weights  = (total * probs[indices]) ** (-beta)
-        weights /= weights.max()
-        weights  = np.array(weights, dtype=np.float32)
-
-        batch       = list(zip(*samples))
-        states      = batch[0]
-        actions     = batch[1]
-        rewards     = batch[2]
-        next_states = batch[3]
-        dones       = batch[4]
-
-        return states, actions, rewards, next_states, dones, indices, weights
-
-    def update_priorities(self, batch_indices, batch_priorities):
-        for idx, prio in zip(batch_indices, batch_priorities):
-            self.priorities[idx] = prio
-
-    def __len__(self):
-        return len(self.buffer)
+INCORPORATE = 7
 
 
 class CnnDQN(nn.Module):
@@ -121,7 +35,7 @@ class CnnDQN(nn.Module):
         )
 
         self.fc = nn.Sequential(
-            nn.Linear(self.feature_size()+10, 512),
+            nn.Linear(self.feature_size()+INCORPORATE, 512),
             nn.ReLU(),
             nn.Linear(512, self.num_actions)
         )
@@ -173,15 +87,9 @@ class CnnDQN(nn.Module):
         return action
 
     def forward_airsim(self,state,device):
-        if len(state) == 2:
-            state = [state]
-
-        img = np.array([i[0] for i in state])
-        inform = np.array([i[1] for i in state])
-
-        img = img / 255.0
-        img = torch.FloatTensor(np.float32(img)).to(device)
-        inform = torch.FloatTensor(np.float32(inform)).to(device)
+        # state is a batched [img, inform] pair as sampled from the replay buffer
+        img = torch.as_tensor(state[0], device=device).float() / 255.0
+        inform = torch.as_tensor(state[1], dtype=torch.float32, device=device)
         ####### TO:(N,C,H,W)
         #img = img.permute(0, 3, 1, 2)
 
@@ -265,12 +173,15 @@ class PER_DQN(object):
             self.target_model = DQN(num_inputs[0], num_actions)
 
         self.device=device
-        self.optimizer = optim.Adam(self.current_model.parameters(),lr=lr,eps=eps)
+        self.optimizer = make_adam(self.current_model.parameters(),lr=lr,eps=eps)
 
-        self.replay_buffer = NaivePrioritizedBuffer(capacity)
+        if CNN:
+            self.replay_buffer = PrioritizedReplayBuffer(capacity, num_inputs, inform_dim=INCORPORATE)
+        else:
+            self.replay_buffer = PrioritizedReplayBuffer(capacity, num_inputs, obs_dtype=np.float32)
         if REW_BN:
             self.bn=rew_bn()
-            self.bn_optimizer= optim.Adam(self.bn.parameters(),lr=lr,eps=eps)
+            self.bn_optimizer= make_adam(self.bn.parameters(),lr=lr,eps=eps)
 
     def compute_td_loss(self,batch_size, beta):
 
@@ -278,10 +189,10 @@ class PER_DQN(object):
 
         #state = torch.FloatTensor(np.float32(state)).to(self.device)
         #next_state = torch.FloatTensor(np.float32(next_state)).to(self.device)
-        action = torch.LongTensor(np.array(action)).to(self.device)
-        reward = torch.FloatTensor(reward).to(self.device)
-        done = torch.FloatTensor(done).to(self.device)
-        weights = torch.FloatTensor(weights).to(self.device)
+        action = torch.as_tensor(action, device=self.device)
+        reward = torch.as_tensor(reward, device=self.device)
+        done = torch.as_tensor(done, device=self.device)
+        weights = torch.as_tensor(weights, device=self.device)
 
         if REW_BN:
             reward=self.bn(reward)
@@ -303,7 +214,7 @@ class PER_DQN(object):
 
         loss.backward()
 
-        _, grad_norm = get_p_and_g_mean_norm(self.current_model.parameters())
+        grad_norm = mean_grad_norm(self.current_model.parameters())
 
         nn.utils.clip_grad_norm_(self.current_model.parameters(), 20)
 
@@ -322,8 +233,7 @@ class PER_DQN(object):
             source (torch.nn.Module): Net whose parameters to copy
             tau (float, 0 < x < 1): Weight factor for update
         """
-        for target_param, param in zip(self.target_model.parameters(), self.current_model.parameters()):
-            target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
+        soft_update(self.current_model, self.target_model, tau)
 
 
     # https://github.com/ikostrikov/pytorch-ddpg-naf/blob/master/ddpg.py#L15
@@ -388,7 +298,9 @@ log_dir = run_dir / 'logs'
 save_dir = run_dir / 'models'
 os.makedirs(str(log_dir))
 os.makedirs(str(save_dir))
-logger = SummaryWriter(str(log_dir))
+logger = ScalarWriter(str(log_dir))
+# losses and grad norms are averaged on-device and written every 100 updates
+metrics = MetricsAccumulator(logger, flush_every=100)
 
 
 USE_CUDA = torch.cuda.is_available()
@@ -447,7 +359,7 @@ for frame_idx in trange(1, num_frames + 1):
 
     reward=reward/50
 
-    per_dqn.replay_buffer.push_airsim(state, action, reward, next_state, done)
+    per_dqn.replay_buffer.push(state, action, reward, next_state, done)
 
     img = np.array(state[0][0], dtype=np.uint8)
     cv2.imshow("0", img)
@@ -471,12 +383,9 @@ for frame_idx in trange(1, num_frames + 1):
         loss,grad_norm = per_dqn.compute_td_loss(batch_size, beta)
         losses.append(loss.data)
 
-        logger.add_scalars('grad_norm',
-                                {'grad_norm': grad_norm},
-                                frame_idx)
-        logger.add_scalars('value_loss',
-                           {'value_loss': loss},
-                           frame_idx)
+        metrics.add('grad_norm', grad_norm)
+        metrics.add('value_loss', loss)
+        metrics.step(frame_idx)
 
         #per_dqn.soft_update(tau)
 
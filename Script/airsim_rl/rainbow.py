@@ -3,84 +3,18 @@ import numpy as np
 import random,math
 import torch
 import torch.nn as nn
-import torch.optim as optim
 import torch.autograd as autograd
 import torch.nn.functional as F
 from Rainbow.common.layers import NoisyLinear
+from common.replay_buffer import PrioritizedReplayBuffer
+from common.nstep import NStepTransitionAssembler
+from common.train_utils import make_adam, soft_update
+from common.metrics import MetricsAccumulator, mean_grad_norm
 import gym_airsim
 from game_handling.game_handler_class import *
 from tqdm import trange
 from pathlib import Path
-from tensorboardX import SummaryWriter
-
-
-def get_p_and_g_mean_norm(it):
-
-    size = 1e-8
-    su_p = 0
-    su_g = 0
-    for x in it:
-        if x.grad is None:continue
-        size += 1.
-        su_p += x.norm()
-        su_g += x.grad.norm()
-    return su_p / size, su_g / size
-
-
-class NaivePrioritizedBuffer(object):
-    def __init__(self, capacity, prob_alpha=0.6):
-        self.prob_alpha = prob_alpha
-        self.capacity   = capacity
-        self.buffer     = []
-        self.pos        = 0
-        self.priorities = np.zeros((capacity,), dtype=np.float32)
-
-    def push(self, state, action, reward, next_state, done):
-        #assert state.ndim == next_state.ndim
-        state      = np.expand_dims(state, 0)
-        next_state = np.expand_dims(next_state, 0)
-
-        max_prio = self.priorities.max() if self.buffer else 1.0
-        if len(self.buffer) < self.capacity:
-            self.buffer.append((state, action, reward, next_state, done))
-        else:
-            self.buffer[self.pos] = (state, action, reward, next_state, done)
-
-        self.priorities[self.pos] = max_prio
-        self.pos = (self.pos + 1) % self.capacity
-
-    def sample(self, batch_size, beta=0.4):
-        if len(self.buffer) == self.capacity:
-            prios = self.priorities
-        else:
-            prios = self.priorities[:self.pos]
-
-        probs  = prios ** self.prob_alpha
-        probs /= probs.sum()
-
-        indices = np.random.choice(len(self.buffer), batch_size, p=probs)
-        samples = [self.buffer[idx] for idx in indices]
-
-        total    = len(self.buffer)
-        weights  = (total * probs[indices]) ** (-beta)
-        weights /= weights.max()
-        weights  = np.array(weights, dtype=np.float32)
-
-        batch       = list(zip(*samples))
-        states      = np.concatenate(batch[0])
-        actions     = batch[1]
-        rewards     = np.array(batch[2])
-        next_states = np.concatenate(batch[3])
-        dones       = batch[4]
-
-        return states, actions, rewards, next_states, dones, indices, weights
-
-    def update_priorities(self, batch_indices, batch_priorities):
-        for idx, prio in zip(batch_indices, batch_priorities):
-            self.priorities[idx] = prio
-
-    def __len__(self):
-        return len(self.buffer)
+from common.scalar_writer import ScalarWriter
 
 
 class RainbowDQN(nn.Module):
@@ -151,12 +85,15 @@ class RainbowDQN(nn.Module):
 
 class Rainbow(object):
 
-    def __init__(self,lr,num_inputs, num_actions, num_atoms, Vmin, Vmax,capacity,use_popart, prob_alpha=0.6):
+    def __init__(self,lr,num_inputs, num_actions, num_atoms, Vmin, Vmax,capacity,use_popart, prob_alpha=0.6,
+                 gamma=0.99, n_step=1):
         self.current_model = RainbowDQN(num_inputs, num_actions, num_atoms, Vmin, Vmax)
         self.target_model = RainbowDQN(num_inputs, num_actions, num_atoms, Vmin, Vmax)
 
-        self.replay_buffer=NaivePrioritizedBuffer(capacity,prob_alpha)
-        self.optimizer = optim.Adam(self.current_model.parameters(), lr)
+        self.replay_buffer=PrioritizedReplayBuffer(capacity,num_inputs,prob_alpha=prob_alpha,obs_dtype=np.float32)
+        # the buffer stores n-step returns, projected with a gamma ** n_step bootstrap
+        self.nstep = NStepTransitionAssembler(n_step, gamma)
+        self.optimizer = make_adam(self.current_model.parameters(), lr)
         self.num_atoms=num_atoms
         self.Vmin=Vmin
         self.Vmax=Vmax
@@ -175,8 +112,7 @@ class Rainbow(object):
             source (torch.nn.Module): Net whose parameters to copy
             tau (float, 0 < x < 1): Weight factor for update
         """
-        for target_param, param in zip(self.target_model.parameters(), self.current_model.parameters()):
-            target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
+        soft_update(self.current_model, self.target_model, tau)
 
     # https://github.com/ikostrikov/pytorch-ddpg-naf/blob/master/ddpg.py#L15
     def hard_update(self):
@@ -209,7 +145,7 @@ class Rainbow(object):
         dones = dones.unsqueeze(1).expand_as(next_dist)
         support = support.unsqueeze(0).expand_as(next_dist)
 
-        Tz = rewards + (1 - dones) * 0.99 * support
+        Tz = rewards + (1 - dones) * self.nstep.discount * support
         Tz = Tz.clamp(min=self.Vmin, max=self.Vmax)
         b = (Tz - self.Vmin) / delta_z
 
@@ -259,7 +195,7 @@ class Rainbow(object):
         self.optimizer.zero_grad()
         loss.backward()
 
-        _, grad_norm = get_p_and_g_mean_norm(self.current_model.parameters())
+        grad_norm = mean_grad_norm(self.current_model.parameters())
         #nn.utils.clip_grad_norm_(self.current_model.parameters(), 100)
 
         self.replay_buffer.update_priorities(indices, prios.data.cpu().numpy())
@@ -311,7 +247,9 @@ log_dir = run_dir / 'logs'
 save_dir = run_dir / 'models'
 os.makedirs(str(log_dir))
 os.makedirs(str(save_dir))
-logger = SummaryWriter(str(log_dir))
+logger = ScalarWriter(str(log_dir))
+# losses and grad norms are averaged on-device and written every 100 updates
+metrics = MetricsAccumulator(logger, flush_every=100)
 
 
 tau=0.01
@@ -323,6 +261,7 @@ capacity=100000
 num_frames = 100000
 batch_size = 64
 gamma = 0.99
+n_step = 1
 
 beta_start = 0.4
 beta_frames = 1000
@@ -341,7 +280,8 @@ USE_CUDA = torch.cuda.is_available()
 Variable = lambda *args, **kwargs: autograd.Variable(*args, **kwargs).cuda() if USE_CUDA else autograd.Variable(*args, **kwargs)
 
 use_popart=True
-rainbow= Rainbow(lr,env.observation_space.shape[0], env.action_space.n, num_atoms, Vmin, Vmax,capacity,use_popart)
+rainbow= Rainbow(lr,env.observation_space.shape[0], env.action_space.n, num_atoms, Vmin, Vmax,capacity,use_popart,
+                 gamma=gamma, n_step=n_step)
 if USE_CUDA:
     current_model = rainbow.current_model.cuda()
     target_model = rainbow.target_model.cuda()
@@ -362,7 +302,8 @@ for frame_idx in trange(1, num_frames + 1):
         reward=reward/100
     else:
         next_state, reward, done, _ = env.step(action)
-    rainbow.replay_buffer.push(state, action, reward, next_state, done)
+    for transition in rainbow.nstep.push(state, action, reward, next_state, done):
+        rainbow.replay_buffer.push(*transition)
 
     state = next_state
     episode_reward += reward
@@ -382,12 +323,9 @@ for frame_idx in trange(1, num_frames + 1):
         loss,grad_norm = rainbow.compute_td_loss(batch_size, beta)
         losses.append(loss.data)
 
-        logger.add_scalars('grad_norm',
-                                {'grad_norm': grad_norm},
-                                frame_idx)
-        logger.add_scalars('value_loss',
-                           {'value_loss': loss},
-                           frame_idx)
+        metrics.add('grad_norm', grad_norm)
+        metrics.add('value_loss', loss)
+        metrics.step(frame_idx)
 
         rainbow.soft_update(tau)
 
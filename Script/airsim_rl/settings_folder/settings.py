@@ -76,6 +76,11 @@ environment_change_frequency = {"ArenaSize":5, "Seed": 5, "NumberOfObjects": 5,
 ## ------------------------------------------------------------
 #ip = '10.243.49.243'
 ip = '127.0.0.1'
+# connections per lane of misc/move_to_airsim/client.py RpcPool (None: a
+# single msgpackrpc connection), so images do not block control / kinematics
+rpc_lanes = {'control': 1, 'kinematics': 1, 'images': 1}
+# 'msgpackrpc' or 'asyncio' (misc/move_to_airsim/aio_client.py)
+rpc_backend = 'msgpackrpc'
 
 # ---------------------------
 # parameters
@@ -120,6 +125,13 @@ window_restart_ctr_threshold = 2  # how many times we are allowed to restart the
 #-------------------------------
 #control mode
 control_mode="Discrete" # "moveByVelocity" "Discrete"
+# seconds each moveByVelocity setpoint is flown (the control period)
+control_dt = 0.35
+# control periods per decision of the policy. moveByVelocity: an action holds
+# action_chunk velocity deltas, flown as one moveOnPath; Discrete: the action
+# is held for action_chunk * rot_dur in one RPC. The kinematics are sampled
+# every period meanwhile (needs rpc_lanes).
+action_chunk = 1
 
 #-------------------------------
 #algorithm
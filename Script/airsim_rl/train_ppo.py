@@ -1,16 +1,18 @@
 #!/usr/bin/env python
 from pathlib import Path
 import torch
-from tensorboardX import SummaryWriter
+from common.scalar_writer import ScalarWriter
+from common.checkpoint import CheckpointManager, load_checkpoint, latest_checkpoint
 from gym_airsim.envs.AirGym import AirSimEnv
+from gym_airsim.surrogate import AirSimSurrogateEnv
 from algorithm.ppo import PPO
 from algorithm.model import Policy
 import shutil
 from config import get_config
 from utils.util import update_linear_schedule
 from utils.storage import RolloutStorage
-import cv2
-import baselines
+from common.lazy import lazy_import
+cv2 = lazy_import('cv2')
 import time
 import numpy as np
 import os
@@ -54,7 +56,7 @@ def main():
     save_dir = run_dir / 'models'
     os.makedirs(str(log_dir))
     os.makedirs(str(save_dir))
-    logger = SummaryWriter(str(log_dir))
+    logger = ScalarWriter(str(log_dir))
 
     # episode steps should be the same with settings
     #args.episode_length = settings.nb_max_episodes_steps
@@ -62,12 +64,18 @@ def main():
     shutil.copy("./settings_folder/settings.py", str(run_dir / 'settings.py'))
 
     ##You need first start Unreal Editor, then the initialization can be completed
-    env = AirSimEnv(need_render=False)
+    env = AirSimSurrogateEnv() if args.surrogate else AirSimEnv(need_render=False)
     env.seed(args.seed)
 
     #Policy network
+    checkpoint = None
     if args.continue_last:
-        actor_critic=torch.load(args.model_dir + "/agent_model" + ".pt")['model']
+        checkpoint = load_checkpoint(latest_checkpoint(args.model_dir, 'agent_model') or
+                                     args.model_dir + "/agent_model" + ".pt")
+    if checkpoint is not None and isinstance(checkpoint['model'], torch.nn.Module):
+        # older runs pickled the whole module
+        actor_critic = checkpoint['model']
+        checkpoint = None
     else:
         actor_critic = Policy(env.observation_space.shape,
                               env.action_space,
@@ -96,6 +104,10 @@ def main():
                 huber_delta=args.huber_delta,
                 device=device)
 
+    # the last keep_last checkpoints, written by a background thread
+    checkpoints = CheckpointManager(save_dir, keep_last=args.keep_last, prefix='agent_model')
+    train_state = dict(model=actor_critic, optimizer=agent.optimizer)
+
     # replay buffer
     rollout = RolloutStorage(args.episode_length,
                              args.n_rollout_threads,
@@ -129,8 +141,14 @@ def main():
     rews_deque=collections.deque(maxlen=100)
     steps_deque=collections.deque(maxlen=100)
     success_deque=collections.deque(maxlen=100)
+    start_episode=0
+    if checkpoint is not None:
+        extra = checkpoints.restore(train_state, checkpoint)
+        start_episode, num_epi, agent.step = extra['step'] + 1, extra['num_epi'], extra['ppo_step']
+        rews_deque, steps_deque, success_deque = \
+            extra['rews_deque'], extra['steps_deque'], extra['success_deque']
 
-    for episode in trange(episodes):
+    for episode in trange(start_episode, episodes):
 
         if args.use_linear_lr_decay:
             # decrease learning rate linearly
@@ -276,12 +294,12 @@ def main():
 
         # save for every interval-th episode or for the last epoch
         if (episode % args.save_interval == 0 or episode == episodes - 1):
-            torch.save({
-                'model': actor_critic
-            },
-                str(save_dir) + "/agent_model_{}".format(episode) + ".pt")
+            checkpoints.save(episode, train_state, num_epi=num_epi, ppo_step=agent.step,
+                             rews_deque=rews_deque, steps_deque=steps_deque,
+                             success_deque=success_deque)
 
 
+    checkpoints.close()
     logger.close()
 
 if __name__ == "__main__":